@@ -0,0 +1,23 @@
+# coding: utf-8
+# Compile OmniDocBench.json once into a prepared GT artifact for end2end evaluation.
+# Set ground_truth.compiled_path in the end2end config to use it; it is ignored if the json changes.
+import argparse
+import sys
+import time
+from dataset.end2end_dataset import End2EndDataset
+from utils.gt_artifact import write_gt_artifact
+
+def process_args(args):
+    parser = argparse.ArgumentParser(description='Compile the end2end ground truth json into a prepared GT artifact.')
+    parser.add_argument('--gt', '-i', type=str, default='./OmniDocBench/OmniDocBench.json')
+    parser.add_argument('--output', '-o', type=str, default=None, help='default: <gt json without .json>.gtc')
+    parameters = parser.parse_args(args)
+    return parameters
+
+if __name__ == '__main__':
+    parameters = process_args(sys.argv[1:])
+    output_path = parameters.output or parameters.gt.rsplit('.json', 1)[0] + '.gtc'
+
+    start = time.time()
+    page_num = write_gt_artifact(parameters.gt, output_path, End2EndDataset.prepare_gt_page)
+    print(f'Compiled {page_num} GT pages from {parameters.gt} into {output_path} in {time.time() - start:.1f}s')
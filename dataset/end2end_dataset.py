@@ -3,21 +3,24 @@ import os
 from collections import defaultdict
 from utils.extract import md_tex_filter
 from utils.match import match_gt2pred_simple, match_gt2pred_no_split
-from utils.match_quick import match_gt2pred_quick
+from utils.match_quick import match_gt2pred_quick, prepare_gt_quick, drop_edit_distance
 # from utils.match_full import match_gt2pred_full, match_gt2pred_textblock_full
-from utils.read_files import read_md_file
-from utils.data_preprocess import normalized_table, clean_string
+from utils.pred_source import PredictionSource
+from utils.match_cache import MatchCache, gt_page_digest
+from utils.gt_artifact import GTArtifact
+from utils.latex_table import LatexTableConverter
+from utils.match_budget import MatchBudget
+from utils.pred_guard import PredictionGuard
+from utils.data_preprocess import normalized_table, normalized_html_table, clean_string, latex_to_unicode
 from registry.registry import DATASET_REGISTRY
 from dataset.recog_dataset import *
 import pdb
 import Levenshtein
 from tqdm import tqdm
-from func_timeout import FunctionTimedOut, func_timeout
 from loguru import logger
 import time
-import sys
-from pylatexenc.latex2text import LatexNodes2Text
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 @DATASET_REGISTRY.register("end2end_dataset")
 class End2EndDataset():
@@ -25,8 +28,49 @@ class End2EndDataset():
         gt_path = cfg_task['dataset']['ground_truth']['data_path']
         pred_folder = cfg_task['dataset']['prediction']['data_path']
         self.match_method = cfg_task['dataset'].get('match_method', 'quick_match')
+        self.num_workers = cfg_task['dataset'].get('num_workers', 1)
+        self.match_time_budget = cfg_task['dataset'].get('match_time_budget', 30)
+        self.match_ops_budget = cfg_task['dataset'].get('match_ops_budget')
+        self.match_status = {}
+        self.sparse_candidates = cfg_task['dataset'].get('sparse_candidates')
+        if self.sparse_candidates is True:
+            self.sparse_candidates = {}
+        elif not self.sparse_candidates:
+            self.sparse_candidates = None
+        prediction_guard = cfg_task['dataset'].get('prediction_guard', False)   # off unless configured, it changes the scores of truncated pages
+        if prediction_guard is True:
+            prediction_guard = {}
+        self.prediction_guard = PredictionGuard(**prediction_guard) if isinstance(prediction_guard, dict) else None
+        match_cache_dir = cfg_task['dataset'].get('match_cache')
+        match_options = {'sparse_candidates': self.sparse_candidates, 'prediction_guard': self.prediction_guard.options() if self.prediction_guard else None}
+        self.match_cache = MatchCache(match_cache_dir, self.match_method, 'end2end', match_options) if match_cache_dir else None
+        self.latex_table_cache = cfg_task['dataset'].get('latex_table_cache')
+        self.latex_table_workers = cfg_task['dataset'].get('latex_table_workers', 1)   # latexmlc processes, separate from the page matching num_workers
+        self.latex_table_fast_path = cfg_task['dataset'].get('latex_table_fast_path', False)
         filtered_types = cfg_task['dataset'].get('filter')
+        self.page_attributes = None
+
+        # Prepared GT pages from compile_gt.py, used only if built from this exact json
+        filtered_gt_samples = None
+        compiled_path = cfg_task['dataset']['ground_truth'].get('compiled_path')
+        if compiled_path and os.path.exists(compiled_path):
+            artifact = GTArtifact(compiled_path)
+            if artifact.is_valid_for(gt_path):
+                selected = [i for i, page in enumerate(artifact.pages) if not filtered_types or all(page['page_attribute'][k] == v for k, v in filtered_types.items())]
+                filtered_gt_samples = artifact.read_pages(selected)
+                for i, gt_page in zip(selected, filtered_gt_samples):
+                    gt_page['gt_digest'] = artifact.pages[i]['gt_digest']
+                self.page_attributes = {page['img_name'][:-4]: page['page_attribute'] for page in artifact.pages}
+                print(f'Loaded {len(filtered_gt_samples)} prepared GT pages from {compiled_path}')
+            else:
+                print(f'!!!WARNING: {compiled_path} was not compiled from the current {gt_path} or is outdated, run compile_gt.py again. The json will be used.')
+
+        if filtered_gt_samples is None:
+            filtered_gt_samples = self.load_gt_samples(gt_path, filtered_types)
 
+        self.samples = self.get_matched_elements(filtered_gt_samples, pred_folder)
+
+    def load_gt_samples(self, gt_path, filtered_types):
         with open(gt_path, 'r') as f:
             gt_samples = json.load(f)
 
@@ -41,8 +85,7 @@ class End2EndDataset():
                     filtered_gt_samples.append(gt_sample)
         else:
             filtered_gt_samples = gt_samples
-
-        self.samples = self.get_matched_elements(filtered_gt_samples, pred_folder)
+        return filtered_gt_samples
      
         
     def __getitem__(self, cat_name, idx):
@@ -50,7 +93,8 @@ class End2EndDataset():
     
 
     # 匹配元素 处理文本截断问题，将截断的文本块合并，并将元素按类别存储在字典中
-    def get_page_elements(self, selected_annos):
+    @staticmethod
+    def get_page_elements(selected_annos):
         
         saved_element_dict = defaultdict(list) #存储元素
         related_truncated = [] #存储需要合并的截断文本块列表
@@ -93,7 +137,8 @@ class End2EndDataset():
         return saved_element_dict
     
     # 根据类别列表 category_list 从 gt_page_elements 中提取元素，并将它们合并到一个列表中
-    def get_page_elements_list(self, gt_page_elements, category_list):
+    @staticmethod
+    def get_page_elements_list(gt_page_elements, category_list):
         element_list = []
         for category_type in category_list:
             if gt_page_elements.get(category_type):
@@ -101,7 +146,8 @@ class End2EndDataset():
         return element_list
 
     # 根据元素的 order 字段对元素列表进行排序，并返回排序后的元素列表。
-    def get_sorted_text_list(self, selected_annos):
+    @staticmethod
+    def get_sorted_text_list(selected_annos):
         # txt_type: text, latex, html
         text_list = []
         for item in selected_annos:
@@ -158,29 +204,27 @@ class End2EndDataset():
         circuit_diagram_match = []
         order_match = []
         save_time = time.time()
-        process_bar = tqdm(gt_samples, ascii=True, ncols=140)
-        for sample in process_bar:
-            img_name = os.path.basename(sample["page_info"]["image_path"])
+        page_jobs = []
+        pred_source = PredictionSource(pred_folder)
+        for sample in gt_samples:
+            img_name = sample['img_name'] if sample.get('prepared') else os.path.basename(sample["page_info"]["image_path"])
             
             # print('Process: ', img_name)
-            pred_path = os.path.join(pred_folder, img_name[:-4] + '.md')
-            if not os.path.exists(pred_path):
-                pred_path = os.path.join(pred_folder, img_name[:-4].replace('.pdf', "") + '.mmd')  # nougat
-                if not os.path.exists(pred_path):
-                    pred_path = os.path.join(pred_folder, img_name[:-4].replace('.pdf', "") + '.md')  # marker
-                    if not os.path.exists(pred_path):
-                        pred_path = os.path.join(pred_folder, img_name + '.md')
-                        if not os.path.exists(pred_path):  # mineru
-                            print(f'!!!WARNING: No prediction for {img_name}')
-                            continue
-
-            process_bar.set_description(f'Processing {os.path.basename(pred_path)}')
-            pred_content = read_md_file(pred_path)
-            
-            # 对单个样本匹配，根据不同的元素类型（如文本块、显示公式、表格等），使用指定的匹配方法将gt与预测结果进行匹配，并返回匹配结果
-            result = self.process_get_matched_elements(sample, pred_content, img_name, save_time) # Don't use timeout logic
-
-            [plain_text_match_clean, formated_display_formula, circuit_diagram_match_s, latex_table_match_s, html_table_match_s, order_match_single] = result
+            pred_name = pred_source.find([img_name[:-4] + '.md',
+                                          img_name[:-4].replace('.pdf', "") + '.mmd',  # nougat
+                                          img_name[:-4].replace('.pdf', "") + '.md',   # marker
+                                          img_name + '.md'])                           # mineru
+            if not pred_name:
+                print(f'!!!WARNING: No prediction for {img_name}')
+                continue
+
+            pred_content = pred_source.read(pred_name)
+            page_jobs.append((sample, pred_content, img_name, pred_name))
+
+        for page_job, result in zip(page_jobs, self.match_pages(page_jobs, save_time)):
+            [plain_text_match_clean, formated_display_formula, circuit_diagram_match_s, latex_table_match_s, html_table_match_s, order_match_single, match_status] = result
+            if match_status['status'] != 'ok':
+                self.match_status[page_job[2]] = match_status
 
             # if img_name == 'docstructbench_dianzishu_zhongwenzaixian-o.O-63674848.pdf_101.jpg':
             #     pdb.set_trace()
@@ -197,6 +241,10 @@ class End2EndDataset():
             if html_table_match_s:
                 html_table_match.extend(html_table_match_s)
 
+        if self.match_status:
+            statuses = [v['status'] for v in self.match_status.values()]
+            print(f"!!!WARNING: {statuses.count('degraded')} pages degraded and {statuses.count('failed')} pages failed in matching (their GT elements are scored as unmatched), see the match_status result file.")
+
         display_formula_match_clean,display_formula_match_others = [],[]
         for item in display_formula_match:
             pred_category_type = item.get("pred_category_type",None)
@@ -206,10 +254,11 @@ class End2EndDataset():
                 gt = item.get('gt',None)
                 norm_gt = item.get('norm_gt',None)
                 ## latex2unicode
-                item['gt'] = LatexNodes2Text().latex_to_text(gt)
+                item['gt'] = latex_to_unicode(gt)
                 # item['norm_gt'] = LatexNodes2Text().latex_to_text(norm_gt)  # 错了，这里的norm gt是跑的normalized_formula函数，所以再跑latex2unicode会报错
                 # 这里的norm_gt应该是跑文本的nrom了
                 item['norm_gt'] = clean_string(item['gt'])
+                drop_edit_distance(item)
                 display_formula_match_others.append(item)
             else:
                 display_formula_match_clean.append(item)
@@ -246,15 +295,106 @@ class End2EndDataset():
             'text_block': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(plain_text_match),
             'display_formula':  DATASET_REGISTRY.get('recogition_end2end_base_dataset')(display_formula_match),
             'circuit_diagram': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(circuit_diagram_match),
-            'table': DATASET_REGISTRY.get('recogition_end2end_table_dataset')(table_match, table_format),
+            'table': DATASET_REGISTRY.get('recogition_end2end_table_dataset')(table_match, table_format, self.latex_table_workers, self.latex_table_cache, self.latex_table_fast_path),
             'reading_order': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(order_match)
         }
       
 
         return matched_samples_all
     
-    #0403 提取gt的table跟pred的table进行匹配 -> 未匹配上的pred_table 去掉html格式然后丢进去混合匹配
+    # 逐页匹配；命中match cache的页直接复用，其余页在num_workers > 1 时用进程池并行，结果按GT顺序返回，与串行结果一致
+    def match_pages(self, page_jobs, save_time):
+        results = [None] * len(page_jobs)
+        page_keys = [None] * len(page_jobs)
+        if self.match_cache:
+            for i, (sample, pred_content, img_name, _) in enumerate(page_jobs):
+                page_keys[i] = self.match_cache.page_key(img_name, sample['gt_digest'] if sample.get('prepared') else gt_page_digest(sample), pred_content)
+                results[i] = self.match_cache.get(page_keys[i])
+        todo = [i for i, result in enumerate(results) if result is None]
+
+        if self.num_workers <= 1 or len(todo) <= 1:
+            process_bar = tqdm(todo, ascii=True, ncols=140)
+            for i in process_bar:
+                sample, pred_content, img_name, pred_name = page_jobs[i]
+                process_bar.set_description(f'Processing {pred_name}')
+                # 对单个样本匹配，根据不同的元素类型（如文本块、显示公式、表格等），使用指定的匹配方法将gt与预测结果进行匹配，并返回匹配结果
+                results[i] = self.process_get_matched_elements(sample, pred_content, img_name, save_time) # Don't use timeout logic
+        else:
+            page_args = [page_jobs[i][:3] + (save_time,) for i in todo]
+            chunksize = max(1, len(page_args) // (self.num_workers * 8))
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                matched = tqdm(executor.map(self.match_single_page, page_args, chunksize=chunksize),
+                               total=len(page_args), ascii=True, ncols=140, desc=f'Matching ({self.num_workers} workers)')
+                for i, result in zip(todo, matched):
+                    results[i] = result
+
+        if self.match_cache:
+            for i in todo:
+                if results[i][-1]['status'] == 'ok':  # degraded / failed pages are matched again next time
+                    self.match_cache.put(page_keys[i], results[i])
+            self.match_cache.report()
+        return results
+
+    def match_single_page(self, page_arg):
+        return self.process_get_matched_elements(*page_arg)
+
+    # GT侧的预处理（截断合并、排序、quick_match的公式拆分与归一化），只依赖GT，可由compile_gt.py预先编译
+    # with_quick: also prepare the quick_match GT lines; compiled pages always have them, so they serve every match method
+    @classmethod
+    def prepare_gt_page(cls, sample, with_quick=True):
+        gt_page_elements = cls.get_page_elements(sample)
+        # circuit_diagram should be included in pred_dataset_mix for matching
+        # for category in gt_page_elements:
+        #     if category not in ['table']:
+        #         gt_mix.extend(gt_page_elements[category])
+        gt_mix = cls.get_page_elements_list(gt_page_elements, ['text_block', 'title', 'code_txt', 'code_txt_caption', 'reference', 'equation_caption',
+                                                'figure_caption', 'figure_footnote', 'table_caption', 'table_footnote', 'code_algorithm', 'code_algorithm_caption',
+                                                'header', 'footer', 'page_footnote', 'page_number', 'equation_isolated', 'circuit_diagram', 'circuit_caption', 'circuit_footnote'])
+        if gt_mix:
+            gt_mix = cls.get_sorted_text_list(gt_mix)
+        gt_table = cls.get_sorted_text_list(gt_page_elements['table']) if gt_page_elements.get('table') else []
+
+        return {
+            'prepared': True,
+            'img_name': os.path.basename(sample["page_info"]["image_path"]),
+            'gt_mix': gt_mix,
+            'gt_table': gt_table,
+            'gt_quick': prepare_gt_quick(gt_mix) if with_quick else None
+        }
+
+    # 单页匹配，失败只影响本页；返回的最后一项为匹配状态：ok / degraded（预算耗尽返回当前最优匹配，或预测被prediction guard截断）/ failed（异常，本页GT按未匹配计分）
     def process_get_matched_elements(self, sample, pred_content, img_name, save_time):
+        truncation = None
+        if self.prediction_guard:
+            pred_content, truncation = self.prediction_guard.guard(pred_content)
+        budget = MatchBudget(self.match_time_budget, self.match_ops_budget)
+        try:
+            result = self.match_page_elements(sample, pred_content, img_name, budget)
+            match_status = {'status': 'degraded', 'reason': budget.reason} if budget.reason else {'status': 'ok'}
+        except Exception as e:
+            print(f'!!!WARNING: Matching failed for {img_name}, its GT elements are scored as unmatched.')
+            print(traceback.format_exc())
+            result = self.unmatched_page_elements(sample, img_name)
+            match_status = {'status': 'failed', 'reason': f'{type(e).__name__}: {e}'}
+            if result is None:
+                result = [[], [], [], [], [], []]
+                match_status['skipped'] = True   # the GT page itself could not be processed
+        if truncation:   # degenerate prediction cut by the prediction guard
+            if match_status['status'] == 'ok':
+                match_status = {'status': 'degraded', 'reason': 'prediction truncated'}
+            match_status['truncation'] = truncation
+        return result + [match_status]
+
+    # 匹配失败的页不能从评测中消失（否则分数反而变高）：GT与空预测匹配，所有GT元素按未匹配计分；GT本身无法处理时返回None
+    def unmatched_page_elements(self, sample, img_name):
+        try:
+            return self.match_page_elements(sample, '', img_name, MatchBudget())
+        except Exception:
+            print(traceback.format_exc())
+            return None
+
+    #0403 提取gt的table跟pred的table进行匹配 -> 未匹配上的pred_table 去掉html格式然后丢进去混合匹配
+    def match_page_elements(self, sample, pred_content, img_name, budget):
         if self.match_method == 'simple_match':   # add match choice
             match_gt2pred = match_gt2pred_simple
         elif self.match_method == 'quick_match':
@@ -264,23 +404,20 @@ class End2EndDataset():
         else:
             print('Invalid match method name. The quick_match will be used.')
             match_gt2pred = match_gt2pred_quick
+        match_kwargs = {'sparse_candidates': self.sparse_candidates, 'budget': budget} if match_gt2pred is match_gt2pred_quick else {'budget': budget}
 
         pred_dataset = md_tex_filter(pred_content)
-        gt_page_elements = self.get_page_elements(sample)
+        budget.exhausted('extraction')
+        gt_page = sample if sample.get('prepared') else self.prepare_gt_page(sample, with_quick=self.match_method not in ['simple_match', 'no_split'])
+        gt_mix = gt_page['gt_mix']
+        if match_gt2pred is match_gt2pred_quick and gt_page['gt_quick'] is not None:
+            match_kwargs['gt_prepared'] = gt_page['gt_quick']
 
-        gt_mix,pred_dataset_mix = [],[]
+        pred_dataset_mix = []
         for category in pred_dataset:
             if category not in ['html_table','latex_table','md2html_table']:
                 pred_dataset_mix.extend(pred_dataset[category])
         # circuit_diagram should be included in pred_dataset_mix for matching
-        # for category in gt_page_elements:
-        #     if category not in ['table']:
-        #         gt_mix.extend(gt_page_elements[category])
-        gt_mix = self.get_page_elements_list(gt_page_elements, ['text_block', 'title', 'code_txt', 'code_txt_caption', 'reference', 'equation_caption',
-                                                'figure_caption', 'figure_footnote', 'table_caption', 'table_footnote', 'code_algorithm', 'code_algorithm_caption',
-                                                'header', 'footer', 'page_footnote', 'page_number', 'equation_isolated', 'circuit_diagram', 'circuit_caption', 'circuit_footnote'])
-        if gt_mix:
-            gt_mix = self.get_sorted_text_list(gt_mix)
 
         display_formula_match_s = []
         plain_text_match_clean = []
@@ -290,8 +427,8 @@ class End2EndDataset():
         order_match_single = []
 
 
-        if gt_page_elements.get('table'):
-            gt_table = self.get_sorted_text_list(gt_page_elements['table'])
+        if gt_page['gt_table']:
+            gt_table = gt_page['gt_table']
             latex_table_len = len(pred_dataset['latex_table']) if pred_dataset['latex_table'] else 0
             html_table_len = len(pred_dataset['html_table']) if pred_dataset['html_table'] else 0
             if latex_table_len == html_table_len and latex_table_len == 0:
@@ -307,15 +444,9 @@ class End2EndDataset():
             if unmatch_table_pred:
                 pred_dataset_mix.extend(unmatch_table_pred)
 
-        try:
-            match = func_timeout(30, match_gt2pred, args=(gt_mix, pred_dataset_mix, 'text_all', img_name))
-        except FunctionTimedOut as e1:
-            # print(f'Time out for plain text match of {img_name}, match_gt2pred_simple will be used.')
-            match,_ = match_gt2pred_simple(gt_mix, pred_dataset_mix, 'text_all', img_name)
-        except Exception as e:
-            # print(str(e))
-            print(traceback.format_exc())
-            sys.exit()  
+        match = match_gt2pred(gt_mix, pred_dataset_mix, 'text_all', img_name, **match_kwargs)
+        if isinstance(match, tuple):  # match_gt2pred_simple also returns the unmatched table preds
+            match = match[0]
         
         
         plain_text_match_s = []
@@ -365,21 +496,28 @@ class RecognitionEnd2EndBaseDataset():
 
 @DATASET_REGISTRY.register("recogition_end2end_table_dataset")
 class RecognitionEnd2EndTableDataset(RecognitionTableDataset):
-    def __init__(self, samples, table_format):
+    def __init__(self, samples, table_format, latex_table_workers=1, latex_table_cache=None, latex_table_fast_path=False):
         self.pred_table_format = table_format
+        self.latex_converter = LatexTableConverter(latex_table_workers, latex_table_cache, fast_path=latex_table_fast_path) if table_format == 'latex' else None
         self.samples = self.normalize_data(samples)
 
     def normalize_data(self, samples):
         img_id = 0
 
-        for sample in samples:
+        if self.latex_converter:
+            pred_html = self.latex_converter.convert_batch([sample['pred'] for sample in samples])
+
+        for idx, sample in enumerate(samples):
             p = sample['pred']
             r = sample['gt']
-            p = normalized_table(p, self.pred_table_format)
+            p = normalized_html_table(pred_html[idx]) if self.latex_converter else normalized_table(p, self.pred_table_format)
             r = normalized_table(r)
             sample['norm_gt'] = r
             sample['norm_pred'] = p
+            drop_edit_distance(sample)
             sample['img_id'] = sample['img_id'] if sample.get('img_id') else img_id
             img_id += 1
 
+        if self.latex_converter:
+            self.latex_converter.report()
         return samples
@@ -6,11 +6,18 @@ from utils.match import match_gt2pred_simple, match_gt2pred_no_split
 from utils.match_quick import match_gt2pred_quick
 # from utils.match_full import match_gt2pred_full, match_gt2pred_textblock_full
 from utils.read_files import read_md_file
+from utils.pred_source import PredictionSource
+from utils.match_cache import MatchCache, gt_page_digest
+from utils.match_budget import MatchBudget
+from utils.pred_guard import PredictionGuard
 from registry.registry import DATASET_REGISTRY
 from dataset.recog_dataset import *
 import pdb
 import Levenshtein
 from tqdm import tqdm
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 @DATASET_REGISTRY.register("md2md_dataset")
 class Md2MdDataset():
@@ -18,6 +25,25 @@ class Md2MdDataset():
         gt_folder = cfg_task['dataset']['ground_truth']['data_path']
         pred_folder = cfg_task['dataset']['prediction']['data_path']
         self.match_method = cfg_task['dataset'].get('match_method', 'simple_match')
+        self.num_workers = cfg_task['dataset'].get('num_workers', 1)
+        self.match_time_budget = cfg_task['dataset'].get('match_time_budget', 30)
+        self.match_ops_budget = cfg_task['dataset'].get('match_ops_budget')
+        self.match_status = {}
+        self.sparse_candidates = cfg_task['dataset'].get('sparse_candidates')
+        if self.sparse_candidates is True:
+            self.sparse_candidates = {}
+        elif not self.sparse_candidates:
+            self.sparse_candidates = None
+        prediction_guard = cfg_task['dataset'].get('prediction_guard', False)   # off unless configured, it changes the scores of truncated pages
+        if prediction_guard is True:
+            prediction_guard = {}
+        self.prediction_guard = PredictionGuard(**prediction_guard) if isinstance(prediction_guard, dict) else None
+        match_cache_dir = cfg_task['dataset'].get('match_cache')
+        match_options = {'sparse_candidates': self.sparse_candidates, 'prediction_guard': self.prediction_guard.options() if self.prediction_guard else None}
+        self.match_cache = MatchCache(match_cache_dir, self.match_method, 'md2md', match_options) if match_cache_dir else None
+        self.latex_table_cache = cfg_task['dataset'].get('latex_table_cache')
+        self.latex_table_workers = cfg_task['dataset'].get('latex_table_workers', 1)   # latexmlc processes, separate from the page matching num_workers
+        self.latex_table_fast_path = cfg_task['dataset'].get('latex_table_fast_path', False)
 
         self.samples = self.get_matched_elements(gt_folder, pred_folder)
         
@@ -44,6 +70,131 @@ class Md2MdDataset():
         else:
             return {}  # If both GT and pred are empty for the page, return empty
 
+    def get_match_function(self, budget=None):
+        if self.match_method == 'simple_match':   # add match choice
+            return partial(match_gt2pred_simple, budget=budget)
+        elif self.match_method == 'quick_match':
+            return partial(match_gt2pred_quick, sparse_candidates=self.sparse_candidates, budget=budget)
+        elif self.match_method == 'no_split':
+            return partial(match_gt2pred_no_split, budget=budget)
+        else:
+            print('Invalid match method name. The quick_match will be used.')
+            return partial(match_gt2pred_quick, sparse_candidates=self.sparse_candidates, budget=budget)
+
+    # Match pages one by one, or in a process pool when num_workers > 1. Pages found in the match cache are reused.
+    # Results keep the page order of the serial path.
+    def match_pages(self, page_jobs):
+        results = [None] * len(page_jobs)
+        page_keys = [None] * len(page_jobs)
+        if self.match_cache:
+            for i, (gt_content, pred_content, img_name) in enumerate(page_jobs):
+                page_keys[i] = self.match_cache.page_key(img_name, gt_page_digest(gt_content), pred_content)
+                results[i] = self.match_cache.get(page_keys[i])
+        todo = [i for i, result in enumerate(results) if result is None]
+
+        if self.num_workers <= 1 or len(todo) <= 1:
+            for i in tqdm(todo):
+                results[i] = self.process_get_matched_elements(*page_jobs[i])
+        else:
+            chunksize = max(1, len(todo) // (self.num_workers * 8))
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                matched = tqdm(executor.map(self.match_single_page, [page_jobs[i] for i in todo], chunksize=chunksize), total=len(todo))
+                for i, result in zip(todo, matched):
+                    results[i] = result
+
+        if self.match_cache:
+            for i in todo:
+                if results[i][-1]['status'] == 'ok':  # degraded / failed pages are matched again next time
+                    self.match_cache.put(page_keys[i], results[i])
+            self.match_cache.report()
+        return results
+
+    def match_single_page(self, page_job):
+        return self.process_get_matched_elements(*page_job)
+
+    # Match one page; a failure only affects this page. The last returned item is the match status:
+    # ok / degraded (budget exhausted, best matching so far is kept, or prediction truncated by the prediction guard) / failed (exception, GT scored as unmatched)
+    def process_get_matched_elements(self, gt_content, pred_content, img_name):
+        truncation = None
+        if self.prediction_guard:
+            pred_content, truncation = self.prediction_guard.guard(pred_content)
+        budget = MatchBudget(self.match_time_budget, self.match_ops_budget)
+        try:
+            result = self.match_page_elements(gt_content, pred_content, img_name, budget)
+            match_status = {'status': 'degraded', 'reason': budget.reason} if budget.reason else {'status': 'ok'}
+        except Exception as e:
+            print(f'!!!WARNING: Matching failed for {img_name}, its GT elements are scored as unmatched.')
+            print(traceback.format_exc())
+            result = self.unmatched_page_elements(gt_content, img_name)
+            match_status = {'status': 'failed', 'reason': f'{type(e).__name__}: {e}'}
+            if result is None:
+                result = ([], [], [], [], [])
+                match_status['skipped'] = True   # the GT page itself could not be processed
+        if truncation:   # degenerate prediction cut by the prediction guard
+            if match_status['status'] == 'ok':
+                match_status = {'status': 'degraded', 'reason': 'prediction truncated'}
+            match_status['truncation'] = truncation
+        return result + (match_status,)
+
+    # A failed page must not drop out of the scores (which would raise them): its GT is matched against an empty prediction,
+    # so every GT element counts as unmatched. Returns None if the GT page itself cannot be processed.
+    def unmatched_page_elements(self, gt_content, img_name):
+        try:
+            return self.match_page_elements(gt_content, '', img_name, MatchBudget())
+        except Exception:
+            print(traceback.format_exc())
+            return None
+
+    def match_page_elements(self, gt_content, pred_content, img_name, budget):
+        match_gt2pred = self.get_match_function(budget)
+
+        gt_dataset = md_tex_filter(gt_content)
+        pred_dataset = md_tex_filter(pred_content)   
+        budget.exhausted('extraction')
+
+        display_formula_match_s = []
+        plain_text_match_clean = []
+        latex_table_match_s = []
+        html_table_match_s = []
+        if gt_dataset['text_all']:
+            plain_text_match_s = match_gt2pred(gt_dataset['text_all'], pred_dataset['text_all'], 'text', img_name)  
+            # No ignore logic for text categories in markdown
+            plain_text_match_clean = plain_text_match_s              
+            
+        # if gt_page_elements.get('title'):
+        #     gt_title_list = self.get_sorted_text_list(gt_page_elements['title'])
+        #     # print('gt_title_list: ', gt_title_list)
+        #     title_match_s = match_gt2pred(gt_title_list, pred_title_list, 'text', img_name)
+        #     title_match.extend(title_match_s)
+            # print('title_match_s: ', title_match_s)
+            # print('-'*10)
+        if gt_dataset.get('equation_isolated'):
+            display_formula_match_s = match_gt2pred(gt_dataset['equation_isolated'], pred_dataset['equation_isolated'], 'formula', img_name)
+            display_formula_match_s = [x for x in display_formula_match_s if x['gt_idx'] != [""] and x['gt_category_type'] != 'equation_inline']  # Remove extra preds since inline formulas are also included for matching, and remove GT that are inline formulas
+        if gt_dataset.get('latex_table') and pred_dataset.get('latex_table'): # By default the model won't randomly output both latex and html, but choose one; Note that table format in GT markdown needs to match Pred
+            # print('gt_table_list', gt_table_list)
+            table_match_s = match_gt2pred(gt_dataset['latex_table'], pred_dataset['latex_table'], 'latex_table', img_name)
+            latex_table_match_s = [x for x in table_match_s if x['gt_idx'] != [""]]  # Remove extra preds
+        elif gt_dataset.get('html_table') and pred_dataset.get('html_table'):   
+            table_match_s = match_gt2pred(gt_dataset['html_table'], pred_dataset['html_table'], 'html_table', img_name)
+            html_table_match_s = [x for x in table_match_s if x['gt_idx'] != [""]]  # Remove extra preds
+            # print('table_match_s: ', table_match_s)
+            # print('-'*10)
+        else:
+            if gt_dataset.get('latex_table') or gt_dataset.get('html_table'):
+                print('GT table is not empty. But pred is empty or its format is different from gt.')
+            if pred_dataset.get('latex_table') or pred_dataset.get('html_table'):
+                print('Pred table is not empty. But gt is empty or its format is different from pred.')
+
+        # Process reading order
+        # order_match_s = []
+        # for mateches in [plain_text_match_clean, display_formula_match_s]:
+        #     if mateches:
+        #         order_match_s.extend(mateches)
+        order_match_s = self.get_order_paired(plain_text_match_clean, img_name)
+
+        return plain_text_match_clean, display_formula_match_s, latex_table_match_s, html_table_match_s, order_match_s
+
     def get_matched_elements(self, gt_folder, pred_folder):
         plain_text_match = []
         display_formula_match = []
@@ -51,81 +202,37 @@ class Md2MdDataset():
         latex_table_match = []
         order_match = []
 
-        for sample_name in tqdm(os.listdir(gt_folder)):
+        page_jobs = []
+        pred_source = PredictionSource(pred_folder)
+        for sample_name in os.listdir(gt_folder):
             if not sample_name.endswith('.md'):
                 continue
             
             img_name = sample_name[:-3] + '.jpg'
 
-            gt_content = read_md_file(os.path.join(gt_folder, sample_name))
-
-            pred_path = os.path.join(pred_folder, sample_name)
-            if not os.path.exists(pred_path):
+            if sample_name not in pred_source:
                 print(f'!!!WARNING: No prediction for {sample_name}')
                 continue
             else:
-                pred_content = read_md_file(pred_path)
-            
-            if self.match_method == 'simple_match':   # add match choice
-                match_gt2pred = match_gt2pred_simple
-                # match_gt2pred_textblock = match_gt2pred_textblock_simple
-            elif self.match_method == 'quick_match':
-                match_gt2pred = match_gt2pred_quick
-                # match_gt2pred_textblock = match_gt2pred_textblock_quick
-            elif self.match_method == 'no_split':
-                match_gt2pred = match_gt2pred_no_split
-            else:
-                print('Invalid match method name. The quick_match will be used.')
-                match_gt2pred = match_gt2pred_quick
-
-            gt_dataset = md_tex_filter(gt_content)
-            pred_dataset = md_tex_filter(pred_content)   
-
-            display_formula_match_s = []
-            plain_text_match_clean = []
-            if gt_dataset['text_all']:
-                plain_text_match_s = match_gt2pred(gt_dataset['text_all'], pred_dataset['text_all'], 'text', img_name)  
-                # No ignore logic for text categories in markdown
-                plain_text_match_clean = plain_text_match_s              
-                plain_text_match.extend(plain_text_match_s)
-                
-            # if gt_page_elements.get('title'):
-            #     gt_title_list = self.get_sorted_text_list(gt_page_elements['title'])
-            #     # print('gt_title_list: ', gt_title_list)
-            #     title_match_s = match_gt2pred(gt_title_list, pred_title_list, 'text', img_name)
-            #     title_match.extend(title_match_s)
-                # print('title_match_s: ', title_match_s)
-                # print('-'*10)
-            if gt_dataset.get('equation_isolated'):
-                display_formula_match_s = match_gt2pred(gt_dataset['equation_isolated'], pred_dataset['equation_isolated'], 'formula', img_name)
-                display_formula_match_s = [x for x in display_formula_match_s if x['gt_idx'] != [""] and x['gt_category_type'] != 'equation_inline']  # Remove extra preds since inline formulas are also included for matching, and remove GT that are inline formulas
-                display_formula_match.extend(display_formula_match_s)
-            if gt_dataset.get('latex_table') and pred_dataset.get('latex_table'): # By default the model won't randomly output both latex and html, but choose one; Note that table format in GT markdown needs to match Pred
-                # print('gt_table_list', gt_table_list)
-                table_match_s = match_gt2pred(gt_dataset['latex_table'], pred_dataset['latex_table'], 'latex_table', img_name)
-                table_match_s = [x for x in table_match_s if x['gt_idx'] != [""]]  # Remove extra preds
-                latex_table_match.extend(table_match_s)
-            elif gt_dataset.get('html_table') and pred_dataset.get('html_table'):   
-                table_match_s = match_gt2pred(gt_dataset['html_table'], pred_dataset['html_table'], 'html_table', img_name)
-                table_match_s = [x for x in table_match_s if x['gt_idx'] != [""]]  # Remove extra preds
-                html_table_match.extend(table_match_s)
-                # print('table_match_s: ', table_match_s)
-                # print('-'*10)
-            else:
-                if gt_dataset.get('latex_table') or gt_dataset.get('html_table'):
-                    print('GT table is not empty. But pred is empty or its format is different from gt.')
-                if pred_dataset.get('latex_table') or pred_dataset.get('html_table'):
-                    print('Pred table is not empty. But gt is empty or its format is different from pred.')
-
-            # Process reading order
-            # order_match_s = []
-            # for mateches in [plain_text_match_clean, display_formula_match_s]:
-            #     if mateches:
-            #         order_match_s.extend(mateches)
-            order_match_s = self.get_order_paired(plain_text_match_clean, img_name)
+                gt_content = read_md_file(os.path.join(gt_folder, sample_name))
+                pred_content = pred_source.read(sample_name)
+            page_jobs.append((gt_content, pred_content, img_name))
+
+        for page_job, result in zip(page_jobs, self.match_pages(page_jobs)):
+            plain_text_match_s, display_formula_match_s, latex_table_match_s, html_table_match_s, order_match_s, match_status = result
+            if match_status['status'] != 'ok':
+                self.match_status[page_job[2]] = match_status
+            plain_text_match.extend(plain_text_match_s)
+            display_formula_match.extend(display_formula_match_s)
+            latex_table_match.extend(latex_table_match_s)
+            html_table_match.extend(html_table_match_s)
             if order_match_s:
                 order_match.append(order_match_s)
 
+        if self.match_status:
+            statuses = [v['status'] for v in self.match_status.values()]
+            print(f"!!!WARNING: {statuses.count('degraded')} pages degraded and {statuses.count('failed')} pages failed in matching (their GT elements are scored as unmatched), see the match_status result file.")
+
         if latex_table_match: # By default the model won't randomly output both latex and html, but choose one
             table_match = latex_table_match
             table_format = 'latex'
@@ -136,7 +243,7 @@ class Md2MdDataset():
         matched_samples_all = {
             'text_block': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(plain_text_match),
             'display_formula':  DATASET_REGISTRY.get('recogition_end2end_base_dataset')(display_formula_match), 
-            'table': DATASET_REGISTRY.get('recogition_end2end_table_dataset')(table_match, table_format),
+            'table': DATASET_REGISTRY.get('recogition_end2end_table_dataset')(table_match, table_format, self.latex_table_workers, self.latex_table_cache, self.latex_table_fast_path),
             'reading_order': DATASET_REGISTRY.get('recogition_end2end_base_dataset')(order_match)
         }
         
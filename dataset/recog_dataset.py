@@ -1,11 +1,38 @@
 import re
+from functools import lru_cache
 from registry.registry import DATASET_REGISTRY
 import json
 import os
 import shutil
 from tqdm import tqdm
 from utils.ocr_utils import get_text_for_block
-from utils.data_preprocess import clean_string, normalized_formula, textblock2unicode, normalized_table
+from utils.data_preprocess import clean_string, normalized_formula, textblock2unicode, normalized_table, normalized_html_table
+from utils.latex_table import LatexTableConverter
+
+
+formula_text_reg = re.compile(r'(\\(operatorname|mathrm|text|mathbf)\s?\*? {.*?})')
+formula_letter = '[a-zA-Z]'
+formula_noletter = '[\W_^\d]'
+formula_space_regs = [
+    re.compile(r'(?!\\ )(%s)\s+?(%s)' % (formula_noletter, formula_noletter)),
+    re.compile(r'(?!\\ )(%s)\s+?(%s)' % (formula_noletter, formula_letter)),
+    re.compile(r'(%s)\s+?(%s)' % (formula_letter, formula_noletter)),
+]
+# Every whitespace removal matches "char, whitespace, char", so no match spans two adjacent non-whitespace characters.
+# The text splits there into independent segments (optional char, whitespace, (char, whitespace)*, optional char),
+# and the fixpoint runs on each segment instead of rescanning the whole formula until nothing changes.
+formula_space_segment_reg = re.compile(r'\S?\s+(?:\S\s+)*\S?')
+
+@lru_cache(maxsize=1<<16)
+def normalize_space_segment(segment):
+    news = segment
+    while True:
+        segment = news
+        for reg in formula_space_regs:
+            news = reg.sub(r'\1\2', news)
+        if news == segment:
+            break
+    return segment
 
 
 @DATASET_REGISTRY.register("recogition_text_dataset")
@@ -130,8 +157,9 @@ class RecognitionFormulaDataset():
         if len(math_preds) != len(math_gts):
             raise ValueError("The number of prediction does not match the number of ground truth.")
 
-        norm_gts = [self.normalize_text(gt) for gt in math_gts]   # Formula normalization
-        norm_preds = [self.normalize_text(pred) for pred in math_preds]
+        norm_cache = {}    # repeated formulas are normalized once
+        norm_gts = [self.normalize_cached(gt, norm_cache) for gt in math_gts]   # Formula normalization
+        norm_preds = [self.normalize_cached(pred, norm_cache) for pred in math_preds]
 
         samples = []
         img_id = 0
@@ -145,22 +173,17 @@ class RecognitionFormulaDataset():
         
         return samples
 
+    def normalize_cached(self, text, norm_cache):
+        if text not in norm_cache:
+            norm_cache[text] = self.normalize_text(text)
+        return norm_cache[text]
+
     def normalize_text(self, text):
         """Remove unnecessary whitespace from LaTeX code."""
-        text_reg = r'(\\(operatorname|mathrm|text|mathbf)\s?\*? {.*?})'
-        letter = '[a-zA-Z]'
-        noletter = '[\W_^\d]'
-        names = [x[0].replace(' ', '') for x in re.findall(text_reg, text)]
-        text = re.sub(text_reg, lambda match: str(names.pop(0)), text)
-        news = text
-        while True:
-            text = news
-            news = re.sub(r'(?!\\ )(%s)\s+?(%s)' % (noletter, noletter), r'\1\2', text)
-            news = re.sub(r'(?!\\ )(%s)\s+?(%s)' % (noletter, letter), r'\1\2', news)
-            news = re.sub(r'(%s)\s+?(%s)' % (letter, noletter), r'\1\2', news)
-            if news == text:
-                break
-        return text
+        text = formula_text_reg.sub(lambda match: match.group(1).replace(' ', ''), text)
+        if not formula_space_segment_reg.search(text):
+            return text
+        return formula_space_segment_reg.sub(lambda match: normalize_space_segment(match.group(0)), text)
     
     def __getitem__(self, idx):
         return self.samples[idx]
@@ -171,6 +194,11 @@ class RecognitionTableDataset():
         gt_file = cfg_task['dataset']['ground_truth']['data_path']
         pred_file = cfg_task['dataset']['prediction']['data_path']
         self.pred_table_format = cfg_task['dataset']['prediction'].get('table_format', 'html')
+        if self.pred_table_format == 'latex':
+            self.latex_converter = LatexTableConverter(cfg_task['dataset'].get('latex_table_workers', 1), cfg_task['dataset'].get('latex_table_cache'),
+                                                       fast_path=cfg_task['dataset'].get('latex_table_fast_path', False))
+        else:
+            self.latex_converter = None
 
         references, predictions = self.load_data(gt_file), self.load_data(pred_file)
         self.samples = self.normalize_data(references, predictions)
@@ -182,7 +210,10 @@ class RecognitionTableDataset():
         samples = []
         ref_keys = list(references.keys())
 
-        for img in tqdm(ref_keys, total=len(ref_keys), ncols=140, ascii=True, desc='Normalizing data'):
+        if self.latex_converter:   # html of every pred, then every GT table, in ref_keys order
+            table_html = self.latex_converter.convert_batch([predictions[img]['latex'] for img in ref_keys] + [references[img]['latex'] for img in ref_keys])
+
+        for idx, img in enumerate(tqdm(ref_keys, total=len(ref_keys), ncols=140, ascii=True, desc='Normalizing data')):
             if self.pred_table_format == 'html':
                 r = references[img]['html']
                 p = predictions[img]['html']
@@ -193,8 +224,12 @@ class RecognitionTableDataset():
                 raise ValueError(f'Invalid table format: {self.pred_table_format}')
 
             img_id = references[img]["page_image_name"]
-            p = normalized_table(p, self.pred_table_format)
-            r = normalized_table(r, self.pred_table_format)
+            if self.latex_converter:
+                p = normalized_html_table(table_html[idx])
+                r = normalized_html_table(table_html[len(ref_keys) + idx])
+            else:
+                p = normalized_table(p, self.pred_table_format)
+                r = normalized_table(r, self.pred_table_format)
             # print('p:', p)
             # print('r:', r)
             samples.append({
@@ -206,6 +241,8 @@ class RecognitionTableDataset():
         
         if self.pred_table_format == 'latex2html':
             shutil.rmtree('./temp')
+        if self.latex_converter:
+            self.latex_converter.report()
         return samples
 
     def __getitem__(self, idx):
@@ -5,14 +5,17 @@ import time
 # from rapidfuzz.distance import Levenshtein
 import Levenshtein
 from .table_metric import TEDS
+from utils.teds_cache import TEDSCache
 import evaluate
 import random
 from utils.read_files import save_paired_result
 from registry.registry import METRIC_REGISTRY
 from collections import defaultdict
+from functools import partial
 import pdb
 import copy
 import pandas as pd
+import numpy as np
 from .cdm_metric import CDM
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
@@ -33,30 +36,83 @@ def get_groups(samples, group_info):
     return group_samples
 
 
+def score_table_pair(pair, **teds_options):
+    # TEDS and TEDS_structure_only of one (pred, gt) pair, the names of the scores that failed and were set to 0,
+    # and whether the scores are approximate (see TEDS approximate_nodes).
+    # Runs in call_TEDS' worker processes, so errors are caught here and stay with their table.
+    pred, gt = pair
+    try:
+        teds = TEDS(structure_only=False, **teds_options)
+        score, score_structure_only = teds.evaluate_with_structure(pred, gt)
+        return score, score_structure_only, [], teds.approximate
+    except:
+        pass
+    # Score each separately, so that one failing score does not zero the other
+    errors = []
+    teds = TEDS(structure_only=False, **teds_options)
+    teds_structure_only = TEDS(structure_only=True, **teds_options)
+    try:
+        score = teds.evaluate(pred, gt)
+    except:
+        score = 0
+        errors.append('TEDS')
+    try:
+        score_structure_only = teds_structure_only.evaluate(pred, gt)
+    except:
+        score_structure_only = 0
+        errors.append('TEDS_structure_only')
+    return score, score_structure_only, errors, teds.approximate or teds_structure_only.approximate
+
+
 @METRIC_REGISTRY.register("TEDS")
 class call_TEDS():
     def __init__(self, samples):
         self.samples = samples
-    def evaluate(self, group_info=[], save_name='default'):
-        teds = TEDS(structure_only=False)
-        teds_structure_only = TEDS(structure_only=True)
+    def evaluate(self, group_info=[], save_name='default', num_workers=1, ted_backend='apted', approximate_nodes=None, cache_dir=None):
+        # num_workers > 1 scores the tables in a process pool; ted_backend is one of table_metric.ted_backends.
+        # Tables with more than approximate_nodes nodes get approximate scores, flagged in per_table_TEDS.json.
+        # cache_dir: reuse the scores of table pairs already scored with the same options (see utils/teds_cache.py)
         group_scores = defaultdict(list)
         group_scores_structure_only = defaultdict(list)
         samples = self.samples
         per_table_score = {}
-        for idx, sample in enumerate(samples):
+        pairs = []
+        for sample in samples:
             gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
             pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
-            try:
-                score = teds.evaluate(pred, gt)
-            except:
-                score = 0
-                print(f'TEDS score error for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to 0.')
-            try:
-                score_structure_only = teds_structure_only.evaluate(pred, gt)
-            except:
-                score_structure_only = 0
-                print(f'TEDS_structure_only score error for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to 0.')
+            pairs.append((pred, gt))
+        teds_options = {'ted_backend': ted_backend, 'approximate_nodes': approximate_nodes}
+        teds_cache = TEDSCache(cache_dir, teds_options) if cache_dir else None
+        pair_scores = [None] * len(pairs)
+        pair_keys = [None] * len(pairs)
+        if teds_cache:
+            for i, (pred, gt) in enumerate(pairs):
+                pair_keys[i] = teds_cache.pair_key(str(pred), str(gt))
+                cached = teds_cache.get(pair_keys[i])
+                if cached is not None:
+                    pair_scores[i] = (cached['TEDS'], cached['TEDS_structure_only'], [], cached['approximate'])
+        todo = [i for i in range(len(pairs)) if pair_scores[i] is None]
+
+        score_pair = partial(score_table_pair, **teds_options)
+        if num_workers <= 1 or len(todo) <= 1:
+            todo_scores = [score_pair(pairs[i]) for i in todo]
+        else:
+            chunksize = max(1, len(todo) // (num_workers * 8))
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                todo_scores = list(executor.map(score_pair, [pairs[i] for i in todo], chunksize=chunksize))
+        for i, (score, score_structure_only, errors, approximate) in zip(todo, todo_scores):
+            pair_scores[i] = (score, score_structure_only, errors, approximate)
+            if teds_cache and not errors:   # failed pairs are scored again next time
+                teds_cache.put(pair_keys[i], {'TEDS': score, 'TEDS_structure_only': score_structure_only, 'approximate': approximate})
+        if teds_cache:
+            teds_cache.report()
+            n_identical = sum(1 for pred, gt in pairs if pred and pred == gt)
+            print(f'TEDS: {n_identical}/{len(pairs)} predicted tables identical to the GT')
+            cache_result = dict(teds_cache.stats(), identical_tables=n_identical)
+        n_approximate = 0
+        for idx, (sample, (score, score_structure_only, errors, approximate)) in enumerate(zip(samples, pair_scores)):
+            for error in errors:
+                print(f'{error} score error for table {sample["gt_idx"]} in {sample["img_id"]}. The score is set to 0.')
             # print('TEDS score:', score)
             group_scores['all'].append(score)
             group_scores_structure_only['all'].append(score_structure_only)
@@ -65,6 +121,9 @@ class call_TEDS():
             sample['metric']['TEDS'] = score
             sample['metric']['TEDS_structure_only'] = score_structure_only
             per_table_score[sample['img_id']+'_'+str(sample.get('gt_idx', idx))] = {'TEDS': score, 'TEDS_structure_only': score_structure_only}
+            if approximate:
+                n_approximate += 1
+                per_table_score[sample['img_id']+'_'+str(sample.get('gt_idx', idx))]['approximate'] = True
             for group in group_info:
                 select_flag = True
                 for k, v in group.items():
@@ -75,6 +134,8 @@ class call_TEDS():
                             select_flag = False
                 if select_flag:
                     group_scores[str(group)].append(score)
+        if n_approximate:
+            print(f'TEDS: {n_approximate} tables with more than {approximate_nodes} nodes were scored approximately (lower bounds)')
         with open(f'./result/{save_name}_per_table_TEDS.json', 'w', encoding='utf-8') as f:
             json.dump(per_table_score, f, indent=4, ensure_ascii=False)
         result = {}
@@ -93,7 +154,10 @@ class call_TEDS():
                 structure_only_result[group_name] = 'NaN'
                 print(f'Warning: Empyty matched samples for {group_name}.')
 
-        return samples, {'TEDS': result, 'TEDS_structure_only': structure_only_result}
+        metric_result = {'TEDS': result, 'TEDS_structure_only': structure_only_result}
+        if teds_cache:   # cache use goes into the run summary (metric_result.json) next to the scores
+            metric_result['TEDS_cache'] = cache_result
+        return samples, metric_result
 
 
 @METRIC_REGISTRY.register("BLEU")
@@ -142,19 +206,32 @@ class call_Edit_dist():
         self.samples = samples
     def evaluate(self, group_info=[], save_name='default'):
         samples = self.samples
+        image_names, edit_nums, upper_lens = [], [], []
         for sample in samples:
             img_name = sample['img_id'] if sample['img_id'].endswith('.jpg') or sample['img_id'].endswith('.png') else '_'.join(sample['img_id'].split('_')[:-1])
             sample['image_name'] = img_name
             gt = sample['norm_gt'] if sample.get('norm_gt') else sample['gt']
             pred = sample['norm_pred'] if sample.get('norm_pred') else sample['pred']
             upper_len = max(len(pred), len(gt))
-            sample['upper_len'] = upper_len
+            edit_pair = sample.pop('edit_pair', None)
             if len(pred) > 0 or len(gt) > 0:
-                edit_dist = Levenshtein.distance(pred, gt)
+                # the quick matcher keeps the distance of the pairs it computed (see record_edit_distance in utils/match_quick.py),
+                # reused only if it was computed from these exact strings; simple_match / no_split pages are always computed here
+                if sample.get('Edit_num') is not None and edit_pair == (gt, pred):
+                    edit_dist = sample['Edit_num']
+                else:
+                    edit_dist = Levenshtein.distance(pred, gt)
+                sample['upper_len'] = upper_len
                 if not sample.get('metric'):
                     sample['metric'] = {}
                 sample['metric']['Edit_dist'] = edit_dist / upper_len
                 sample['Edit_num'] = edit_dist
+                edit_nums.append(edit_dist)
+            else:
+                sample['upper_len'] = upper_len
+                edit_nums.append(np.nan)
+            image_names.append(img_name)
+            upper_lens.append(upper_len)
 
         if isinstance(samples, list):
             saved_samples = samples
@@ -167,9 +244,15 @@ class call_Edit_dist():
                 json.dump({}, f, indent=4, ensure_ascii=False)
             return samples, {'Edit_dist': {'ALL_page_avg': 'NaN'}}
 
-        df = pd.DataFrame(saved_samples)
-        up_total_avg = df.groupby("image_name").apply(lambda x: x['Edit_num'].sum() / x['upper_len'].sum()) # page level, sum of edits divided by sum of max(gt,pred) lengths for each sample
-        all_total_avg = df['Edit_num'].sum() / df['upper_len'].sum()
+        # Page sums with np.bincount over the page codes (pages sorted by name, as groupby does); samples without text have no Edit_num
+        edit_nums = np.array(edit_nums, dtype=np.float64)
+        upper_lens = np.array(upper_lens, dtype=np.float64)
+        page_names, page_codes = np.unique(np.array(image_names, dtype=object), return_inverse=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            page_avg = np.bincount(page_codes, weights=np.nan_to_num(edit_nums), minlength=len(page_names)) / \
+                       np.bincount(page_codes, weights=upper_lens, minlength=len(page_names))
+        up_total_avg = pd.Series(page_avg, index=page_names) # page level, sum of edits divided by sum of max(gt,pred) lengths for each sample
+        all_total_avg = np.nansum(edit_nums) / upper_lens.sum()
         # all_total_avg = df["Edit_dist"].mean()
         per_img_score = up_total_avg.to_dict()
         with open(f'./result/{save_name}_per_page_edit.json', 'w', encoding='utf-8') as f:
@@ -180,9 +263,9 @@ class call_Edit_dist():
         # else:
         #     return samples, {'Edit_dist': {'ALL_page_avg': up_total_avg.mean()}}
         
-        edit_whole = df['Edit_num'].sum() / df['upper_len'].sum()
-        df['ratio'] = df['Edit_num'] / df['upper_len']
-        edit_sample_avg = df['ratio'].mean()
+        edit_whole = all_total_avg
+        with np.errstate(invalid='ignore', divide='ignore'):
+            edit_sample_avg = pd.Series(edit_nums / upper_lens).mean()
         # edit_sample_avg = df['metric']['Edit_dist'].mean()
         return samples, {'Edit_dist': {'ALL_page_avg': up_total_avg.mean(), 'edit_whole': edit_whole, 'edit_sample_avg': edit_sample_avg}}
     
@@ -15,6 +15,9 @@ from apted import APTED, Config
 from apted.helpers import Tree
 from lxml import etree, html
 from collections import deque
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein as rf_Levenshtein
 # from parallel import parallel_process
 from tqdm import tqdm
 
@@ -60,11 +63,259 @@ class CustomConfig(Config):
         return 0.
 
 
+def structure_only_tree(tree):
+    ''' The tree load_html_tree gives with structure_only=True: same nodes, no cell content
+    '''
+    content = [] if tree.tag == 'td' else None
+    return TableTree(tree.tag, tree.colspan, tree.rowspan, content, *[structure_only_tree(child) for child in tree.children])
+
+
+def postorder_tree(tree, config):
+    ''' Postorder node list of a tree and the postorder index of the leftmost leaf of every node
+    '''
+    nodes, leftmost = [], []
+    stack = [(tree, None)]
+    while stack:
+        node, first = stack.pop()
+        if first is None:
+            # the leftmost leaf is the first node of the subtree in postorder
+            stack.append((node, len(nodes)))
+            stack.extend((child, None) for child in reversed(config.children(node)))
+        else:
+            leftmost.append(first)
+            nodes.append(node)
+    return nodes, leftmost
+
+
+def keyroots(leftmost):
+    # The highest node of each leftmost leaf, in postorder
+    highest = {}
+    for i, l in enumerate(leftmost):
+        highest[l] = i
+    return sorted(highest.values())
+
+
+def zhang_shasha_distance(tree1, tree2, config):
+    ''' Exact (minimum) tree edit distance with the Zhang-Shasha algorithm on postorder arrays, with the costs of config.
+        Rename costs are computed once per pair of distinct node labels. It agrees with apted except on rare trees where
+        apted returns a distance above the optimum (see tests/test_table_metric.py), so scores can differ slightly there
+    '''
+    nodes1, lmd1 = postorder_tree(tree1, config)
+    nodes2, lmd2 = postorder_tree(tree2, config)
+    n1, n2 = len(nodes1), len(nodes2)
+    keyroots1, keyroots2 = keyroots(lmd1), keyroots(lmd2)
+    delete = [config.delete(node) for node in nodes1]
+    insert = [config.insert(node) for node in nodes2]
+
+    # Nodes with the same label share their rename costs
+    labels = {}
+    def label_id(node):
+        content = tuple(node.content) if node.content is not None else None
+        return labels.setdefault((node.tag, node.colspan, node.rowspan, content), len(labels))
+    label1 = [label_id(node) for node in nodes1]
+    label2 = [label_id(node) for node in nodes2]
+    rename_cache = {}
+
+    # Per keyroot of tree2: (column, node, column of its leftmost leaf, insert cost) of the nodes of its subtree
+    columns2 = {k2: [(j, l2 + j - 1, lmd2[l2+j-1] - l2, insert[l2+j-1]) for j in range(1, k2 - lmd2[k2] + 2)]
+                for k2, l2 in ((k2, lmd2[k2]) for k2 in keyroots2)}
+    first_row2 = {k2: [0] + [sum(insert[lmd2[k2]:lmd2[k2]+j]) for j in range(1, k2 - lmd2[k2] + 2)] for k2 in keyroots2}
+
+    treedist = [[0] * n2 for _ in range(n1)]
+    for k1 in keyroots1:
+        l1 = lmd1[k1]
+        for k2 in keyroots2:
+            columns = columns2[k2]
+            forestdist = [first_row2[k2]]
+            for x in range(l1, k1 + 1):
+                prev = forestdist[-1]
+                cost_delete = delete[x]
+                left = prev[0] + cost_delete
+                row = [left]
+                tree_x = treedist[x]
+                base = forestdist[lmd1[x] - l1]
+                if lmd1[x] == l1:
+                    for j, y, q, cost_insert in columns:
+                        distance = prev[j] + cost_delete
+                        if left + cost_insert < distance:
+                            distance = left + cost_insert
+                        if q == 0:
+                            # x and y on the leftmost paths: the distance of their subtrees, kept in treedist
+                            key = (label1[x], label2[y])
+                            cost_rename = rename_cache.get(key)
+                            if cost_rename is None:
+                                cost_rename = rename_cache[key] = config.rename(nodes1[x], nodes2[y])
+                            if prev[j-1] + cost_rename < distance:
+                                distance = prev[j-1] + cost_rename
+                            tree_x[y] = distance
+                        elif base[q] + tree_x[y] < distance:
+                            distance = base[q] + tree_x[y]
+                        row.append(distance)
+                        left = distance
+                else:
+                    for j, y, q, cost_insert in columns:
+                        distance = prev[j] + cost_delete
+                        if left + cost_insert < distance:
+                            distance = left + cost_insert
+                        if base[q] + tree_x[y] < distance:
+                            distance = base[q] + tree_x[y]
+                        row.append(distance)
+                        left = distance
+                forestdist.append(row)
+    return treedist[n1-1][n2-1]
+
+
+def apted_distance(tree1, tree2, config):
+    return APTED(tree1, tree2, config).compute_edit_distance()
+
+
+# Tree edit distance backends of TEDS: name -> function(tree1, tree2, config) returning the tree edit distance
+# (zhang_shasha is always the minimum; apted is the default, for scores comparable with earlier runs)
+ted_backends = {
+    'apted': apted_distance,
+    'zhang_shasha': zhang_shasha_distance,
+}
+
+
+def tree_size(tree):
+    return 1 + sum(tree_size(child) for child in tree.children)
+
+
+def split_table_tree(tree):
+    ''' The rows under the root as (tr node, cells), and the number of other nodes below the root.
+        Runs of cells outside any tr (broken predictions) become rows with node None
+    '''
+    rows, n_other = [], 0
+    stack = list(reversed(tree.children))
+    while stack:
+        node = stack.pop()
+        if node.tag == 'tr':
+            rows.append((node, node.children))
+        elif node.tag != 'td' and node.children:
+            n_other += 1
+            stack.extend(reversed(node.children))
+        elif rows and rows[-1][0] is None:
+            rows[-1][1].append(node)
+        else:
+            rows.append((None, [node]))
+    return rows, n_other
+
+
+def row_signature(cells):
+    # Cell structure and text of a row, to align rows cheaply
+    return '|'.join(f"{cell.tag}{cell.colspan}x{cell.rowspan}:{''.join(cell.content or [])}" for cell in cells)
+
+
+def row_rename(node1, node2, config):
+    # A row without tr node maps to a tr node by deleting / inserting that node
+    if node1 is None or node2 is None:
+        return int(node1 is not node2)
+    return config.rename(node1, node2)
+
+
+def align_sequences(sizes1, sizes2, substitute):
+    ''' Edit-distance alignment of two sequences, where deleting / inserting an item costs its size and
+        substitute(i, j) is the cost of mapping item i to item j. Returns the aligned (i, j) pairs
+    '''
+    n1, n2 = len(sizes1), len(sizes2)
+    table = [[0] * (n2 + 1) for _ in range(n1 + 1)]
+    for j in range(1, n2 + 1):
+        table[0][j] = table[0][j-1] + sizes2[j-1]
+    for i in range(1, n1 + 1):
+        prev, row = table[i-1], table[i]
+        row[0] = prev[0] + sizes1[i-1]
+        for j in range(1, n2 + 1):
+            row[j] = min(prev[j] + sizes1[i-1], row[j-1] + sizes2[j-1], prev[j-1] + substitute(i-1, j-1))
+    pairs = []
+    i, j = n1, n2
+    while i > 0 and j > 0:
+        if table[i][j] == table[i-1][j-1] + substitute(i-1, j-1):
+            pairs.append((i-1, j-1))
+            i, j = i - 1, j - 1
+        elif table[i][j] == table[i-1][j] + sizes1[i-1]:
+            i -= 1
+        else:
+            j -= 1
+    return pairs[::-1]
+
+
+# Above this many pairs, rows (or the cells of two aligned rows) are paired by position instead of aligned
+max_alignment_pairs = 250000
+
+def approximate_distance(tree1, tree2, config):
+    ''' Cost of an edit script restricted to row-to-row and cell-to-cell mappings, so an upper bound of the
+        exact tree edit distance (TEDS computed from it is a lower bound). Rows are aligned first on a
+        cheap signature, then the cells of every aligned row pair; other nodes under the roots are deleted
+        and inserted. For tables too large for the exact backends: alignments above max_alignment_pairs
+        pairs fall back to pairing by position, so the time stays bounded
+    '''
+    rows1, n_other1 = split_table_tree(tree1)
+    rows2, n_other2 = split_table_tree(tree2)
+    row_sizes1 = [(node is not None) + sum(tree_size(cell) for cell in cells) for node, cells in rows1]
+    row_sizes2 = [(node is not None) + sum(tree_size(cell) for cell in cells) for node, cells in rows2]
+    if len(rows1) * len(rows2) > max_alignment_pairs:
+        pairs = list(zip(range(len(rows1)), range(len(rows2))))
+    elif rows1 and rows2:
+        signature_distance = process.cdist([row_signature(cells) for _, cells in rows1], [row_signature(cells) for _, cells in rows2],
+                                           scorer=rf_Levenshtein.normalized_distance, dtype=np.float64)
+        pairs = align_sequences(row_sizes1, row_sizes2,
+                                lambda i, j: signature_distance[i, j] * max(row_sizes1[i], row_sizes2[j]))
+    else:
+        pairs = []
+    distance = config.rename(tree1, tree2) + n_other1 + n_other2 + sum(row_sizes1) + sum(row_sizes2)
+    for i, j in pairs:
+        (node1, cells1), (node2, cells2) = rows1[i], rows2[j]
+        distance += row_rename(node1, node2, config) + cells_distance(cells1, cells2, config) - row_sizes1[i] - row_sizes2[j]
+    return distance
+
+
+def cells_distance(cells1, cells2, config):
+    sizes1 = [tree_size(cell) for cell in cells1]
+    sizes2 = [tree_size(cell) for cell in cells2]
+    cache = {}
+    def substitute(i, j):
+        if (i, j) not in cache:
+            if cells1[i].children or cells2[j].children:
+                cache[i, j] = zhang_shasha_distance(cells1[i], cells2[j], config)
+            else:
+                cache[i, j] = config.rename(cells1[i], cells2[j])
+        return cache[i, j]
+    if len(cells1) * len(cells2) > max_alignment_pairs:
+        pairs = list(zip(range(len(cells1)), range(len(cells2))))
+    else:
+        pairs = align_sequences(sizes1, sizes2, substitute)
+    return sum(sizes1) + sum(sizes2) + sum(substitute(i, j) - sizes1[i] - sizes2[j] for i, j in pairs)
+
+
+def tree_similarity(tree_pred, tree_true, n_nodes, ted_backend='apted', approximate=False):
+    if approximate:
+        distance = approximate_distance(tree_pred, tree_true, CustomConfig())
+    else:
+        distance = ted_backends[ted_backend](tree_pred, tree_true, CustomConfig())
+    return 1.0 - (float(distance) / n_nodes)
+
+
+def parse_html_table(table_html):
+    ''' Parses a normalized html table and returns its body/table element, or None
+    '''
+    parser = html.HTMLParser(remove_comments=True, encoding='utf-8')
+    root = html.fromstring(table_html, parser=parser)
+    tables = root.xpath('body/table')
+    return tables[0] if tables else None
+
+
 class TEDS(object):
     ''' Tree Edit Distance basead Similarity
     '''
-    def __init__(self, structure_only=False, n_jobs=1, ignore_nodes=None):
+    def __init__(self, structure_only=False, n_jobs=1, ignore_nodes=None, ted_backend='apted', approximate_nodes=None):
+        ''' approximate_nodes: tables with more nodes than this are scored with approximate_distance
+            (a lower bound of TEDS); self.approximate tells whether the last evaluation was
+        '''
         assert isinstance(n_jobs, int) and (n_jobs >= 1), 'n_jobs must be an integer greather than 1'
+        assert ted_backend in ted_backends, f'ted_backend must be one of {list(ted_backends)}'
+        self.ted_backend = ted_backend
+        self.approximate_nodes = approximate_nodes
+        self.approximate = False
         self.structure_only = structure_only
         self.n_jobs = n_jobs
         self.ignore_nodes = ignore_nodes
@@ -112,14 +363,12 @@ class TEDS(object):
         ''' Computes TEDS score between the prediction and the ground truth of a
             given sample
         '''
+        self.approximate = False
         if (not pred) or (not true):
             return 0.0
-        parser = html.HTMLParser(remove_comments=True, encoding='utf-8')
-        pred = html.fromstring(pred, parser=parser)
-        true = html.fromstring(true, parser=parser)
-        if pred.xpath('body/table') and true.xpath('body/table'):
-            pred = pred.xpath('body/table')[0]
-            true = true.xpath('body/table')[0]
+        pred = parse_html_table(pred)
+        true = parse_html_table(true)
+        if pred is not None and true is not None:
             if self.ignore_nodes:
                 etree.strip_tags(pred, *self.ignore_nodes)
                 etree.strip_tags(true, *self.ignore_nodes)
@@ -128,11 +377,41 @@ class TEDS(object):
             n_nodes = max(n_nodes_pred, n_nodes_true)
             tree_pred = self.load_html_tree(pred)
             tree_true = self.load_html_tree(true)
-            distance = APTED(tree_pred, tree_true, CustomConfig()).compute_edit_distance()
-            return 1.0 - (float(distance) / n_nodes)
+            self.approximate = self.approximate_nodes is not None and n_nodes > self.approximate_nodes
+            return tree_similarity(tree_pred, tree_true, n_nodes, self.ted_backend, self.approximate)
         else:
             return 0.0
 
+    def evaluate_with_structure(self, pred, true):
+        ''' Computes (TEDS, TEDS structure only) of a sample, building one tree per
+            table for both scores. Only for structure_only=False instances
+        '''
+        self.approximate = False
+        if (not pred) or (not true):
+            return 0.0, 0.0
+        if pred == true:
+            # Identical tables are at distance 0: one parse tells whether the table is valid and not empty
+            table = parse_html_table(pred)
+            if table is None:
+                return 0.0, 0.0
+            if self.ignore_nodes:
+                etree.strip_tags(table, *self.ignore_nodes)
+            if len(table.xpath(".//*")):
+                return 1.0, 1.0
+        pred = parse_html_table(pred)
+        true = parse_html_table(true)
+        if pred is None or true is None:
+            return 0.0, 0.0
+        if self.ignore_nodes:
+            etree.strip_tags(pred, *self.ignore_nodes)
+            etree.strip_tags(true, *self.ignore_nodes)
+        n_nodes = max(len(pred.xpath(".//*")), len(true.xpath(".//*")))
+        tree_pred = self.load_html_tree(pred)
+        tree_true = self.load_html_tree(true)
+        self.approximate = self.approximate_nodes is not None and n_nodes > self.approximate_nodes
+        return (tree_similarity(tree_pred, tree_true, n_nodes, self.ted_backend, self.approximate),
+                tree_similarity(structure_only_tree(tree_pred), structure_only_tree(tree_true), n_nodes, self.ted_backend, self.approximate))
+
     def batch_evaluate(self, pred_json, true_json):
         ''' Computes TEDS score between the prediction and the ground truth of
             a batch of samples
@@ -42,14 +42,18 @@ if __name__ == '__main__':
         # --- Dynamic Path Logic ---
         prediction_path = cfg[task_name]['dataset']['prediction'].get('data_path', '')
         # Extracts 'sr' from 'output/sr'
-        mode_name = os.path.basename(prediction_path) if prediction_path else "default"
+        mode_name = os.path.basename(prediction_path.rstrip('/')) if prediction_path else "default"
+        for ext in ['.tar.gz', '.tgz', '.tar', '.zip', '.jsonl']:  # prediction archives / bundles
+            if mode_name.endswith(ext):
+                mode_name = mode_name[:-len(ext)]
+                break
         
         # Define and create output directory: result/{mode}/
         output_dir = os.path.join("result", mode_name)
         os.makedirs(output_dir, exist_ok=True)
 
         if prediction_path:
-            base_name = os.path.basename(prediction_path) + '_' + cfg[task_name]['dataset'].get('match_method', 'quick_match')
+            base_name = mode_name + '_' + cfg[task_name]['dataset'].get('match_method', 'quick_match')
         else:
             base_name = os.path.basename(cfg[task_name]['dataset']['ground_truth']['data_path']).split('.')[0]
         
@@ -15,7 +15,9 @@ class End2EndEval():
             md_flag = True
         else:
             md_flag = False
-        if not md_flag:
+        if not md_flag and getattr(dataset, 'page_attributes', None):  # from the compiled GT artifact
+            page_info = dataset.page_attributes
+        elif not md_flag:
             with open(page_info_path, 'r') as f:
                 pages = json.load(f)
             
@@ -27,9 +29,10 @@ class End2EndEval():
             result = {}
             group_info = metrics_list[element].get('group', [])
             samples = dataset.samples[element]
+            metric_options = metrics_list[element].get('metric_options', {})   # extra evaluate() arguments per metric
             for metric in metrics_list[element]['metric']:
                 metric_val = METRIC_REGISTRY.get(metric)
-                samples, result_s = metric_val(samples).evaluate(group_info, f"{save_name}_{element}")
+                samples, result_s = metric_val(samples).evaluate(group_info, f"{save_name}_{element}", **metric_options.get(metric, {}))
                 if result_s:
                     result.update(result_s)
             if result:
@@ -83,6 +86,19 @@ class End2EndEval():
                 find_non_serializable(saved_samples)
 
 
+        # Pages whose matching was degraded (budget exhausted) or failed
+        match_status = getattr(dataset, 'match_status', None)
+        # Predictions truncated by the prediction guard, so that the scores of guarded runs can be audited
+        prediction_guard = getattr(dataset, 'prediction_guard', None)
+        if prediction_guard:
+            result_all['prediction_guard'] = {
+                'options': prediction_guard.options(),
+                'truncated_pages': {img_name: status['truncation'] for img_name, status in (match_status or {}).items() if status.get('truncation')}
+            }
+
         with open(f'./result/{save_name}_metric_result.json', 'w', encoding='utf-8') as f:
             json.dump(result_all, f, indent=4, ensure_ascii=False)
-    
\ No newline at end of file
+    
+        if match_status:
+            with open(f'./result/{save_name}_match_status.json', 'w', encoding='utf-8') as f:
+                json.dump(match_status, f, indent=4, ensure_ascii=False)
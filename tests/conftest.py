@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The tests import the repo modules the way main.py / pdf_validation.py do, from the repo root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
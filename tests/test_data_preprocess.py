@@ -0,0 +1,85 @@
+import glob
+import json
+import os
+import random
+
+import pytest
+from pylatexenc.latex2text import LatexNodes2Text
+
+from tools.bench_normalized_formula import previous_normalized_formula
+from utils.data_preprocess import (FAST_LATEX_MACRO_NAMES, delimited_finditer, fast_latex_macros, formula_filter_list, inline_delimiters, inline_reg,
+                                   latex_to_unicode, latex_to_unicode_fast, normalized_formula)
+from utils.extract import md_tex_filter
+
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo_data')
+
+
+def demo_formulas():
+    # Display formulas and the inline formulas of text, as the pipeline finds them in the demo GT and predictions
+    with open(os.path.join(DEMO_DIR, 'omnidocbench_demo', 'OmniDocBench_demo.json'), 'r', encoding='utf-8') as f:
+        pages = json.load(f)
+    texts = [item['text'] for page in pages for item in page['layout_dets'] if item.get('text')]
+    formulas = [item['latex'].strip('$').strip() for page in pages for item in page['layout_dets']
+                if item['category_type'] == 'equation_isolated' and item.get('latex')]
+    for path in sorted(glob.glob(os.path.join(DEMO_DIR, 'end2end', '*.md'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            pred_dataset = md_tex_filter(f.read())
+        texts += [item['content'] for item in pred_dataset['text_all']]
+        formulas += [item['content'].strip('$').strip() for item in pred_dataset['equation_isolated']]
+    for text in texts:
+        for match in delimited_finditer(inline_reg, text, inline_delimiters, dotall=False):
+            formulas.append(match.group(1) if match.group(1) is not None else match.group(2))
+    return sorted(set(formulas))
+
+
+def macro_formulas():
+    formulas = []
+    for name in FAST_LATEX_MACRO_NAMES:
+        formulas += [f'\\{name}', f'\\{name} x', f'\\{name}  x', f'\\{name}{{}}x', f'a^{{\\{name}}}_2', f'({name}) \\{name}\\{name}', f'x_{{\\{name}}}+1']
+    return formulas
+
+
+@pytest.fixture(scope='module')
+def converter():
+    return LatexNodes2Text()
+
+
+def test_fast_latex_macros_are_single_replacements(converter):
+    macros = fast_latex_macros()
+    assert macros
+    for name, value in macros.items():
+        assert converter.latex_to_text('\\' + name) == value
+
+
+@pytest.mark.parametrize('formula', macro_formulas())
+def test_latex_to_unicode_fast_macros(converter, formula):
+    fast = latex_to_unicode_fast(formula)
+    if fast is not None:
+        assert fast == converter.latex_to_text(formula)
+    assert latex_to_unicode(formula) == converter.latex_to_text(formula)
+
+
+def test_latex_to_unicode_demo(converter):
+    formulas = demo_formulas()
+    assert formulas
+    fast_count = 0
+    for formula in formulas:
+        expected = converter.latex_to_text(formula)
+        assert latex_to_unicode(formula) == expected, formula
+        if latex_to_unicode_fast(formula) is not None:
+            fast_count += 1
+    assert fast_count > 0   # the demo formulas exercise the fast path too
+
+
+def random_formulas(rng, count):
+    # Formulas glued from the pieces normalized_formula looks for, so that removals interact (e.g. \te\bmxt)
+    pieces = formula_filter_list + ['\\tag{1}', '\\hspace{2pt}', '\\begin{array}{l}', '\\end{array}', '\\arraycolsep=1pt}', '\\[', '\\]',
+                                    '$', '.', '\n', '{', '}', '\\', 'te', 'xt', 'x', 'A', '=', '\\frac{a}{b}', '\\tag{', '\\begin{']
+    return [''.join(rng.choice(pieces) for _ in range(rng.randint(0, 12))) for _ in range(count)]
+
+
+def test_normalized_formula_matches_previous():
+    formulas = demo_formulas() + random_formulas(random.Random(0), 20000)
+    for formula in formulas:
+        assert normalized_formula(formula) == previous_normalized_formula(formula), formula
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from utils.disk_cache import DiskCache, content_key
+from utils.latex_table import LatexTableConverter
+
+
+def test_content_key_separates_parts():
+    assert content_key('ab', 'c') != content_key('a', 'bc')
+    assert content_key('ab', 'c') == content_key('ab', 'c')
+
+
+@pytest.mark.parametrize('entry_format, value', [
+    ('pickle', [{'img_id': 'page.jpg', 'edit': 0.5}]),
+    ('json', {'TEDS': 0.75, 'TEDS_structure_only': 1.0, 'approximate': False}),
+    ('html', '<table><tr><td>ä</td></tr></table>'),
+])
+def test_entries_round_trip(tmp_path, entry_format, value):
+    key = content_key('1', entry_format)
+    DiskCache(str(tmp_path), entry_format).put(key, value)
+    cache = DiskCache(str(tmp_path), entry_format)
+    assert cache.get(key) == value
+    assert cache.get(content_key('2', entry_format)) is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith('.tmp')]
+
+
+def test_broken_entry_is_a_miss(tmp_path):
+    cache = DiskCache(str(tmp_path), 'json')
+    key = content_key('broken')
+    os.makedirs(os.path.dirname(cache.cache_path(key)))
+    with open(cache.cache_path(key), 'w') as f:
+        f.write('{"TEDS": ')
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_latex_table_converter_reuses_disk_entries(tmp_path):
+    latex = '\\begin{tabular}{c}\na \\\\\n\\end{tabular}'
+    converter = LatexTableConverter(cache_dir=str(tmp_path))
+    key = converter.cache_key(latex)
+    converter.store(key, '<table><tr><td>a</td></tr></table>')
+    converter = LatexTableConverter(cache_dir=str(tmp_path))
+    assert converter.convert(latex) == '<table><tr><td>a</td></tr></table>'
+    assert converter.path_counts == {'disk cache': 1}
@@ -0,0 +1,56 @@
+import glob
+import json
+import os
+
+import pytest
+
+from utils.extract import extract_html_table, extract_tabular, md_tex_filter
+
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo_data')
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'md_tex_filter_demo.json')
+
+
+def demo_pages():
+    # GT markdown and predictions of the demo pages, keyed by their path under demo_data
+    paths = sorted(glob.glob(os.path.join(DEMO_DIR, 'end2end', '*.md')) + glob.glob(os.path.join(DEMO_DIR, 'omnidocbench_demo', 'mds', '*.md')))
+    return [os.path.relpath(path, DEMO_DIR).replace(os.sep, '/') for path in paths]
+
+
+def extracted_items(page):
+    with open(os.path.join(DEMO_DIR, page), 'r', encoding='utf-8') as f:
+        pred_dataset = md_tex_filter(f.read())
+    return {category: [{'category_type': item['category_type'], 'position': list(item['position']), 'content': item['content']} for item in items]
+            for category, items in pred_dataset.items()}
+
+
+@pytest.fixture(scope='module')
+def golden():
+    with open(GOLDEN_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_golden_covers_demo_pages(golden):
+    assert sorted(golden) == demo_pages()
+
+
+@pytest.mark.parametrize('page', demo_pages())
+def test_md_tex_filter_demo(golden, page):
+    assert extracted_items(page) == golden[page]
+
+
+def test_unclosed_tags_are_linear():
+    # One unclosed tag per repetition used to cost a rescan (and a recursion level) each
+    text = 'text <table> more words here ' * 1500
+    assert extract_html_table(text) == ([], [])
+    assert extract_tabular('x \\begin{tabular} y ' * 1500) == ([], [])
+    md_tex_filter(text)
+
+
+def test_pairs_after_an_unclosed_begin():
+    text = 'a <table> b <table><tr><td>1</td></tr></table> c <table><tr><td>2</td></tr></table>'
+    tables, positions = extract_html_table(text)
+    assert tables == ['<table><tr><td>1</td></tr></table>', '<table><tr><td>2</td></tr></table>']
+    assert [text[start:end] for start, end in positions] == tables
+    nested = '\\begin{tabular}{c} \\begin{tabular}{c} x \\end{tabular} \\end{tabular}'
+    assert extract_tabular(nested)[0] == [nested]
@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from dataset.end2end_dataset import End2EndDataset
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GT_PATH = os.path.join(REPO_DIR, 'demo_data', 'omnidocbench_demo', 'OmniDocBench_demo.json')
+
+
+def element_samples(dataset):
+    return {element: [(sample['img_id'], sample['gt'], sample['pred']) for sample in dataset.samples[element].samples]
+            for element in ['text_block', 'display_formula', 'table', 'reading_order']}
+
+
+@pytest.mark.parametrize('match_method', ['quick_match', 'simple_match'])
+def test_compiled_gt_matches_the_json(tmp_path, match_method):
+    artifact_path = str(tmp_path / 'demo.gtc')
+    subprocess.run([sys.executable, 'compile_gt.py', '--gt', GT_PATH, '--output', artifact_path], cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL)
+    cfg = {'dataset': {'ground_truth': {'data_path': GT_PATH}, 'prediction': {'data_path': os.path.join(REPO_DIR, 'demo_data', 'end2end')},
+                       'match_method': match_method}}
+    from_json = End2EndDataset(cfg)
+    cfg['dataset']['ground_truth']['compiled_path'] = artifact_path
+    compiled = End2EndDataset(cfg)
+    assert element_samples(compiled) == element_samples(from_json)
@@ -0,0 +1,50 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from utils.data_preprocess import normalized_html_table
+from utils.latex_table import LatexTableConverter, tabular_to_html
+
+FIXTURES = json.load(open(os.path.join(os.path.dirname(__file__), 'data', 'latex_table_fixtures.json'), encoding='utf-8'))
+
+
+@pytest.mark.parametrize('name', sorted(FIXTURES))
+def test_fast_path_matches_latexmlc(name):
+    fixture = FIXTURES[name]
+    html_content = tabular_to_html(fixture['latex'])
+    assert html_content is not None
+    assert normalized_html_table(html_content) == normalized_html_table(fixture['latexmlc_html'])
+
+
+@pytest.mark.skipif(not shutil.which('latexmlc'), reason='latexmlc not installed')
+@pytest.mark.parametrize('name', sorted(FIXTURES))
+def test_fixtures_match_latexmlc(name):
+    # tools/record_latex_table_fixtures.py records them again
+    fixture = FIXTURES[name]
+    html_content = LatexTableConverter().run_latexml(fixture['latex'])
+    assert normalized_html_table(html_content) == normalized_html_table(fixture['latexmlc_html'])
+
+
+@pytest.mark.parametrize('latex', [
+    '\\begin{tabular}{cc}\n$x^2$ & b \\\\\n\\end{tabular}',                                   # math
+    '\\begin{tabular}{cc}\n\\textbf{a} & b \\\\\n\\end{tabular}',                             # other macros
+    '\\begin{tabular}{cc}\na & b \\\\\nc \\\\\n\\end{tabular}',                               # short row
+    '\\begin{tabular}{cc}\n\\multirow{2}{*}{a} & b \\\\\nc & d \\\\\n\\end{tabular}',         # text under a \multirow
+    '\\begin{tabular}{cc}\n\\multirow{3}{*}{a} & b \\\\\n & d \\\\\n\\end{tabular}',           # \multirow past the last row
+    '\\begin{tabular}{p{2cm}c}\na & b \\\\\n\\end{tabular}',                                  # column types other than l, c, r
+])
+def test_fast_path_leaves_other_tables_to_latexmlc(latex):
+    assert tabular_to_html(latex) is None
+
+
+def test_memory_cache_is_bounded():
+    tables = [f'\\begin{{tabular}}{{c}}\nrow {i} \\\\\n\\end{{tabular}}' for i in range(5)]
+    converter = LatexTableConverter(fast_path=True, memory_size=2)
+    html_contents = converter.convert_batch(tables + tables[:1])
+    assert html_contents == [tabular_to_html(table) for table in tables + tables[:1]]
+    assert len(converter.cache) == 2
+    assert converter.path_counts == {'fast path': 5}
+    assert converter.convert(tables[4]) == tabular_to_html(tables[4])
+    assert converter.path_counts == {'fast path': 5}
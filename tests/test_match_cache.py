@@ -0,0 +1,43 @@
+from dataset.md2md_dataset import Md2MdDataset
+
+
+PAGE = '''# Title
+
+The first paragraph of the page.
+
+$$
+E = mc^2
+$$
+
+The second paragraph of the page.
+'''
+
+
+def md2md_cfg(gt_dir, pred_dir, cache_dir):
+    return {'dataset': {
+        'ground_truth': {'data_path': str(gt_dir)},
+        'prediction': {'data_path': str(pred_dir)},
+        'match_method': 'quick_match',
+        'match_cache': str(cache_dir),
+    }}
+
+
+def page_ids(dataset):
+    return sorted((sample['img_id'], sample['gt']) for sample in dataset.samples['text_block'].samples)
+
+
+def test_identical_pages_keep_their_own_names(tmp_path):
+    gt_dir, pred_dir = tmp_path / 'gt', tmp_path / 'pred'
+    gt_dir.mkdir()
+    pred_dir.mkdir()
+    for name in ['pageA.md', 'pageB.md']:
+        (gt_dir / name).write_text(PAGE, encoding='utf-8')
+        (pred_dir / name).write_text(PAGE, encoding='utf-8')
+    cfg = md2md_cfg(gt_dir, pred_dir, tmp_path / 'cache')
+
+    cold = Md2MdDataset(cfg)
+    warm = Md2MdDataset(cfg)
+
+    assert warm.match_cache.hits == 2
+    assert {img_id for img_id, _ in page_ids(warm)} == {'pageA.jpg', 'pageB.jpg'}
+    assert page_ids(warm) == page_ids(cold)
@@ -0,0 +1,136 @@
+import os
+import random
+from collections import defaultdict
+
+import Levenshtein
+
+from utils.match_quick import get_final_subset, record_edit_distance
+
+
+def reference_get_final_subset(subset_certain, subset_certain_cost):
+    # get_final_subset as it was before the interval bookkeeping (pairwise index comparisons), kept as the oracle
+    if not subset_certain or not subset_certain_cost:
+        return []
+
+    subset_turple = sorted([(a, b) for a, b in zip(subset_certain, subset_certain_cost)], key=lambda x: x[0][0])
+
+    group_list = defaultdict(list)
+    group_idx = 0
+    group_list[group_idx].append(subset_turple[0])
+
+    for item in subset_turple[1:]:
+        overlap_flag = False
+        for subset in group_list[group_idx]:
+            for idx in item[0]:
+                if idx in subset[0]:
+                    overlap_flag = True
+                    break
+            if overlap_flag:
+                break
+        if overlap_flag:
+            group_list[group_idx].append(item)
+        else:
+            group_idx += 1
+            group_list[group_idx].append(item)
+
+    final_subset = []
+    for _, group in group_list.items():
+        if len(group) == 1:
+            final_subset.append(group[0][0])
+        else:
+            path_dict = defaultdict(list)
+            path_idx = 0
+            path_dict[path_idx].append(group[0])
+
+            for subset in group[1:]:
+                new_path = True
+                for path_idx_s, path_items in path_dict.items():
+                    is_dup = False
+                    is_same = False
+                    for path_item in path_items:
+                        if path_item[0] == subset[0]:
+                            is_dup = True
+                            is_same = True
+                            if path_item[1] > subset[1]:
+                                path_dict[path_idx_s].pop(path_dict[path_idx_s].index(path_item))
+                                path_dict[path_idx_s].append(subset)
+                        else:
+                            for num_1 in path_item[0]:
+                                for num_2 in subset[0]:
+                                    if num_1 == num_2:
+                                        is_dup = True
+                    if not is_dup:
+                        path_dict[path_idx_s].append(subset)
+                        new_path = False
+                    if is_same:
+                        new_path = False
+                if new_path:
+                    path_idx = len(path_dict.keys())
+                    path_dict[path_idx].append(subset)
+
+            saved_cost = float('inf')
+            saved_subset = []
+            for path_idx, path in path_dict.items():
+                avg_cost = sum([i[1] for i in path]) / len(path)
+                if avg_cost < saved_cost:
+                    saved_subset = [i[0] for i in path]
+                    saved_cost = avg_cost
+
+            final_subset.extend(saved_subset)
+
+    return final_subset
+
+
+def random_subsets(rng, n_preds, n_subsets, max_len):
+    # Runs of consecutive pred indices, as the truncation merging produces them, with some repeated runs
+    subsets, costs = [], []
+    for _ in range(n_subsets):
+        if subsets and rng.random() < 0.2:
+            subset = list(rng.choice(subsets))
+        else:
+            start = rng.randrange(n_preds)
+            subset = list(range(start, min(n_preds, start + rng.randint(2, max_len))))
+        subsets.append(subset)
+        costs.append(rng.choice([0.1, 0.2, 0.3, 0.5]) if rng.random() < 0.3 else rng.random())
+    return subsets, costs
+
+
+def test_get_final_subset_edge_cases():
+    assert get_final_subset([], []) == []
+    assert get_final_subset([[0, 1]], [0.3]) == [[0, 1]]
+    assert get_final_subset([[0, 1], [3, 4]], [0.3, 0.1]) == [[0, 1], [3, 4]]
+    # the cheaper copy of an identical run replaces the dearer one
+    assert get_final_subset([[0, 1], [1, 2], [0, 1]], [0.5, 0.4, 0.1]) == [[0, 1]]
+
+
+def test_get_final_subset_matches_reference():
+    rng = random.Random(0)
+    for _ in range(5000):
+        n_preds = rng.randint(2, 30)
+        subsets, costs = random_subsets(rng, n_preds, rng.randint(1, 12), rng.randint(2, 6))
+        assert get_final_subset(subsets, costs) == reference_get_final_subset(subsets, costs), (subsets, costs)
+
+
+def test_recorded_edit_distance_is_tied_to_its_strings(tmp_path, monkeypatch):
+    from metrics import cal_metric
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('result')
+    computed = []
+    distance = Levenshtein.distance
+    def counting_distance(pred, gt):
+        computed.append((gt, pred))
+        return distance(pred, gt)
+    monkeypatch.setattr(cal_metric.Levenshtein, 'distance', counting_distance)
+
+    def sample(norm_pred):
+        entry = {'img_id': 'page.jpg', 'gt': 'abcd', 'pred': 'abce', 'norm_gt': 'abcd', 'norm_pred': 'abce'}
+        record_edit_distance(entry, {('abcd', 'abce'): 1})
+        entry['norm_pred'] = norm_pred   # e.g. a later normalization step that forgets drop_edit_distance
+        return entry
+
+    reused, changed = sample('abce'), sample('wxyz')
+    assert reused['Edit_num'] == changed['Edit_num'] == 1 and reused['upper_len'] == changed['upper_len']
+    cal_metric.call_Edit_dist([reused, changed]).evaluate()
+    assert computed == [('abcd', 'wxyz')]
+    assert reused['Edit_num'] == 1 and changed['Edit_num'] == 4
+    assert 'edit_pair' not in reused and 'edit_pair' not in changed
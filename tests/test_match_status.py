@@ -0,0 +1,110 @@
+import os
+import shutil
+
+import pytest
+
+from dataset.end2end_dataset import End2EndDataset
+from dataset.md2md_dataset import Md2MdDataset
+from utils.extract import md_tex_filter
+from utils.match import match_gt2pred_no_split, match_gt2pred_simple
+from utils.match_budget import MatchBudget
+
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo_data')
+PAGE = 'docstructbench_dianzishu_zhongwenzaixian-o.O-60599898.pdf_30.md'
+
+
+def failing_when_predicted(match_page_elements):
+    # Matching raises for the real prediction; the empty prediction of the fallback goes through
+    def match(self, gt, pred_content, img_name, budget):
+        if pred_content:
+            raise ValueError('matching crashed')
+        return match_page_elements(self, gt, pred_content, img_name, budget)
+    return match
+
+
+def text_samples(dataset):
+    return dataset.samples['text_block'].samples
+
+
+def assert_scored_as_unmatched(ok_dataset, failed_dataset):
+    img_name = PAGE[:-3] + '.jpg'
+    assert failed_dataset.match_status[img_name]['status'] == 'failed'
+    ok_gt = sorted(sample['gt'] for sample in text_samples(ok_dataset) if sample['gt'])
+    failed_gt = sorted(sample['gt'] for sample in text_samples(failed_dataset) if sample['gt'])
+    assert failed_gt == ok_gt
+    assert all(sample['pred'] == '' for sample in text_samples(failed_dataset))
+
+
+def test_failed_md2md_page_is_scored_as_unmatched(tmp_path, monkeypatch):
+    pred_dir = tmp_path / 'pred'
+    pred_dir.mkdir()
+    shutil.copy(os.path.join(DEMO_DIR, 'end2end', PAGE), pred_dir)
+    gt_dir = tmp_path / 'gt'
+    gt_dir.mkdir()
+    shutil.copy(os.path.join(DEMO_DIR, 'omnidocbench_demo', 'mds', PAGE), gt_dir)
+    cfg = {'dataset': {'ground_truth': {'data_path': str(gt_dir)}, 'prediction': {'data_path': str(pred_dir)}, 'match_method': 'quick_match'}}
+
+    ok_dataset = Md2MdDataset(cfg)
+    monkeypatch.setattr(Md2MdDataset, 'match_page_elements', failing_when_predicted(Md2MdDataset.match_page_elements))
+    assert_scored_as_unmatched(ok_dataset, Md2MdDataset(cfg))
+
+
+def test_failed_end2end_page_is_scored_as_unmatched(tmp_path, monkeypatch):
+    pred_dir = tmp_path / 'pred'
+    pred_dir.mkdir()
+    shutil.copy(os.path.join(DEMO_DIR, 'end2end', PAGE), pred_dir)
+    cfg = {'dataset': {'ground_truth': {'data_path': os.path.join(DEMO_DIR, 'omnidocbench_demo', 'OmniDocBench_demo.json')},
+                       'prediction': {'data_path': str(pred_dir)}, 'match_method': 'quick_match'}}
+
+    ok_dataset = End2EndDataset(cfg)
+    monkeypatch.setattr(End2EndDataset, 'match_page_elements', failing_when_predicted(End2EndDataset.match_page_elements))
+    assert_scored_as_unmatched(ok_dataset, End2EndDataset(cfg))
+
+
+def test_prediction_guard_is_opt_in(tmp_path):
+    pred_dir = tmp_path / 'pred'
+    pred_dir.mkdir()
+    shutil.copy(os.path.join(DEMO_DIR, 'end2end', PAGE), pred_dir)
+    gt_dir = tmp_path / 'gt'
+    gt_dir.mkdir()
+    shutil.copy(os.path.join(DEMO_DIR, 'omnidocbench_demo', 'mds', PAGE), gt_dir)
+    cfg = {'dataset': {'ground_truth': {'data_path': str(gt_dir)}, 'prediction': {'data_path': str(pred_dir)}, 'match_method': 'quick_match'}}
+
+    dataset = Md2MdDataset(cfg)
+    assert dataset.prediction_guard is None
+    assert dataset.match_status == {}
+
+    cfg['dataset']['prediction_guard'] = {'max_chars': 100}
+    dataset = Md2MdDataset(cfg)
+    truncation = dataset.match_status[PAGE[:-3] + '.jpg']['truncation']
+    assert truncation['kept_chars'] == 100
+    assert truncation['rules'] == ['size cap of 100 chars']
+
+
+
+def demo_text_items():
+    with open(os.path.join(DEMO_DIR, 'omnidocbench_demo', 'mds', PAGE), encoding='utf-8') as f:
+        gt_items = md_tex_filter(f.read())['text_all']
+    with open(os.path.join(DEMO_DIR, 'end2end', PAGE), encoding='utf-8') as f:
+        pred_items = md_tex_filter(f.read())['text_all']
+    return gt_items, pred_items
+
+
+@pytest.mark.parametrize('budget, reason', [
+    (MatchBudget(), None),
+    (MatchBudget(max_ops=0), 'operation budget of 0 exhausted in cost matrix'),
+    (MatchBudget(time_limit=-1), 'time budget of -1s exhausted in line extraction'),
+])
+def test_simple_match_checks_the_budget(budget, reason):
+    gt_items, pred_items = demo_text_items()
+    match_list, _ = match_gt2pred_simple(gt_items, pred_items, 'text', 'page.jpg', budget=budget)
+    assert budget.reason == reason
+    assert sorted(gt_idx for item in match_list for gt_idx in item['gt_idx'] if gt_idx != '') == list(range(len(gt_items)))
+
+
+def test_no_split_checks_the_budget():
+    gt_items, pred_items = demo_text_items()
+    budget = MatchBudget(time_limit=-1)
+    assert match_gt2pred_no_split(gt_items, pred_items, 'text', 'page.jpg', budget=budget)
+    assert budget.reason == 'time budget of -1s exhausted in line extraction'
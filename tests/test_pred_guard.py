@@ -0,0 +1,57 @@
+import random
+
+from utils.pred_guard import PredictionGuard
+
+
+def varied_text(rng, n_words):
+    return ' '.join(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9))) for _ in range(n_words))
+
+
+def sparse_html_table(rng, n_rows=400, n_cols=10):
+    rows = []
+    for _ in range(n_rows):
+        cells = [f'<td>{rng.randint(0, 9999)}</td>' if rng.random() < 0.05 else '<td></td>' for _ in range(n_cols)]
+        rows.append('<tr>' + ''.join(cells) + '</tr>')
+    return '<table>' + ''.join(rows) + '</table>'
+
+
+def test_sparse_table_is_not_a_repetition():
+    rng = random.Random(0)
+    content = sparse_html_table(rng) + '\n\n' + varied_text(rng, 3000)
+    assert len(content) > 40000
+    assert PredictionGuard().guard(content) == (content, None)
+
+
+def test_sparse_latex_tabular_is_not_a_repetition():
+    rng = random.Random(1)
+    rows = ' \\\\\n'.join(' & '.join(str(rng.randint(0, 99)) if rng.random() < 0.05 else '' for _ in range(10)) for _ in range(2000))
+    content = varied_text(rng, 500) + '\n\\begin{tabular}{' + 'c' * 10 + '}\n' + rows + '\n\\end{tabular}\n' + varied_text(rng, 500)
+    assert len(content) > 20000
+    assert PredictionGuard().guard(content) == (content, None)
+
+
+def test_repetition_is_collapsed_and_the_rest_is_kept():
+    rng = random.Random(2)
+    head, tail = varied_text(rng, 1000), varied_text(rng, 1000)
+    content = head + '\n' + 'the same line again\n' * 5000 + tail
+    guarded, truncation = PredictionGuard().guard(content)
+    assert guarded.startswith(head) and guarded.endswith(tail)
+    assert len(guarded) < len(head) + len(tail) + 2 * 4096
+    assert truncation['original_chars'] == len(content) and truncation['kept_chars'] == len(guarded)
+    assert len(truncation['rules']) == 1 and truncation['rules'][0].startswith('repetition in chars')
+
+
+def test_unclosed_table_loop_is_collapsed():
+    rng = random.Random(3)
+    content = varied_text(rng, 500) + '<table><tr>' + '<td></td>' * 20000
+    guarded, truncation = PredictionGuard().guard(content)
+    assert len(guarded) < 3 * 4096 + 5000
+    assert truncation is not None
+
+
+def test_short_pages_and_size_cap():
+    guard = PredictionGuard(max_chars=100)
+    assert guard.guard('a' * 100) == ('a' * 100, None)
+    guarded, truncation = guard.guard('a' * 1000)
+    assert guarded == 'a' * 100
+    assert truncation == {'original_chars': 1000, 'kept_chars': 100, 'rules': ['size cap of 100 chars']}
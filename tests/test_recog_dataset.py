@@ -0,0 +1,53 @@
+import json
+import os
+import random
+import re
+
+from dataset.recog_dataset import RecognitionFormulaDataset
+
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'demo_data')
+
+
+def reference_normalize_text(text):
+    # RecognitionFormulaDataset.normalize_text before the per-segment fixpoint, kept as the oracle
+    text_reg = r'(\\(operatorname|mathrm|text|mathbf)\s?\*? {.*?})'
+    letter = '[a-zA-Z]'
+    noletter = r'[\W_^\d]'
+    names = [x[0].replace(' ', '') for x in re.findall(text_reg, text)]
+    text = re.sub(text_reg, lambda match: str(names.pop(0)), text)
+    news = text
+    while True:
+        text = news
+        news = re.sub(r'(?!\\ )(%s)\s+?(%s)' % (noletter, noletter), r'\1\2', text)
+        news = re.sub(r'(?!\\ )(%s)\s+?(%s)' % (noletter, letter), r'\1\2', news)
+        news = re.sub(r'(%s)\s+?(%s)' % (letter, noletter), r'\1\2', news)
+        if news == text:
+            break
+    return text
+
+
+def demo_formulas():
+    formulas = []
+    for name in ['recognition/OmniDocBench_demo_formula.json', 'omnidocbench_demo/OmniDocBench_demo.json']:
+        with open(os.path.join(DEMO_DIR, name), 'r', encoding='utf-8') as f:
+            pages = json.load(f)
+        for page in pages:
+            for item in page['layout_dets']:
+                formulas += [item[key] for key in ['latex', 'pred'] if isinstance(item.get(key), str)]
+    return formulas
+
+
+def random_formulas(rng, count):
+    # Whitespace runs between letters, digits, punctuation, escaped spaces and \text-like groups
+    pieces = [' ', '  ', '\t', '\n', '\\ ', 'a', 'Z', '1', '_', '^', '{', '}', '\\', '+', '(', ')', 'é', '\\frac', '\\text {a b}',
+              '\\mathrm {x y}', '\\operatorname* {d}', '\\mathbf{v}']
+    return [''.join(rng.choice(pieces) for _ in range(rng.randint(0, 16))) for _ in range(count)]
+
+
+def test_normalize_text_matches_whole_string_fixpoint():
+    dataset = RecognitionFormulaDataset.__new__(RecognitionFormulaDataset)
+    formulas = demo_formulas() + random_formulas(random.Random(0), 30000)
+    assert len(formulas) > 30000
+    for formula in formulas:
+        assert dataset.normalize_text(formula) == reference_normalize_text(formula), formula
@@ -0,0 +1,132 @@
+import os
+import random
+from functools import lru_cache
+
+import pytest
+
+from metrics import table_metric
+from metrics.table_metric import TEDS, CustomConfig, TableTree, apted_distance, zhang_shasha_distance
+
+
+def td(text, colspan=1, rowspan=1, *children):
+    return TableTree('td', colspan, rowspan, list(text), *children)
+
+
+def node(tag, *children):
+    return TableTree(tag, None, None, None, *children)
+
+
+def brute_force_distance(tree1, tree2, config):
+    # Ordered forest edit distance straight from its recursive definition (exponential, for small trees only):
+    # the rightmost roots are deleted, inserted, or matched with their subtrees
+    children = {}
+    def index(tree):
+        children[id(tree)] = tuple(id(child) for child in config.children(tree))
+        nodes[id(tree)] = tree
+        for child in config.children(tree):
+            index(child)
+    nodes = {}
+    index(tree1)
+    index(tree2)
+
+    @lru_cache(maxsize=None)
+    def forest_distance(forest1, forest2):
+        if not forest1 and not forest2:
+            return 0
+        if not forest2:
+            return forest_distance(forest1[:-1] + children[forest1[-1]], ()) + config.delete(nodes[forest1[-1]])
+        if not forest1:
+            return forest_distance((), forest2[:-1] + children[forest2[-1]]) + config.insert(nodes[forest2[-1]])
+        v, w = forest1[-1], forest2[-1]
+        return min(forest_distance(forest1[:-1] + children[v], forest2) + config.delete(nodes[v]),
+                   forest_distance(forest1, forest2[:-1] + children[w]) + config.insert(nodes[w]),
+                   forest_distance(forest1[:-1], forest2[:-1]) + forest_distance(children[v], children[w]) + config.rename(nodes[v], nodes[w]))
+
+    return forest_distance((id(tree1),), (id(tree2),))
+
+
+# (tree1, tree2, distance): small tables whose distances were checked against brute_force_distance
+FIXED_TREES = [
+    (node('table', node('tr', td('a'))), node('table', node('tr', td('a'))), 0),
+    (node('table', node('tr', td('ab'))), node('table', node('tr', td('ac'))), 0.5),
+    (node('table', node('tr', td('a'), td('b'))), node('table', node('tr', td('a')), node('tr', td('b'))), 3),
+    (node('table', node('tr', td('a', 2))), node('table', node('tr', td('a'), td(''))), 2),
+    (node('table', node('thead', node('tr', td('x'), td('y'))), node('tbody', node('tr', td('1'), td('2')))),
+     node('table', node('tbody', node('tr', td('x'), td('y')), node('tr', td('1'), td('2')))), 3),
+    (node('table', node('tr', td('abc'), td('de')), node('tr', td('f'))),
+     node('table', node('tr', td('abd')), node('tr', td('de'), td('f'))), 2 + 1 / 3),
+    (node('table'), node('table', node('tr', td('a'), td('b')), node('tr', td('c'))), 5),
+]
+
+# A pair (found by random fuzzing, then shrunk) where apted returns a distance above the optimum; zhang_shasha is exact
+APTED_NOT_OPTIMAL = (
+    node('table', td(''), node('tr'), td('a', 1, 2, td('', 2, 2)), node('b')),
+    node('table', td('', 1, 2), td('', 2, 1, node('thead')), td('ab', 1, 2), node('b', node('tbody', td('', 2, 1)), td(''))),
+)
+
+
+@pytest.mark.parametrize('tree1, tree2, distance', FIXED_TREES)
+def test_backends_on_fixed_trees(tree1, tree2, distance):
+    config = CustomConfig()
+    assert brute_force_distance(tree1, tree2, config) == pytest.approx(distance)
+    assert zhang_shasha_distance(tree1, tree2, config) == pytest.approx(distance)
+    assert apted_distance(tree1, tree2, config) == pytest.approx(distance)
+
+
+def test_apted_is_not_always_optimal():
+    config = CustomConfig()
+    assert brute_force_distance(*APTED_NOT_OPTIMAL, config) == pytest.approx(7.5)
+    assert zhang_shasha_distance(*APTED_NOT_OPTIMAL, config) == pytest.approx(7.5)
+    assert apted_distance(*APTED_NOT_OPTIMAL, config) == pytest.approx(8.0)
+
+
+def random_table(rng, n_nodes):
+    tree = node('table')
+    parents = [tree]
+    for _ in range(n_nodes - 1):
+        if rng.random() < 0.5:
+            child = td(''.join(rng.choice('ab') for _ in range(rng.randint(0, 3))), colspan=rng.choice([1, 1, 2]))
+        else:
+            child = node(rng.choice(['tr', 'tbody']))
+            parents.append(child)
+        rng.choice(parents).children.append(child)
+    return tree
+
+
+def test_zhang_shasha_is_exact_on_random_trees():
+    rng = random.Random(0)
+    config = CustomConfig()
+    for _ in range(300):
+        tree1, tree2 = random_table(rng, rng.randint(1, 7)), random_table(rng, rng.randint(1, 7))
+        assert zhang_shasha_distance(tree1, tree2, config) == pytest.approx(brute_force_distance(tree1, tree2, config))
+
+
+IDENTICAL_TABLE = '<html><body><table><tr><td colspan="2">a</td></tr><tr><td>b</td><td>c</td></tr></table></body></html>'
+
+
+def test_identical_tables_are_parsed_once(monkeypatch):
+    parsed = []
+    parse_html_table = table_metric.parse_html_table
+    def counting_parse(html):
+        parsed.append(html)
+        return parse_html_table(html)
+    monkeypatch.setattr(table_metric, 'parse_html_table', counting_parse)
+    assert TEDS().evaluate_with_structure(IDENTICAL_TABLE, IDENTICAL_TABLE) == (1.0, 1.0)
+    assert len(parsed) == 1
+    assert TEDS(structure_only=True).evaluate(IDENTICAL_TABLE, IDENTICAL_TABLE) == 1.0
+
+
+def test_teds_cache_stats_in_metric_result(tmp_path, monkeypatch):
+    from metrics.cal_metric import call_TEDS
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('result')
+    def samples():
+        return [{'img_id': 'page', 'gt_idx': i, 'gt': IDENTICAL_TABLE, 'pred': pred, 'gt_attribute': [{}]}
+                for i, pred in enumerate([IDENTICAL_TABLE, IDENTICAL_TABLE.replace('>b<', '>x<')])]
+    _, cold = call_TEDS(samples()).evaluate(cache_dir=str(tmp_path / 'cache'))
+    _, warm = call_TEDS(samples()).evaluate(cache_dir=str(tmp_path / 'cache'))
+    assert cold['TEDS_cache'] == {'hits': 0, 'misses': 2, 'hit_rate': 0.0, 'identical_tables': 1}
+    assert warm['TEDS_cache'] == {'hits': 2, 'misses': 0, 'hit_rate': 1.0, 'identical_tables': 1}
+    assert warm['TEDS'] == cold['TEDS']
+    _, uncached = call_TEDS(samples()).evaluate()
+    assert 'TEDS_cache' not in uncached
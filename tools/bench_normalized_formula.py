@@ -0,0 +1,88 @@
+# Compare normalized_formula (utils/data_preprocess.py) with its implementation before the hoisted patterns: time and output.
+# Run from the repo root: python tools/bench_normalized_formula.py
+# Exits with status 1 if any formula is normalized differently.
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.data_preprocess import normalized_formula
+from utils.extract import md_tex_filter
+
+
+def previous_normalized_formula(text):
+    # normalized_formula before the patterns were hoisted to module level
+    filter_list = ['\\mathbf', '\\mathrm', '\\mathnormal', '\\mathit', '\\mathbb', '\\mathcal', '\\mathscr', '\\mathfrak', '\\mathsf', '\\mathtt', 
+                   '\\textbf', '\\text', '\\boldmath', '\\boldsymbol', '\\operatorname', '\\bm',
+                   '\\symbfit', '\\mathbfcal', '\\symbf', '\\scriptscriptstyle', '\\notag',
+                   '\\setlength', '\\coloneqq', '\\space', '\\thickspace', '\\thinspace', '\\medspace', '\\nobreakspace', '\\negmedspace',
+                   '\\quad', '\\qquad', '\\enspace', '\\substackw', ' ', '$$', '\\left', '\\right', '\\displaystyle', '\\text']
+
+    text = text.strip().strip('$').strip('\n')
+    pattern = re.compile(r"\\\[(.+?)(?<!\\)\\\]")
+    match = pattern.search(text)
+
+    if match:
+        text = match.group(1).strip()
+
+    tag_pattern = re.compile(r"\\tag\{.*?\}")
+    text = tag_pattern.sub('', text)
+    hspace_pattern = re.compile(r"\\hspace\{.*?\}")
+    text = hspace_pattern.sub('', text)
+    begin_pattern = re.compile(r"\\begin\{.*?\}")
+    text = begin_pattern.sub('', text)
+    end_pattern = re.compile(r"\\end\{.*?\}")
+    text = end_pattern.sub('', text)
+    col_sep = re.compile(r"\\arraycolsep.*?\}")
+    text = col_sep.sub('', text)
+    text = text.strip('.')
+
+    for filter_text in filter_list:
+        text = text.replace(filter_text, '')
+
+    text = text.lower()
+    return text
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark normalized_formula against its previous implementation.')
+    parser.add_argument('--gt', type=str, default='./demo_data/omnidocbench_demo/OmniDocBench_demo.json')
+    parser.add_argument('--pred', type=str, default='./demo_data/end2end', help='directory of prediction .md files')
+    parser.add_argument('--repeat', type=int, default=200, help='normalize every formula this many times')
+    return parser.parse_args()
+
+
+def load_formulas(gt_path, pred_dir):
+    # Display formulas of the GT and of the predictions, plain and as the matcher sees them (with delimiters)
+    with open(gt_path, 'r', encoding='utf-8') as f:
+        pages = json.load(f)
+    formulas = [item['latex'] for page in pages for item in page['layout_dets']
+                if item['category_type'] == 'equation_isolated' and item.get('latex')]
+    for path in sorted(glob.glob(os.path.join(pred_dir, '*.md'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            formulas += [item['content'] for item in md_tex_filter(f.read())['equation_isolated']]
+    return formulas
+
+
+def time_all(function, formulas, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        outputs = [function(formula) for formula in formulas]
+    return outputs, time.time() - start
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    formulas = load_formulas(args.gt, args.pred)
+    previous, previous_time = time_all(previous_normalized_formula, formulas, args.repeat)
+    current, current_time = time_all(normalized_formula, formulas, args.repeat)
+    mismatches = [formula for formula, a, b in zip(formulas, previous, current) if a != b]
+    print(f'{len(formulas)} formulas x {args.repeat}: previous {previous_time:.3f}s, current {current_time:.3f}s, '
+          f'speedup {previous_time / current_time:.2f}, {len(mismatches)} mismatches')
+    for formula in mismatches[:10]:
+        print(f'  mismatch: {formula!r}')
+    sys.exit(1 if mismatches else 0)
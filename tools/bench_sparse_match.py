@@ -0,0 +1,101 @@
+# Compare the dense cost matrix with sparse q-gram candidates (sparse_candidates) in match_gt2pred_quick.
+# Run from the repo root: python tools/bench_sparse_match.py
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset.end2end_dataset import End2EndDataset
+from utils.pred_source import PredictionSource
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark sparse q-gram candidates against the dense matcher.')
+    parser.add_argument('--gt', type=str, default='./demo_data/omnidocbench_demo/OmniDocBench_demo.json')
+    parser.add_argument('--pred', type=str, default='./demo_data/end2end')
+    parser.add_argument('--q', type=int, default=2)
+    parser.add_argument('--min_overlap', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=1, help='the merged stress page repeats all pages this many times')
+    return parser.parse_args()
+
+
+def get_matcher(sparse_candidates):
+    # Only the attributes used by process_get_matched_elements, without matching the whole dataset in __init__
+    dataset = End2EndDataset.__new__(End2EndDataset)
+    dataset.match_method = 'quick_match'
+    dataset.sparse_candidates = sparse_candidates
+    # Time the matcher itself: no budget and no prediction guard
+    dataset.match_time_budget = None
+    dataset.match_ops_budget = None
+    dataset.prediction_guard = None
+    return dataset
+
+
+def merge_pages(pages, repeat):
+    # One dense page made of all pages (repeated), to mimic newspapers / notes
+    merged = {'layout_dets': [], 'extra': {'relation': []}, 'page_info': {'image_path': 'merged_stress_page.jpg'}}
+    contents = []
+    for r in range(repeat):
+        for i, (sample, pred_content) in enumerate(pages):
+            offset = (r * len(pages) + i) * 100000
+            for item in sample['layout_dets']:
+                item = copy.deepcopy(item)
+                item['anno_id'] += offset
+                if item.get('order'):
+                    item['order'] += offset
+                merged['layout_dets'].append(item)
+            for relation in sample['extra']['relation']:
+                relation = dict(relation, source_anno_id=relation['source_anno_id'] + offset, target_anno_id=relation['target_anno_id'] + offset)
+                merged['extra']['relation'].append(relation)
+            contents.append(pred_content)
+    return merged, '\n\n'.join(contents)
+
+
+def pair_set(result):
+    pairs = set()
+    for matches in result[:3]:   # text, display formula, circuit diagram
+        for item in matches:
+            pairs.add((str(item['gt_idx']), str(item['pred_idx']), item['gt']))
+    return pairs
+
+
+def mean_edit(result):
+    edits = [item['edit'] for item in result[0]]
+    return sum(edits) / len(edits) if edits else 0
+
+
+def run(matcher, sample, pred_content, img_name):
+    start = time.time()
+    result = matcher.process_get_matched_elements(sample, pred_content, img_name, start)
+    return result, time.time() - start
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(args.gt, 'r', encoding='utf-8') as f:
+        gt_samples = json.load(f)
+    pred_source = PredictionSource(args.pred)
+    pages = []
+    for sample in gt_samples:
+        img_name = os.path.basename(sample['page_info']['image_path'])
+        pred_name = pred_source.find([img_name[:-4] + '.md'])
+        if pred_name:
+            pages.append((sample, pred_source.read(pred_name)))
+
+    dense = get_matcher(None)
+    sparse = get_matcher({'q': args.q, 'min_overlap': args.min_overlap, 'min_pairs': 0})
+
+    merged_sample, merged_pred = merge_pages(pages, args.repeat)
+    cases = [(os.path.basename(s['page_info']['image_path']), s, p) for s, p in pages]
+    cases.append((f'merged stress page (x{args.repeat})', merged_sample, merged_pred))
+
+    print(f"{'page':60s} {'dense s':>8s} {'sparse s':>8s} {'same pairs':>10s} {'text edit dense/sparse':>24s}")
+    for name, sample, pred_content in cases:
+        dense_result, dense_time = run(dense, sample, pred_content, name)
+        sparse_result, sparse_time = run(sparse, sample, pred_content, name)
+        dense_pairs, sparse_pairs = pair_set(dense_result), pair_set(sparse_result)
+        same = len(dense_pairs & sparse_pairs) / max(len(dense_pairs), 1)
+        print(f'{name[:60]:60s} {dense_time:8.3f} {sparse_time:8.3f} {same:10.1%} {mean_edit(dense_result):11.4f}/{mean_edit(sparse_result):.4f}')
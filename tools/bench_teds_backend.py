@@ -0,0 +1,74 @@
+# Compare the tree edit distance backends of TEDS (see ted_backends in metrics/table_metric.py): time and score agreement.
+# Run from the repo root: python tools/bench_teds_backend.py
+# Exits with status 1 if a backend's scores differ from apted's by more than --tolerance,
+# or if an approximate score (TEDS approximate_nodes) is above the exact one. A difference is not always a backend bug:
+# apted can return a distance above the optimum on rare trees (see tests/test_table_metric.py).
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics.table_metric import TEDS, ted_backends
+from utils.data_preprocess import normalized_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark TEDS tree edit distance backends against apted.')
+    parser.add_argument('--data', type=str, default='./demo_data/recognition/OmniDocBench_demo_table.json',
+                        help='OmniDocBench style json whose table items have html (GT) and pred')
+    parser.add_argument('--backends', type=str, nargs='+', default=[name for name in ted_backends if name != 'apted'])
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 4],
+                        help='also score every table with its rows repeated this many times, to mimic large tables')
+    parser.add_argument('--tolerance', type=float, default=1e-9)
+    return parser.parse_args()
+
+
+def repeat_rows(table_html, times):
+    rows = re.findall(r'<tr>.*?</tr>', table_html, re.DOTALL)
+    if times == 1 or not rows:
+        return table_html
+    return '<html><body><table>' + ''.join(rows) * times + '</table></body></html>'
+
+
+def load_pairs(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        samples = json.load(f)
+    pairs = []
+    for sample in samples:
+        for item in sample['layout_dets']:
+            if item.get('html') and item.get('pred'):
+                pairs.append((normalized_table(item['pred']), normalized_table(item['html'])))
+    return pairs
+
+
+def score_all(pairs, ted_backend, approximate_nodes=None):
+    teds = TEDS(ted_backend=ted_backend, approximate_nodes=approximate_nodes)
+    start = time.time()
+    scores = [teds.evaluate_with_structure(pred, gt) for pred, gt in pairs]
+    return scores, time.time() - start
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    pairs = load_pairs(args.data)
+    failed = False
+    print(f"{'tables':>12s} {'backend':>14s} {'seconds':>9s} {'speedup':>8s} {'max score diff':>15s}")
+    for scale in args.scale:
+        scaled_pairs = [(repeat_rows(pred, scale), repeat_rows(gt, scale)) for pred, gt in pairs]
+        reference, reference_time = score_all(scaled_pairs, 'apted')
+        name = f'{len(pairs)} x{scale}'
+        print(f"{name:>12s} {'apted':>14s} {reference_time:9.3f} {1:8.2f} {0:15.2e}")
+        for backend in args.backends:
+            scores, backend_time = score_all(scaled_pairs, backend)
+            diff = max(abs(a - b) for score, reference_score in zip(scores, reference) for a, b in zip(score, reference_score))
+            failed = failed or diff > args.tolerance
+            print(f'{name:>12s} {backend:>14s} {backend_time:9.3f} {reference_time / backend_time:8.2f} {diff:15.2e}')
+        # Approximate scores are lower bounds: report the largest gap to the exact score
+        scores, approximate_time = score_all(scaled_pairs, 'apted', approximate_nodes=0)
+        gap = max(b - a for score, reference_score in zip(scores, reference) for a, b in zip(score, reference_score))
+        failed = failed or gap < -args.tolerance
+        print(f"{name:>12s} {'approximate':>14s} {approximate_time:9.3f} {reference_time / approximate_time:8.2f} {gap:15.2e}")
+    sys.exit(1 if failed else 0)
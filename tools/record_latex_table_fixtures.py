@@ -0,0 +1,40 @@
+# Record the latexmlc HTML of the tabulars in CASES to tests/data/latex_table_fixtures.json,
+# the reference tests/test_latex_table.py compares the tabular_to_html fast path (utils/latex_table.py) with.
+# Run from the repo root with latexmlc installed: python tools/record_latex_table_fixtures.py
+import json
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.latex_table import LatexTableConverter
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'data', 'latex_table_fixtures.json')
+
+CASES = {
+    'plain': '\\begin{tabular}{lcc}\nModel & Acc & F1 \\\\\nBase & 81.2 & 79.0 \\\\\nOurs (large) & 85.4 & 83.1 \\\\\n\\end{tabular}',
+    'multicolumn': '\\begin{tabular}{lcc}\n & \\multicolumn{2}{c}{Scores} \\\\\nMethod & P & R \\\\\nA & 0.91 & 0.88 \\\\\n\\end{tabular}',
+    'multirow': '\\begin{tabular}{lcc}\n\\multirow{2}{*}{Method} & \\multicolumn{2}{c}{Scores} \\\\\n & P & R \\\\\nA & 0.91 & 0.88 \\\\\nB & 0.85 & 0.90 \\\\\n\\end{tabular}',
+    'hline_cline': '\\begin{tabular}{|l|c|c|}\n\\hline\nName & Train & Test \\\\\n\\cline{2-3}\nsplit a & 1200 & 300 \\\\\n\\hline\nsplit b & 800 & 200 \\\\\n\\hline\n\\end{tabular}',
+    'booktabs': '\\begin{tabular}{lrr}\n\\toprule\nItem & Count & Share \\\\\n\\midrule\napples & 12 & 40\\% \\\\\npears & 18 & 60\\% \\\\\n\\bottomrule\n\\end{tabular}',
+    'empty_cells': '\\begin{tabular}{ccc}\na & & c \\\\\n & b & \\\\\n & & \\\\\nx & y & z \\\\\n\\end{tabular}',
+}
+
+
+def main():
+    if not shutil.which('latexmlc'):
+        sys.exit('latexmlc not found')
+    converter = LatexTableConverter()
+    fixtures = {}
+    for name, latex in CASES.items():
+        html_content = converter.run_latexml(latex)
+        if html_content is None:
+            sys.exit(f'latexmlc failed on {name}')
+        fixtures[name] = {'latex': latex, 'latexmlc_html': html_content}
+    with open(FIXTURE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, indent=4, ensure_ascii=False)
+    print(f'{len(fixtures)} tables recorded to {FIXTURE_PATH}')
+
+
+if __name__ == '__main__':
+    main()
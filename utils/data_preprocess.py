@@ -2,11 +2,9 @@ import re
 import unicodedata
 from pylatexenc.latex2text import LatexNodes2Text
 from bs4 import BeautifulSoup
-import subprocess
-import shutil
-import uuid
 import html
-import os
+from functools import lru_cache
+from utils.latex_table import LatexTableConverter
 
 def remove_markdown_fences(content):
     content = re.sub(r'^```markdown\n?', '', content, flags=re.MULTILINE)
@@ -72,9 +70,122 @@ inline_reg = re.compile(
     r'\$(.*?)\$|'
     r'\\\((.*?)\\\)',
 )
+inline_delimiters = [('$', '$'), ('\\(', '\\)')]
+
+def delimited_finditer(reg, text, delimiters, dotall=True):
+    '''
+    Same matches as reg.finditer(text), where reg is the alternation of open(.*?)close over delimiters (in this order),
+    but linear in len(text): reg only runs where a match is known to start, so an opener without a closer no longer
+    costs a scan to the end of the text (quadratic on degenerate predictions full of unclosed delimiters).
+    '''
+    found = {}   # literal -> (searched from, next position or -1)
+    def find(literal, pos):
+        searched_from, next_pos = found.get(literal, (None, None))
+        if searched_from is None or pos < searched_from or (next_pos != -1 and next_pos < pos):
+            searched_from, next_pos = pos, text.find(literal, pos)
+            found[literal] = (searched_from, next_pos)
+        return next_pos
+
+    openers = list(dict.fromkeys(opener for opener, _ in delimiters))
+    pos = 0
+    while pos < len(text):
+        starts = [start for start in (find(opener, pos) for opener in openers) if start != -1]
+        if not starts:
+            return
+        start = min(starts)
+        pos = start + 1
+        for opener, closer in delimiters:
+            if text.startswith(opener, start):
+                close_pos = find(closer, start + len(opener))
+                if close_pos == -1:
+                    continue
+                if not dotall:
+                    newline_pos = find('\n', start + len(opener))
+                    if newline_pos != -1 and newline_pos < close_pos:
+                        continue
+                match = reg.match(text, start)
+                if match:
+                    yield match
+                    pos = max(match.end(), start + 1)
+                break
+
+# Shared pylatexenc converter; building a LatexNodes2Text per formula is expensive
+latex2text_converter = LatexNodes2Text()
+
+# Fast path for simple inline formulas: plain chars, ^ _ and braces are kept / dropped exactly as pylatexenc does,
+# and these macros map to the single char pylatexenc gives them (it also eats the whitespace after a macro).
+FAST_LATEX_PLAIN_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 +-=()[],.;:/<>|!*^_')
+FAST_LATEX_MACRO_NAMES = [
+    'alpha', 'beta', 'gamma', 'delta', 'epsilon', 'varepsilon', 'zeta', 'eta', 'theta', 'vartheta', 'iota', 'kappa', 'lambda',
+    'mu', 'nu', 'xi', 'pi', 'varpi', 'rho', 'varrho', 'sigma', 'varsigma', 'tau', 'upsilon', 'phi', 'varphi', 'chi', 'psi', 'omega',
+    'Gamma', 'Delta', 'Theta', 'Lambda', 'Xi', 'Pi', 'Sigma', 'Upsilon', 'Phi', 'Psi', 'Omega',
+    'cdot', 'times', 'div', 'pm', 'mp', 'leq', 'le', 'geq', 'ge', 'neq', 'ne', 'approx', 'equiv', 'sim', 'simeq', 'propto',
+    'infty', 'partial', 'nabla', 'circ', 'degree', 'prime', 'ldots', 'cdots', 'rightarrow', 'leftarrow', 'to', 'in', 'notin',
+    'subset', 'subseteq', 'cup', 'cap', 'forall', 'exists', 'sum', 'prod', 'int',
+]
+
+@lru_cache(maxsize=None)
+def fast_latex_macros():
+    # Take each macro's text from pylatexenc itself and keep only macros that behave as a plain single-char replacement.
+    # Built on first use rather than at import, since it runs a few hundred pylatexenc conversions
+    macros = {}
+    for name in FAST_LATEX_MACRO_NAMES:
+        try:
+            value = latex2text_converter.latex_to_text('\\' + name)
+            if value and all(latex2text_converter.latex_to_text(f'\\{name}{sep}x') == value + 'x' for sep in [' ', '  ', '{}']):
+                macros[name] = value
+        except Exception:
+            continue
+    return macros
+
+def latex_to_unicode_fast(latex):
+    # Returns None if the formula is outside the simple subset ('--' is turned into dashes by pylatexenc)
+    if '--' in latex:
+        return None
+    out = []
+    depth = 0
+    i = 0
+    n = len(latex)
+    while i < n:
+        char = latex[i]
+        if char in FAST_LATEX_PLAIN_CHARS:
+            out.append(char)
+            i += 1
+        elif char == '{':
+            depth += 1
+            i += 1
+        elif char == '}':
+            depth -= 1
+            if depth < 0:
+                return None
+            i += 1
+        elif char == '\\':
+            j = i + 1
+            while j < n and latex[j].isascii() and latex[j].isalpha():
+                j += 1
+            macro = fast_latex_macros().get(latex[i + 1:j])
+            if macro is None:
+                return None
+            out.append(macro)
+            while j < n and latex[j] == ' ':
+                j += 1
+            i = j
+        else:
+            return None
+    if depth != 0:
+        return None
+    return ''.join(out)
+
+@lru_cache(maxsize=1 << 16)
+def latex_to_unicode(latex):
+    # Same output as LatexNodes2Text().latex_to_text(latex), memoized by formula text
+    text = latex_to_unicode_fast(latex)
+    if text is None:
+        text = latex2text_converter.latex_to_text(latex)
+    return text
 
 def textblock2unicode(text):
-    inline_matches = inline_reg.finditer(text)
+    inline_matches = delimited_finditer(inline_reg, text, inline_delimiters, dotall=False)
     removal_positions = []
     for match in inline_matches:
         position = [match.start(), match.end()]
@@ -88,7 +199,7 @@ def textblock2unicode(text):
                 if clean_content.endswith('\\'):
                     clean_content += ' '
                 # inline_array.append(match.group(0))
-                unicode_content = LatexNodes2Text().latex_to_text(clean_content)
+                unicode_content = latex_to_unicode(clean_content)
                 removal_positions.append((position[0], position[1], unicode_content))
         except:
             continue
@@ -99,37 +210,45 @@ def textblock2unicode(text):
 
     return text
 
+# Normalize math formulas before matching
+formula_filter_list = ['\\mathbf', '\\mathrm', '\\mathnormal', '\\mathit', '\\mathbb', '\\mathcal', '\\mathscr', '\\mathfrak', '\\mathsf', '\\mathtt', 
+                       '\\textbf', '\\text', '\\boldmath', '\\boldsymbol', '\\operatorname', '\\bm',
+                       '\\symbfit', '\\mathbfcal', '\\symbf', '\\scriptscriptstyle', '\\notag',
+                       '\\setlength', '\\coloneqq', '\\space', '\\thickspace', '\\thinspace', '\\medspace', '\\nobreakspace', '\\negmedspace',
+                       '\\quad', '\\qquad', '\\enspace', '\\substackw', ' ', '$$', '\\left', '\\right', '\\displaystyle', '\\text']
+                    #    '\\left', '\\right', '{', '}', ' ']
+formula_delimiter_reg = re.compile(r"\\\[(.+?)(?<!\\)\\\]")
+# (literal every match contains, pattern), applied in this order
+formula_env_regs = [
+    ('\\tag{', re.compile(r"\\tag\{.*?\}")),
+    ('\\hspace{', re.compile(r"\\hspace\{.*?\}")),
+    ('\\begin{', re.compile(r"\\begin\{.*?\}")),
+    ('\\end{', re.compile(r"\\end\{.*?\}")),
+    ('\\arraycolsep', re.compile(r"\\arraycolsep.*?\}")),
+]
+
 def normalized_formula(text):
-    # Normalize math formulas before matching
-    filter_list = ['\\mathbf', '\\mathrm', '\\mathnormal', '\\mathit', '\\mathbb', '\\mathcal', '\\mathscr', '\\mathfrak', '\\mathsf', '\\mathtt', 
-                   '\\textbf', '\\text', '\\boldmath', '\\boldsymbol', '\\operatorname', '\\bm',
-                   '\\symbfit', '\\mathbfcal', '\\symbf', '\\scriptscriptstyle', '\\notag',
-                   '\\setlength', '\\coloneqq', '\\space', '\\thickspace', '\\thinspace', '\\medspace', '\\nobreakspace', '\\negmedspace',
-                   '\\quad', '\\qquad', '\\enspace', '\\substackw', ' ', '$$', '\\left', '\\right', '\\displaystyle', '\\text']
-                #    '\\left', '\\right', '{', '}', ' ']
-    
     # delimiter_filter
     text = text.strip().strip('$').strip('\n')
-    pattern = re.compile(r"\\\[(.+?)(?<!\\)\\\]")
-    match = pattern.search(text)
+    match = formula_delimiter_reg.search(text)
 
     if match:
         text = match.group(1).strip()
     
-    tag_pattern = re.compile(r"\\tag\{.*?\}")
-    text = tag_pattern.sub('', text)
-    hspace_pattern = re.compile(r"\\hspace\{.*?\}")
-    text = hspace_pattern.sub('', text)
-    begin_pattern = re.compile(r"\\begin\{.*?\}")
-    text = begin_pattern.sub('', text)
-    end_pattern = re.compile(r"\\end\{.*?\}")
-    text = end_pattern.sub('', text)
-    col_sep = re.compile(r"\\arraycolsep.*?\}")
-    text = col_sep.sub('', text)
+    if '\\' in text:
+        for env_literal, env_reg in formula_env_regs:
+            if env_literal in text:
+                text = env_reg.sub('', text)
     text = text.strip('.')
     
-    for filter_text in filter_list:
-        text = text.replace(filter_text, '')
+    # Kept as a replace chain: the order matters (a removal can glue a later filter together, e.g. \te\bmxt),
+    # and for formula-sized strings it is faster than one alternation regex
+    if '\\' in text:
+        for filter_text in formula_filter_list:
+            text = text.replace(filter_text, '')
+    else:
+        # Only ' ' and '$$' have no backslash
+        text = text.replace(' ', '').replace('$$', '')
         
     # text = normalize_text(delimiter_filter(text))
     # text = delimiter_filter(text)
@@ -206,31 +325,10 @@ def normalized_html_table(text):
     norm_text = clean_table(norm_text)
     return norm_text
 
-def normalized_latex_table(text):
-    def latex_template(latex_code):  
-        template = r'''
-        \documentclass[border=20pt]{article}
-        \usepackage{subcaption}
-        \usepackage{url}
-        \usepackage{graphicx}
-        \usepackage{caption}
-        \usepackage{multirow}
-        \usepackage{booktabs}
-        \usepackage{color}
-        \usepackage{colortbl}
-        \usepackage{xcolor,soul,framed}
-        \usepackage{fontspec}
-        \usepackage{amsmath,amssymb,mathtools,bm,mathrsfs,textcomp}
-        \setlength{\parindent}{0pt}''' + \
-        r'''
-        \begin{document}
-        ''' + \
-        latex_code + \
-        r'''
-        \end{document}'''
-    
-        return template
+# Shared by callers that don't pass their own converter
+latex_table_converter = LatexTableConverter()
 
+def normalized_latex_table(text, converter=None):
     def process_table_latex(latex_code):
         SPECIAL_STRINGS= [
             ['\\\\vspace\\{.*?\\}', ''],
@@ -274,46 +372,22 @@ def normalized_latex_table(text):
 
         return latex_code
     
-    def convert_latex_to_html(latex_content, cache_dir='./temp'):
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-
-        uuid_str = str(uuid.uuid1())
-        with open(f'{cache_dir}/{uuid_str}.tex', 'w') as f:
-            f.write(latex_template(latex_content))
-
-        cmd = ['latexmlc', '--quiet', '--nocomments', f'--log={cache_dir}/{uuid_str}.log',
-               f'{cache_dir}/{uuid_str}.tex', f'--dest={cache_dir}/{uuid_str}.html']
-        try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            with open(f'{cache_dir}/{uuid_str}.html', 'r') as f:
-                html_content = f.read()
-
-            pattern = r'<table\b[^>]*>(.*)</table>'
-            tables = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
-            tables = [f'<table>{table}</table>' for table in tables]
-            html_content = '\n'.join(tables)
-        
-        except Exception as e:
-            html_content = ''
-        
-        shutil.rmtree(cache_dir)
-        return html_content
-    
-    html_text = convert_latex_to_html(text)
+    html_text = (converter or latex_table_converter).convert(text)
     normlized_tables = normalized_html_table(html_text)
     return normlized_tables
 
 
-def normalized_table(text, format='html'):
+def normalized_table(text, format='html', latex_converter=None):
     if format not in ['html', 'latex']:
         raise ValueError('Invalid format: {}'.format(format))
+    elif format == 'latex':
+        return normalized_latex_table(text, latex_converter)
     else:
-        return globals()['normalized_{}_table'.format(format)](text)
+        return normalized_html_table(text)
 
 
 def textblock_with_norm_formula(text):
-    inline_matches = inline_reg.finditer(text)
+    inline_matches = delimited_finditer(inline_reg, text, inline_delimiters, dotall=False)
     removal_positions = []
     for match in inline_matches:
         position = [match.start(), match.end()]
@@ -381,7 +455,7 @@ def inline_filter_unicode(text):
     text_copy = text.replace('$', placeholder).replace('\\(', placeholder).replace('\\)', placeholder)
     #print('--------text_copy-------',text_copy)
     # Convert LaTeX content to Unicode representation
-    text_copy = LatexNodes2Text().latex_to_text(text_copy)
+    text_copy = latex_to_unicode(text_copy)
     #print('--------text_copy---unicode----',text_copy)
     # Restore boundary markers
     text_copy = text_copy.replace(placeholder, '$')
@@ -419,7 +493,7 @@ def inline_filter(text):
         text = str(text)
     
     inline_array = []
-    inline_matches = inline_reg.finditer(text)
+    inline_matches = delimited_finditer(inline_reg, text, inline_delimiters, dotall=False)
     
     for match in inline_matches:
         position = [match.start(), match.end()]
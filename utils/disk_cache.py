@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import pickle
+
+
+def content_key(*parts):
+    # sha256 of the parts (str), each prefixed with its length so that different part lists never share a key
+    h = hashlib.sha256()
+    for part in parts:
+        part = part.encode('utf-8')
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+# (file suffix, binary, dump, load) of the entry formats
+ENTRY_FORMATS = {
+    'pickle': ('.pkl', True, lambda value, f: pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL), pickle.load),
+    'json': ('.json', False, json.dump, json.load),
+    'html': ('.html', False, lambda value, f: f.write(value), lambda f: f.read()),
+}
+
+
+class DiskCache():
+    '''
+    Keyed on-disk store shared by the caches (MatchCache, TEDSCache, LatexTableConverter): one file per entry in
+    cache_dir/key[:2]/, in one of ENTRY_FORMATS. Keys come from the caller, usually content_key() of a version and the inputs.
+    get() counts hits and misses; a broken entry is reported and counts as a miss.
+    '''
+    def __init__(self, cache_dir, entry_format, name='cache'):
+        self.cache_dir = cache_dir
+        self.suffix, self.binary, self.dump, self.load = ENTRY_FORMATS[entry_format]
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.suffix)
+
+    def open(self, path, mode):
+        if self.binary:
+            return open(path, mode + 'b')
+        return open(path, mode, encoding='utf-8')
+
+    def get(self, key):
+        path = self.cache_path(key)
+        if os.path.exists(path):
+            try:
+                with self.open(path, 'r') as f:
+                    value = self.load(f)
+                self.hits += 1
+                return value
+            except Exception as e:
+                print(f'!!!WARNING: Broken {self.name} entry {path}: {e}')
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        path = self.cache_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with self.open(tmp_path, 'w') as f:
+            self.dump(value, f)
+        os.replace(tmp_path, path)  # atomic, so an interrupted run never leaves a truncated entry
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 'NaN'}
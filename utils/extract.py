@@ -12,49 +12,72 @@ from pylatexenc.latex2text import LatexNodes2Text
 from pylatexenc.latexwalker import LatexWalker, LatexEnvironmentNode, LatexCharsNode, LatexGroupNode, LatexMacroNode, LatexSpecialsNode
 from collections import defaultdict
 import pdb
-from utils.data_preprocess import remove_markdown_fences, replace_repeated_chars, textblock_with_norm_formula, textblock2unicode
+from utils.data_preprocess import remove_markdown_fences, replace_repeated_chars, textblock_with_norm_formula, textblock2unicode, delimited_finditer
 
 
-def extract_tabular(text):
-    begin_pattern = r'\\begin{tabular}'
-    end_pattern = r'\\end{tabular}'
-
-    tabulars = []
-    positions = []
+def blank_spans(content, spans):
+    # Replace the (start, end) spans with spaces in one rebuild instead of one rebuild per span
+    if not spans:
+        return content
+    parts = []
+    last = 0
+    for start, end in sorted(spans):
+        start = max(start, last)
+        if end <= start:
+            continue
+        parts.append(content[last:start])
+        parts.append(' '*(end-start))
+        last = end
+    parts.append(content[last:])
+    return ''.join(parts)
+
+
+def extract_nested_spans(text, begin_reg, end_reg, end_len):
+    # Outermost begin/end pairs, nesting aware, in one scan with an explicit stack: an end closes the latest open begin
+    # (an end with nothing open is ignored) and a closed pair is kept unless it lies inside another closed pair, so a begin
+    # that is never closed does not hide the pairs after it. The next begin and end matches are only searched again once
+    # the scan passes them, so the text is scanned about once.
+    pairs = []
     current_pos = 0
     stack = []
+    begin_match = end_match = None
     
     while current_pos < len(text):
-        begin_match = re.search(begin_pattern, text[current_pos:])
-        end_match = re.search(end_pattern, text[current_pos:])
+        if begin_match is not False and (begin_match is None or begin_match.start() < current_pos):
+            begin_match = begin_reg.search(text, current_pos) or False
+        if end_match is not False and (end_match is None or end_match.start() < current_pos):
+            end_match = end_reg.search(text, current_pos) or False
         
         if not begin_match and not end_match:
             break
             
         if begin_match and (not end_match or begin_match.start() < end_match.start()):
-            stack.append(current_pos + begin_match.start())
-            current_pos += begin_match.start() + len(end_pattern)
+            stack.append(begin_match.start())
+            current_pos = begin_match.start() + end_len
         elif end_match:
             if stack:
-                start_pos = stack.pop()
-                if not stack:
-                    end_pos = current_pos + end_match.start() + len(end_pattern)
-                    tabular_code = text[start_pos:end_pos]
-                    tabulars.append(tabular_code)
-                    positions.append((start_pos, end_pos))
-            current_pos += end_match.start() + len(end_pattern)
+                pairs.append((stack.pop(), end_match.start() + end_len))
+            current_pos = end_match.start() + end_len
         else:
             current_pos += 1
     
-    if stack:
-        new_start = stack[0] + len(begin_pattern)
-        new_tabulars, new_positions = extract_tabular(text[new_start:])
-        new_positions = [(start + new_start, end + new_start) for start, end in new_positions]
-        tabulars.extend(new_tabulars)
-        positions.extend(new_positions)
-
+    # Pairs are properly nested, so in start order a pair is outermost iff it starts after the last kept one ends
+    tabulars = []
+    positions = []
+    for start_pos, end_pos in sorted(pairs):
+        if not positions or start_pos >= positions[-1][1]:
+            tabulars.append(text[start_pos:end_pos])
+            positions.append((start_pos, end_pos))
     return tabulars, positions
 
+
+# The end length is that of the pattern string, as in the original scanners
+tabular_begin_reg = re.compile(r'\\begin{tabular}')
+tabular_end_reg = re.compile(r'\\end{tabular}')
+
+def extract_tabular(text):
+    return extract_nested_spans(text, tabular_begin_reg, tabular_end_reg, len(tabular_end_reg.pattern))
+
 # math reg
     # r'\\begin{equation\*?}(.*?)\\end{equation\*?}|'
     # r'\\begin{align\*?}(.*?)\\end{align\*?}|'
@@ -71,6 +94,8 @@ display_reg = re.compile(
     re.DOTALL
 )
 
+display_delimiters = [('$$', '$$'), ('\\[', '\\]'), ('$', '$'), ('\\(', '\\)')]
+
 # inline_reg = re.compile(
 #     r'(?<!\$)\$(?!\$)(.*?)(?<!\$)\$(?!\$)|'
 #     r'\\\((.*?)\\\)',
@@ -100,6 +125,9 @@ spice_reg = re.compile(
     re.DOTALL
 )
 
+# display formula delimiters, rewritten to \[\]
+display_dollar_reg = re.compile(r'\$\$(.*?)\$\$|\$(.*?)\$|\\\((.*?)\\\)', re.DOTALL)
+
 # title
 title_reg = re.compile(
     r'^\s*#.*$', 
@@ -152,20 +180,24 @@ def md_tex_filter(content):
     #     })
     
     # extract SPICE netlists for circuit diagrams
+    # Each phase matches on the content left by the previous phases, and blanks its matches with spaces in one rebuild
     spice_matches = spice_reg.finditer(content)
+    blank_positions = []
     for match in spice_matches:
         matched = match.group(0)
         spice_content = match.group(1).strip()
         position = [match.start(), match.end()]
-        content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace with spaces
+        blank_positions.append(position)  # replace with spaces
         pred_all.append({
             'category_type': 'circuit_diagram',
             'position': position,
             'content': spice_content,
         })
+    content = blank_spans(content, blank_positions)
     
     # extract latex table 
     latex_table_array, table_positions = extract_tex_table(content)
+    blank_positions = []
     for latex_table, position in zip(latex_table_array, table_positions):
         position = [position[0], position[0]+len(latex_table)]   # !!!
         pred_all.append({
@@ -173,13 +205,15 @@ def md_tex_filter(content):
             'position': position,
             'content': latex_table
         })
-        content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace latex table with space
+        blank_positions.append(position)  # replace latex table with space
+    content = blank_spans(content, blank_positions)
 
     # print('--------After latex table: \n', content)
     # print('-------latex_table_array: \n', latex_table_array)
 
     # extract html table  
     html_table_array, table_positions = extract_html_table(content)
+    blank_positions = []
     for html_table, position in zip(html_table_array, table_positions):
         position = [position[0], position[0]+len(html_table)]
         pred_all.append({
@@ -187,7 +221,8 @@ def md_tex_filter(content):
             'position': position,
             'content': html_table
         })
-        content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace html table with space
+        blank_positions.append(position)  # replace html table with space
+    content = blank_spans(content, blank_positions)
     # html_table_array = []
     # html_table_matches = html_table_reg.finditer(content)
     # if html_table_matches:
@@ -217,8 +252,9 @@ def md_tex_filter(content):
     #         content = content.replace(matched, '')
 
     # extract interline formula
-    display_matches = display_reg.finditer(content)
+    display_matches = delimited_finditer(display_reg, content, display_delimiters)
     content_copy = content
+    blank_positions = []
     for match in display_matches:
         matched = match.group(0)
         if matched:
@@ -226,11 +262,11 @@ def md_tex_filter(content):
             single_line = ' '.join(matched.strip().split('\n'))
             position = [match.start(), match.end()]
             # replace $$ with \[\]
-            dollar_pattern = re.compile(r'\$\$(.*?)\$\$|\$(.*?)\$|\\\((.*?)\\\)', re.DOTALL)
+            dollar_pattern = display_dollar_reg
             sub_match = dollar_pattern.search(single_line)
             if sub_match is None:
                 # pass
-                content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]
+                blank_positions.append(position)
                 pred_all.append({
                     'category_type': 'equation_isolated',
                     'position': position,
@@ -238,7 +274,7 @@ def md_tex_filter(content):
                 })
             elif sub_match.group(1):
                 single_line = re.sub(dollar_pattern, r'\\[\1\\]', single_line)
-                content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace equation with space
+                blank_positions.append(position)  # replace equation with space
                 pred_all.append({
                     'category_type': 'equation_isolated',
                     'position': position,
@@ -272,6 +308,7 @@ def md_tex_filter(content):
             #     'content': single_line
             # })
             # print('-----Found display formula: ', matched)
+    content = blank_spans(content, blank_positions)
 
     # print('-------------After display: \n', content)
     # extract md table with ||
@@ -282,30 +319,33 @@ def md_tex_filter(content):
         content = convert_markdown_to_html(content)
         # print('----------content after converting md table to html:', content)
         html_table_matches = html_table_reg.finditer(content)
+        blank_positions = []
         if html_table_matches:
             for match in html_table_matches:
                 matched = match.group(0)
                 position = [match.start(), match.end()]
                 # content = content.replace(match, '')
                 # print('content after removing the md table:', content)
-                content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace md table with space
+                blank_positions.append(position)  # replace md table with space
                 pred_all.append({
                     'category_type': 'html_table',
                     'position': position,
                     'content': matched.strip(),
                     'fine_category_type': 'md2html_table'
                 })
+        content = blank_spans(content, blank_positions)
     # print('---------After md table: \n', content)
 
     # extract code blocks
     code_matches = code_block_reg.finditer(content)
+    blank_positions = []
     if code_matches:
         for match in code_matches:
             position = [match.start(), match.end()]
             language = match.group(1)
             code = match.group(2).strip()
             # content = content.replace(match.group(0), '')
-            content = content[:position[0]] + ' '*(position[1]-position[0]) + content[position[1]:]  # replace code block with space
+            blank_positions.append(position)  # replace code block with space
             pred_all.append({
                 'category_type': 'text_all',
                 'position': position,
@@ -313,6 +353,7 @@ def md_tex_filter(content):
                 'language': language,
                 'fine_category_type': 'code'
             })
+    content = blank_spans(content, blank_positions)
 
     # print('-------After code block: \n', content)
 
@@ -460,18 +501,19 @@ def md_tex_filter(content):
 
 #     return tables, positions
 
+tex_table_reg = re.compile(r'\\begin{table}(.*?)\\end{table}', re.DOTALL)
+
 def extract_tex_table(content):
     tables = []
     tables_positions = []
 
-    pattern = r'\\begin{table}(.*?)\\end{table}'
-    for match in re.finditer(pattern, content, re.DOTALL):
+    for match in tex_table_reg.finditer(content):
         start_pos = match.start()
         end_pos = match.end()
         table_content = match.group(0)
         tables.append(table_content)
         tables_positions.append((start_pos, end_pos))
-        content = content[:start_pos] + ' '*(end_pos-start_pos) + content[end_pos:]
+    content = blank_spans(content, tables_positions)
 
     tabulars, tabular_positions = extract_tabular(content)
     all_tables = tables + tabulars
@@ -499,45 +541,11 @@ def extract_tex_table(content):
 #             positions.append((start_pos, end_pos))
 #     return tables, positions
 
-def extract_html_table(text):
-    begin_pattern = r'<table(?:[^>]*)>'
-    end_pattern = r'</table>'
+html_table_begin_reg = re.compile(r'<table(?:[^>]*)>')
+html_table_end_reg = re.compile(r'</table>')
 
-    tabulars = []
-    positions = []
-    current_pos = 0
-    stack = []
-    
-    while current_pos < len(text):
-        begin_match = re.search(begin_pattern, text[current_pos:])
-        end_match = re.search(end_pattern, text[current_pos:])
-        
-        if not begin_match and not end_match:
-            break
-            
-        if begin_match and (not end_match or begin_match.start() < end_match.start()):
-            stack.append(current_pos + begin_match.start())
-            current_pos += begin_match.start() + len(end_pattern)
-        elif end_match:
-            if stack:
-                start_pos = stack.pop()
-                if not stack:
-                    end_pos = current_pos + end_match.start() + len(end_pattern)
-                    tabular_code = text[start_pos:end_pos]
-                    tabulars.append(tabular_code)
-                    positions.append((start_pos, end_pos))
-            current_pos += end_match.start() + len(end_pattern)
-        else:
-            current_pos += 1
-    
-    if stack:
-        new_start = stack[0] + len(begin_pattern)
-        new_tabulars, new_positions = extract_html_table(text[new_start:])
-        new_positions = [(start + new_start, end + new_start) for start, end in new_positions]
-        tabulars.extend(new_tabulars)
-        positions.extend(new_positions)
-
-    return tabulars, positions
+def extract_html_table(text):
+    return extract_nested_spans(text, html_table_begin_reg, html_table_end_reg, len(html_table_end_reg.pattern))
 
 
 def extract_node_content(node):
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import pickle
+import struct
+
+from utils.match_cache import MATCHER_VERSION, gt_page_digest
+
+# Layout: MAGIC | header length (8 bytes, little endian) | pickled header | pickled pages
+# The header holds the GT json sha256 and a per-page index (image name, page attributes, page digest, offset, length),
+# so pages can be filtered by attribute and loaded without reading the others.
+MAGIC = b'OMNIDOC-GT\x00\x01'
+# Bump this whenever the GT preparation stored in pages changes
+ARTIFACT_VERSION = '1'
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_gt_artifact(gt_path, artifact_path, prepare_page):
+    '''
+    Compile OmniDocBench.json into artifact_path. prepare_page(sample) returns the prepared page stored for each sample.
+    '''
+    with open(gt_path, 'r') as f:
+        gt_samples = json.load(f)
+
+    blobs = []
+    pages = []
+    offset = 0
+    for sample in gt_samples:
+        blob = pickle.dumps(prepare_page(sample), protocol=pickle.HIGHEST_PROTOCOL)
+        pages.append({
+            'img_name': os.path.basename(sample['page_info']['image_path']),
+            'page_attribute': sample['page_info']['page_attribute'],
+            'gt_digest': gt_page_digest(sample),
+            'offset': offset,
+            'length': len(blob)
+        })
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = pickle.dumps({
+        'artifact_version': ARTIFACT_VERSION,
+        'matcher_version': MATCHER_VERSION,
+        'gt_sha256': file_sha256(gt_path),
+        'pages': pages
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    tmp_path = artifact_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, artifact_path)
+    return len(pages)
+
+
+class GTArtifact():
+    def __init__(self, artifact_path):
+        self.artifact_path = artifact_path
+        with open(artifact_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{artifact_path} is not a compiled GT artifact')
+            header_len = struct.unpack('<Q', f.read(8))[0]
+            self.header = pickle.loads(f.read(header_len))
+        self.data_start = len(MAGIC) + 8 + header_len
+        self.pages = self.header['pages']
+
+    def is_valid_for(self, gt_path):
+        # Usable only if built from this exact json with the current preparation code
+        if self.header['artifact_version'] != ARTIFACT_VERSION or self.header['matcher_version'] != MATCHER_VERSION:
+            return False
+        return self.header['gt_sha256'] == file_sha256(gt_path)
+
+    def read_pages(self, page_indices):
+        prepared_pages = []
+        with open(self.artifact_path, 'rb') as f:
+            for idx in page_indices:
+                page = self.pages[idx]
+                f.seek(self.data_start + page['offset'])
+                prepared_pages.append(pickle.loads(f.read(page['length'])))
+        return prepared_pages
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.disk_cache import DiskCache
+
+
+def latex_template(latex_code):
+    template = r'''
+    \documentclass[border=20pt]{article}
+    \usepackage{subcaption}
+    \usepackage{url}
+    \usepackage{graphicx}
+    \usepackage{caption}
+    \usepackage{multirow}
+    \usepackage{booktabs}
+    \usepackage{color}
+    \usepackage{colortbl}
+    \usepackage{xcolor,soul,framed}
+    \usepackage{fontspec}
+    \usepackage{amsmath,amssymb,mathtools,bm,mathrsfs,textcomp}
+    \setlength{\parindent}{0pt}''' + \
+    r'''
+    \begin{document}
+    ''' + \
+    latex_code + \
+    r'''
+    \end{document}'''
+
+    return template
+
+
+# Fast path: a lone tabular whose cells are plain text, converted to the rows / cells latexmlc would give.
+# \multicolumn and \multirow cells become colspan / rowspan cells; the empty cells a \multirow spans in the rows below are dropped.
+# Anything else (nested environments, math, other macros, special characters) returns None and goes to latexmlc.
+tabular_reg = re.compile(r'\s*\\begin\{tabular\}\{([^{}]*)\}(.*)\\end\{tabular\}\s*', re.DOTALL)
+tabular_rule_reg = re.compile(r'\\(?:hline|toprule|midrule|bottomrule)(?:\[[^\]]*\])?|\\cline\{[^{}]*\}|\\cmidrule(?:\[[^\]]*\])?(?:\([^()]*\))?\{[^{}]*\}')
+tabular_row_space_reg = re.compile(r'^\s*\[[^\]]*\]')
+multicolumn_reg = re.compile(r'\\multicolumn\{(\d+)\}\{[^{}]*\}\{([^{}]*)\}')
+multirow_reg = re.compile(r'\\multirow(?:\[[^\]]*\])?\{(\d+)\}\{[^{}]*\}\{([^{}]*)\}')
+plain_cell_reg = re.compile(r"[\w\s.,;:()\[\]/+*=?!%-]*")
+
+def tabular_cell_text(cell):
+    # Plain text, with \% as the only macro (a bare % starts a comment)
+    if '%' in cell.replace('\\%', ''):
+        return None
+    text = cell.replace('\\%', '%')
+    if '--' in text or '_' in text or not plain_cell_reg.fullmatch(text):
+        return None
+    return ' '.join(text.split())
+
+def tabular_to_html(latex_content):
+    match = tabular_reg.fullmatch(latex_content)
+    if not match:
+        return None
+    col_spec, body = match.groups()
+    if set(col_spec) - set('lcr| '):
+        return None
+    n_cols = sum(col_spec.count(c) for c in 'lcr')
+    if '\\begin' in body or '\\end' in body or '\\&' in body:
+        return None
+
+    rows = tabular_rule_reg.sub('', body).split('\\\\')
+    if not rows[-1].strip():
+        rows = rows[:-1]
+    html_rows = []
+    spanned = {}    # column -> rows below still spanned by a \multirow cell
+    for row_idx, row in enumerate(rows):
+        row = tabular_row_space_reg.sub('', row)
+        if not row.strip():
+            return None
+        html_cells = []
+        row_cols = 0
+        for cell in row.split('&'):
+            if spanned.get(row_cols):
+                if cell.strip():
+                    return None
+                spanned[row_cols] -= 1
+                row_cols += 1
+                continue
+            colspan, rowspan = 1, 1
+            multicolumn = multicolumn_reg.fullmatch(cell.strip())
+            multirow = multirow_reg.fullmatch(cell.strip())
+            if multicolumn:
+                colspan = int(multicolumn.group(1))
+                cell = multicolumn.group(2)
+            elif multirow:
+                rowspan = int(multirow.group(1))
+                cell = multirow.group(2)
+                if rowspan < 2 or row_idx + rowspan > len(rows):
+                    return None
+                spanned[row_cols] = rowspan - 1
+            text = tabular_cell_text(cell)
+            if text is None:
+                return None
+            row_cols += colspan
+            span_attrs = (f' colspan="{colspan}"' if colspan > 1 else '') + (f' rowspan="{rowspan}"' if rowspan > 1 else '')
+            html_cells.append(f'<td{span_attrs}>{text}</td>')
+        if row_cols != n_cols:
+            return None
+        html_rows.append('<tr>' + ''.join(html_cells) + '</tr>')
+    if not html_rows:
+        return None
+    return '<table>' + ''.join(html_rows) + '</table>'
+
+
+class LatexTableConverter():
+    '''
+    Converts LaTeX tables to HTML tables with latexmlc, or with tabular_to_html for simple tabulars if fast_path is set
+    (opt-in; tests/test_latex_table.py compares its normalized HTML with latexmlc's).
+    Every latexmlc conversion runs in its own temporary directory, so conversions can run concurrently (up to num_workers latexmlc
+    processes in convert_batch). Results are cached by the sha256 of the LaTeX document, in memory (the memory_size most recently
+    used tables) and, if cache_dir is set, on disk so that later runs skip latexmlc for tables already converted.
+    '''
+    def __init__(self, num_workers=1, cache_dir=None, timeout=None, fast_path=False, memory_size=4096):
+        self.num_workers = num_workers
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.fast_path = fast_path
+        self.memory_size = memory_size
+        self.cache = OrderedDict()    # LRU: most recently used last
+        self.path_counts = Counter()    # how tables not found in memory were converted, for report()
+        self.disk_cache = DiskCache(cache_dir, 'html', name='LaTeX table cache') if cache_dir else None
+
+    def cache_key(self, latex_content):
+        return hashlib.sha256(latex_template(latex_content).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        html_content = self.disk_cache.get(key) if self.disk_cache else None
+        if html_content is not None:
+            self.put(key, html_content, persist=False)
+            self.path_counts['disk cache'] += 1
+        return html_content
+
+    def put(self, key, html_content, persist=True):
+        self.cache[key] = html_content
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.memory_size:
+            self.cache.popitem(last=False)
+        if self.disk_cache and persist:
+            self.disk_cache.put(key, html_content)
+
+    def run_latexml(self, latex_content):
+        # Returns None if latexmlc failed
+        with tempfile.TemporaryDirectory(prefix='latex_table_') as work_dir:
+            tex_path = os.path.join(work_dir, 'table.tex')
+            html_path = os.path.join(work_dir, 'table.html')
+            with open(tex_path, 'w') as f:
+                f.write(latex_template(latex_content))
+
+            cmd = ['latexmlc', '--quiet', '--nocomments', f'--log={work_dir}/table.log',
+                   tex_path, f'--dest={html_path}']
+            try:
+                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.timeout)
+                with open(html_path, 'r') as f:
+                    html_content = f.read()
+
+                pattern = r'<table\b[^>]*>(.*)</table>'
+                tables = re.findall(pattern, html_content, re.DOTALL | re.IGNORECASE)
+                tables = [f'<table>{table}</table>' for table in tables]
+                html_content = '\n'.join(tables)
+
+            except Exception as e:
+                html_content = None
+        return html_content
+
+    def convert_fast(self, key, latex_content):
+        # Returns the fast path's HTML, or None; its result is cheap to redo, so it is only kept in memory
+        html_content = tabular_to_html(latex_content) if self.fast_path else None
+        if html_content is not None:
+            self.put(key, html_content, persist=False)
+            self.path_counts['fast path'] += 1
+        return html_content
+
+    def convert(self, latex_content):
+        key = self.cache_key(latex_content)
+        html_content = self.get(key)
+        if html_content is None:
+            html_content = self.convert_fast(key, latex_content)
+        if html_content is None:
+            html_content = self.store(key, self.run_latexml(latex_content))
+        return html_content
+
+    def store(self, key, html_content):
+        # Failed conversions count as no table, but are not kept on disk so that a later run can retry them
+        if html_content is None:
+            self.put(key, '', persist=False)
+            self.path_counts['latexmlc failed'] += 1
+            return ''
+        self.put(key, html_content)
+        self.path_counts['latexmlc'] += 1
+        return html_content
+
+    def convert_batch(self, latex_contents):
+        # Convert the distinct uncached tables with up to num_workers latexmlc processes.
+        # Results are collected here rather than read back from the cache, which may have evicted them.
+        keys = [self.cache_key(latex_content) for latex_content in latex_contents]
+        converted = {}
+        todo = {}
+        for key, latex_content in zip(keys, latex_contents):
+            if key in converted or key in todo:
+                continue
+            html_content = self.get(key)
+            if html_content is None:
+                html_content = self.convert_fast(key, latex_content)
+            if html_content is None:
+                todo[key] = latex_content
+            else:
+                converted[key] = html_content
+        if todo:
+            print(f'Converting {len(todo)} LaTeX tables with latexmlc ({self.num_workers} workers)')
+            with ThreadPoolExecutor(max_workers=max(1, self.num_workers)) as executor:
+                for key, html_content in zip(todo, executor.map(self.run_latexml, todo.values())):
+                    converted[key] = self.store(key, html_content)
+        return [converted[key] for key in keys]
+
+    def report(self):
+        if self.path_counts:
+            print('LaTeX tables: ' + ', '.join(f'{n} {path}' for path, n in self.path_counts.most_common()))
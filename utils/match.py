@@ -1,5 +1,6 @@
 from scipy.optimize import linear_sum_assignment
-import Levenshtein
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein as rf_Levenshtein
 import numpy as np
 import re
 import sys
@@ -8,6 +9,7 @@ from .data_preprocess import textblock_with_norm_formula, normalized_formula, te
 import re
 from bs4 import BeautifulSoup
 from copy import deepcopy
+from collections import defaultdict
 
 def get_pred_category_type(pred_idx, pred_items):
     if pred_items[pred_idx].get('fine_category_type'):
@@ -17,30 +19,123 @@ def get_pred_category_type(pred_idx, pred_items):
     return pred_pred_category_type
 
 
-def compute_edit_distance_matrix_new(gt_lines, matched_lines):
-    try:
-        distance_matrix = np.zeros((len(gt_lines), len(matched_lines)))
-        for i, gt_line in enumerate(gt_lines):
-            for j, matched_line in enumerate(matched_lines):
-                if len(gt_line) == 0 and len(matched_line) == 0:
-                    distance_matrix[i][j] = 0  
-                else:
-                    distance_matrix[i][j] = Levenshtein.distance(gt_line, matched_line) / max(len(matched_line), len(gt_line))
-        return distance_matrix
-    except ZeroDivisionError:
-        raise  
+# Threads used by rapidfuzz for one matrix; pages are already parallelised by the datasets' num_workers
+EDIT_DISTANCE_WORKERS = 1
+
+def compute_edit_distance_matrix_new(gt_lines, matched_lines, score_cutoff=None, dtype=np.float64, workers=None, sparse_candidates=None):
+    """
+    Normalized Levenshtein distance matrix (len(gt_lines) x len(matched_lines)): distance / max(len), empty vs empty = 0.
+    score_cutoff: distances above it are set to 1.0, for callers that only need entries below a threshold.
+    dtype: np.float64 gives the same values as Levenshtein.distance(a, b) / max(len(a), len(b)); np.float32 halves memory.
+    sparse_candidates: None for the exact dense matrix, or a dict of compute_candidate_edit_distance_matrix options.
+    """
+    if len(gt_lines) == 0 or len(matched_lines) == 0:
+        return np.zeros((len(gt_lines), len(matched_lines)), dtype=dtype)
+    if sparse_candidates is not None and len(gt_lines) * len(matched_lines) >= sparse_candidates.get('min_pairs', 2500):
+        return compute_candidate_edit_distance_matrix(gt_lines, matched_lines, dtype=dtype, **{k: v for k, v in sparse_candidates.items() if k != 'min_pairs'})
+    return process.cdist(gt_lines, matched_lines, scorer=rf_Levenshtein.normalized_distance, score_cutoff=score_cutoff,
+                         dtype=dtype, workers=EDIT_DISTANCE_WORKERS if workers is None else workers)
+
+
+def get_qgrams(line, q):
+    if len(line) <= q:
+        return {line}
+    return {line[i:i+q] for i in range(len(line) - q + 1)}
+
+def compute_candidate_edit_distance_matrix(gt_lines, matched_lines, q=2, min_overlap=0.2, short_len=8, dtype=np.float64):
+    """
+    Approximate compute_edit_distance_matrix_new for large pages: a q-gram inverted index over gt_lines selects plausible pairs,
+    exact normalized Levenshtein is computed only for those, and all other pairs get cost 1.
+    A pair is a candidate if it shares at least min_overlap of the smaller distinct q-gram set, or either line is at most short_len chars long.
+    """
+    distance_matrix = np.ones((len(gt_lines), len(matched_lines)), dtype=dtype)
+    gt_grams = [get_qgrams(line, q) for line in gt_lines]
+    gt_gram_num = np.array([len(grams) for grams in gt_grams])
+    inverted_index = defaultdict(list)
+    for i, grams in enumerate(gt_grams):
+        for gram in grams:
+            inverted_index[gram].append(i)
+    gt_short = np.array([len(line) <= short_len for line in gt_lines])
+
+    for j, matched_line in enumerate(matched_lines):
+        shared = np.zeros(len(gt_lines), dtype=np.int32)
+        pred_grams = get_qgrams(matched_line, q)
+        for gram in pred_grams:
+            if gram in inverted_index:
+                shared[inverted_index[gram]] += 1
+        if len(matched_line) <= short_len:
+            candidates = range(len(gt_lines))
+        else:
+            candidates = np.flatnonzero(gt_short | ((shared > 0) & (shared >= min_overlap * np.minimum(gt_gram_num, len(pred_grams)))))
+        for i in candidates:
+            distance_matrix[i, j] = rf_Levenshtein.normalized_distance(gt_lines[i], matched_line)
+    return distance_matrix
 
 
 ## 混合匹配here  0403
 def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
+    # Both sides are normalized in one batch, so a line that occurs in the GT and the pred is normalized once
+    gt_lines, gt_sources, gt_kinds, gt_cat_list = collect_gt_lines(gt_mix, line_type)
+    pred_lines, pred_sources, pred_kinds = collect_pred_lines(pred_dataset_mix, line_type)
+    norm_lines = normalize_lines(gt_sources + pred_sources, gt_kinds + pred_kinds)
+    gt_lines_c, norm_gt_lines_c, gt_cat_list_c = filter_gt_lines(gt_lines, norm_lines[:len(gt_lines)], gt_cat_list)
+    pred_lines_c, norm_pred_lines_c = filter_pred_lines(pred_lines, norm_lines[len(gt_lines):])
+    return gt_lines_c, norm_gt_lines_c, gt_cat_list_c, pred_lines_c, norm_pred_lines_c, gt_mix, pred_dataset_mix
+
+
+def normalize_text_line(line):
+    return clean_string(textblock2unicode(line))
+
+# Normalizer of each kind of line; kind None keeps the line as is
+line_normalizers = {
+    'text': normalize_text_line,
+    'formula': normalized_formula,
+    'spice': normalize_spice,
+}
+
+# Line kind of table pages, by line_type
+table_line_kinds = {
+    'text': 'text',
+    'formula': 'formula',
+}
 
-    norm_html_lines,gt_lines,pred_lines,norm_gt_lines,norm_pred_lines,gt_cat_list = [],[],[],[],[],[]
+gt_text_categories = frozenset([
+    'text_block', 'title', 'code_txt', 'code_txt_caption', 'reference', 'equation_caption',
+    'figure_caption', 'figure_footnote', 'table_caption', 'table_footnote', 'code_algorithm', 'code_algorithm_caption',
+    'header', 'footer', 'page_footnote', 'page_number', 'circuit_caption', 'circuit_footnote'
+])
+
+def normalize_lines(sources, kinds):
+    '''
+    Normalize sources[i] with line_normalizers[kinds[i]]. Lines are grouped by kind and each normalizer runs once per distinct line.
+    '''
+    unique_lines = defaultdict(dict)
+    for source, kind in zip(sources, kinds):
+        if kind is not None:
+            unique_lines[kind][source] = None
+    normalized = {kind: {source: line_normalizers[kind](source) for source in kind_lines} for kind, kind_lines in unique_lines.items()}
+    return [source if kind is None else normalized[kind][source] for source, kind in zip(sources, kinds)]
+
+
+def get_category(item):
+    if item.get('fine_category_type'):
+        return item['fine_category_type']
+    return item['category_type']
+
+
+# GT side of get_gt_pred_lines. It only depends on the GT, so it can be precompiled (see utils/gt_artifact.py)
+def get_gt_lines(gt_mix, line_type):
+    gt_lines, norm_sources, norm_kinds, gt_cat_list = collect_gt_lines(gt_mix, line_type)
+    return filter_gt_lines(gt_lines, normalize_lines(norm_sources, norm_kinds), gt_cat_list)
+
+
+def collect_gt_lines(gt_mix, line_type):
+    # Returns the GT lines, what to normalize for each of them and how (see normalize_lines), and their categories
+
+    norm_html_lines,gt_lines,norm_sources,norm_kinds,gt_cat_list = [],[],[],[],[]
     if line_type in ['html_table','latex_table']:
         for item in gt_mix:
-            if item.get('fine_category_type'):
-                gt_cat_list.append(item['fine_category_type'])
-            else:
-                gt_cat_list.append(item['category_type'])
+            gt_cat_list.append(get_category(item))
             if item.get('content'):
                 gt_lines.append(str(item['content']))
                 norm_html_lines.append(str(item['content']))
@@ -57,87 +152,50 @@ def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
                 gt_lines.append(str(item['latex']))
                 norm_html_lines.append(str(item['html']))
         
-        pred_lines = [str(item['content']) for item in pred_dataset_mix]
-        if line_type == 'formula':
-            norm_gt_lines = [normalized_formula(_) for _ in gt_lines]
-            norm_pred_lines = [normalized_formula(_) for _ in pred_lines]
-        elif line_type == 'text':
-            norm_gt_lines = [clean_string(textblock2unicode(_)) for _ in gt_lines]
-            norm_pred_lines = [clean_string(textblock2unicode(_)) for _ in pred_lines]
-        else:
-            norm_gt_lines = gt_lines
-            norm_pred_lines = pred_lines
+        norm_sources = list(gt_lines)
+        norm_kinds = [table_line_kinds.get(line_type)] * len(gt_lines)
         if line_type == 'latex_table':
             gt_lines = norm_html_lines
 
     else:
-        for item in pred_dataset_mix:
-            # text
-            if item['category_type'] == 'text_all':
-                pred_lines.append(str(item['content']))
-                norm_pred_lines.append(clean_string(textblock2unicode(str(item['content']))))
-            # formula
-            elif  item['category_type']=='equation_isolated':
-                pred_lines.append(str(item['content']))
-                norm_pred_lines.append(normalized_formula(str(item['content'])))
-            # circuit_diagram (SPICE netlist)
-            elif item['category_type'] == 'circuit_diagram':
-                pred_lines.append(str(item['content']))
-                norm_pred_lines.append(normalize_spice(str(item['content'])))
-            # table
-            else:
-                pred_lines.append(str(item['content']))
-                norm_pred_lines.append(str(item['content']))
-        
         for item in gt_mix:
             if item.get('content'):
                 gt_lines.append(str(item['content']))
                 if item['category_type'] == 'text_all':              
-                    norm_gt_lines.append(clean_string(textblock2unicode(str(item['content']))))
+                    norm_sources.append(str(item['content']))
+                    norm_kinds.append('text')
                 else:
-                   norm_gt_lines.append(item['content'])
+                    norm_sources.append(item['content'])
+                    norm_kinds.append(None)
                 
                 norm_html_lines.append(str(item['content']))
-
-                if item.get('fine_category_type'):
-                    gt_cat_list.append(item['fine_category_type'])
-                else:
-                    gt_cat_list.append(item['category_type'])
+                gt_cat_list.append(get_category(item))
             # text      
-            elif item['category_type'] in ['text_block', 'title', 'code_txt', 'code_txt_caption', 'reference', 'equation_caption','figure_caption', 'figure_footnote', 'table_caption', 'table_footnote', 'code_algorithm', 'code_algorithm_caption','header', 'footer', 'page_footnote', 'page_number', 'circuit_caption', 'circuit_footnote']:
+            elif item['category_type'] in gt_text_categories:
                 gt_lines.append(str(item['text']))
-                norm_gt_lines.append(clean_string(textblock2unicode(str(item['text']))))
-
-                if item.get('fine_category_type'):
-                    gt_cat_list.append(item['fine_category_type'])
-                else:
-                    gt_cat_list.append(item['category_type'])
+                norm_sources.append(str(item['text']))
+                norm_kinds.append('text')
+                gt_cat_list.append(get_category(item))
 
             # circuit_diagram - can have either 'text' or 'spice' field
             elif item['category_type'] == 'circuit_diagram':
                 # Prefer 'text' field if available, otherwise use 'spice' field
                 circuit_content = item.get('text', item.get('spice', ''))
                 gt_lines.append(str(circuit_content))
+                norm_sources.append(str(circuit_content))
                 # Use normalize_spice for SPICE content, or textblock2unicode for text content
                 if 'spice' in item and not item.get('text'):
-                    norm_gt_lines.append(normalize_spice(str(circuit_content)))
+                    norm_kinds.append('spice')
                 else:
-                    norm_gt_lines.append(clean_string(textblock2unicode(str(circuit_content))))
-
-                if item.get('fine_category_type'):
-                    gt_cat_list.append(item['fine_category_type'])
-                else:
-                    gt_cat_list.append(item['category_type'])
+                    norm_kinds.append('text')
+                gt_cat_list.append(get_category(item))
 
             # formula
             elif item['category_type'] == 'equation_isolated':
                 gt_lines.append(str(item['latex']))
-                norm_gt_lines.append(normalized_formula(str(item['latex'])))
-
-                if item.get('fine_category_type'):
-                    gt_cat_list.append(item['fine_category_type'])
-                else:
-                    gt_cat_list.append(item['category_type'])
+                norm_sources.append(str(item['latex']))
+                norm_kinds.append('formula')
+                gt_cat_list.append(get_category(item))
             # table
             # elif item['category_type'] == 'table':
             #     gt_lines.append(str(item['html']))
@@ -148,7 +206,10 @@ def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
             #     else:
             #         gt_cat_list.append(item['category_type'])
 
+    return gt_lines, norm_sources, norm_kinds, gt_cat_list
+
 
+def filter_gt_lines(gt_lines, norm_gt_lines, gt_cat_list):
     filtered_lists = [(a, b, c) for a, b, c in zip(gt_lines, norm_gt_lines, gt_cat_list) if a and b]
 
     # decompress to three lists
@@ -164,6 +225,32 @@ def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
         norm_gt_lines_c = []
         gt_cat_list_c = []
 
+    return gt_lines_c, norm_gt_lines_c, gt_cat_list_c
+
+
+# Pred side of get_gt_pred_lines
+def get_pred_lines(pred_dataset_mix, line_type):
+    pred_lines, norm_sources, norm_kinds = collect_pred_lines(pred_dataset_mix, line_type)
+    return filter_pred_lines(pred_lines, normalize_lines(norm_sources, norm_kinds))
+
+
+# Line kind of pred items, by category_type; other categories (tables) are kept as is
+pred_line_kinds = {
+    'text_all': 'text',
+    'equation_isolated': 'formula',
+    'circuit_diagram': 'spice',
+}
+
+def collect_pred_lines(pred_dataset_mix, line_type):
+    pred_lines = [str(item['content']) for item in pred_dataset_mix]
+    if line_type in ['html_table','latex_table']:
+        norm_kinds = [table_line_kinds.get(line_type)] * len(pred_lines)
+    else:
+        norm_kinds = [pred_line_kinds.get(item['category_type']) for item in pred_dataset_mix]
+    return pred_lines, list(pred_lines), norm_kinds
+
+
+def filter_pred_lines(pred_lines, norm_pred_lines):
     # pred's empty values
     filtered_lists = [(a, b) for a, b in zip(pred_lines, norm_pred_lines) if a and b]
 
@@ -178,11 +265,12 @@ def get_gt_pred_lines(gt_mix,pred_dataset_mix,line_type):
         pred_lines_c = []
         norm_pred_lines_c = []
 
-    return gt_lines_c, norm_gt_lines_c, gt_cat_list_c, pred_lines_c, norm_pred_lines_c, gt_mix, pred_dataset_mix
-
+    return pred_lines_c, norm_pred_lines_c
 
-def match_gt2pred_simple(gt_items, pred_items, line_type, img_name):
 
+def match_gt2pred_simple(gt_items, pred_items, line_type, img_name, budget=None):
+    # budget: optional MatchBudget, checked after line extraction and after the cost matrix; once exhausted, the cost matrix
+    # only scores q-gram candidate pairs (compute_candidate_edit_distance_matrix) instead of all pairs
     gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines, gt_items, pred_items = get_gt_pred_lines(gt_items, pred_items,line_type)
     match_list = []
 
@@ -223,7 +311,11 @@ def match_gt2pred_simple(gt_items, pred_items, line_type, img_name):
             })
         return match_list,None
     
-    cost_matrix = compute_edit_distance_matrix_new(norm_gt_lines, norm_pred_lines)
+    sparse_candidates = {} if budget and budget.exhausted('line extraction') else None
+    cost_matrix = compute_edit_distance_matrix_new(norm_gt_lines, norm_pred_lines, sparse_candidates=sparse_candidates)
+    if budget:
+        budget.spend(len(norm_gt_lines) * len(norm_pred_lines))
+        budget.exhausted('cost matrix')
 
     row_ind, col_ind = linear_sum_assignment(cost_matrix)
 
@@ -292,9 +384,12 @@ def match_gt2pred_simple(gt_items, pred_items, line_type, img_name):
     return match_list,None
 
 
-def match_gt2pred_no_split(gt_items, pred_items, line_type, img_name):
+def match_gt2pred_no_split(gt_items, pred_items, line_type, img_name, budget=None):
     # directly concatenate gt and pred by position
-    gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines = get_gt_pred_lines(gt_items, pred_items)
+    # budget: optional MatchBudget; there is no matching stage to cut short, so an exhausted budget is only recorded
+    gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines, gt_items, pred_items = get_gt_pred_lines(gt_items, pred_items, line_type)
+    if budget:
+        budget.exhausted('line extraction')
     gt_line_with_position = []
     for gt_line, norm_gt_line, gt_item in zip(gt_lines, norm_gt_lines, gt_items):
         gt_position = gt_item['order'] if gt_item.get('order') else gt_item.get('position', [""])[0]
@@ -0,0 +1,28 @@
+import time
+
+
+class MatchBudget():
+    '''
+    Time and/or operation budget for matching one page.
+    Matchers call spend() in their expensive loops and skip the remaining refinement once exhausted() is True,
+    returning the best assignment found so far. The datasets and quick_match also check it between stages (extraction, cost matrix);
+    a running stage is not interrupted. The first exhausting stage is kept in reason.
+    '''
+    def __init__(self, time_limit=None, max_ops=None):
+        self.time_limit = time_limit
+        self.max_ops = max_ops
+        self.start_time = time.time()
+        self.ops = 0
+        self.reason = None
+
+    def spend(self, ops=1):
+        self.ops += ops
+
+    def exhausted(self, stage):
+        if self.reason:
+            return True
+        if self.time_limit is not None and time.time() - self.start_time > self.time_limit:
+            self.reason = f'time budget of {self.time_limit}s exhausted in {stage}'
+        elif self.max_ops is not None and self.ops > self.max_ops:
+            self.reason = f'operation budget of {self.max_ops} exhausted in {stage}'
+        return self.reason is not None
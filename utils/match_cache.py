@@ -0,0 +1,39 @@
+import hashlib
+import json
+
+from utils.disk_cache import DiskCache, content_key
+
+# Bump this whenever extraction, normalization or matching logic changes the per-page match results,
+# so that stale cache entries are not reused.
+MATCHER_VERSION = '6'
+
+
+def gt_page_digest(gt_page):
+    # sha256 of a GT page: markdown text, or a json page dumped with sorted keys
+    if isinstance(gt_page, str):
+        gt_bytes = gt_page.encode('utf-8')
+    else:
+        gt_bytes = json.dumps(gt_page, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(gt_bytes).hexdigest()
+
+
+class MatchCache(DiskCache):
+    '''
+    On-disk cache of per-page match results, keyed by the content of the page inputs:
+    page name, GT page (json or markdown), prediction markdown, match_method, match options and MATCHER_VERSION.
+    The page name is part of the key because the cached results carry it (img_id), so identical pages never share an entry.
+    namespace separates datasets whose per-page results differ in layout (e.g. end2end and md2md).
+    '''
+    def __init__(self, cache_dir, match_method, namespace='', match_options=None):
+        super().__init__(cache_dir, 'pickle', name='match cache')
+        self.match_method = match_method
+        self.namespace = namespace
+        self.match_options = json.dumps(match_options or {}, sort_keys=True)
+
+    def page_key(self, img_name, gt_digest, pred_content):
+        # gt_digest: gt_page_digest() of the GT page
+        return content_key(MATCHER_VERSION, self.namespace, self.match_method, self.match_options, img_name, gt_digest, pred_content)
+
+    def report(self):
+        total = self.hits + self.misses
+        print(f'Match cache: {self.hits} hits, {self.misses} misses ({self.hits}/{total} pages reused) in {self.cache_dir}')
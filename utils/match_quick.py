@@ -1,9 +1,8 @@
 from scipy.optimize import linear_sum_assignment
 # from rapidfuzz.distance import Levenshtein
 import Levenshtein
-from collections import defaultdict
 import copy
-from utils.match import compute_edit_distance_matrix_new, get_gt_pred_lines, get_pred_category_type
+from utils.match import compute_edit_distance_matrix_new, get_gt_lines, get_pred_lines, get_pred_category_type
 import pdb
 import numpy as np
 import evaluate
@@ -262,9 +261,20 @@ def sort_by_position_skip_inline(items: List[Dict[str, Any]]) -> List[Dict[str,
             pair[0]                                                   # 原序号，确保稳定
         )
     )
-def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
-
+def prepare_gt_quick(gt_items):
+    # GT side of match_gt2pred_quick: (split gt items, gt lines, normalized gt lines, gt categories)
     gt_items = split_gt_equation_arrays(gt_items)
+    gt_lines, norm_gt_lines, gt_cat_list = get_gt_lines(gt_items, None)
+    return gt_items, gt_lines, norm_gt_lines, gt_cat_list
+
+def match_gt2pred_quick(gt_items, pred_items, line_type, img_name, sparse_candidates=None, budget=None, gt_prepared=None):
+    # budget: optional MatchBudget, checked after the cost matrix and inside truncation merging / fuzzy matching; once exhausted,
+    # those refinements stop and the best assignment so far is returned
+    # gt_prepared: output of prepare_gt_quick(gt_items), e.g. from a precompiled GT artifact; gt_items is then not used
+
+    if gt_prepared is None:
+        gt_prepared = prepare_gt_quick(gt_items)
+    gt_items, gt_lines, norm_gt_lines, gt_cat_list = gt_prepared
     
     # pred_items = sorted(pred_items, key=lambda x: x['position'][0])
     pred_items = [pair[1] for pair in sort_by_position_skip_inline(pred_items)]
@@ -272,7 +282,7 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
     pred_items = split_equation_arrays(pred_items)
 
     # gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines= get_gt_pred_lines(gt_items, pred_items, line_type)
-    gt_lines, norm_gt_lines, gt_cat_list, pred_lines, norm_pred_lines, gt_items, pred_items = get_gt_pred_lines(gt_items, pred_items, None)
+    pred_lines, norm_pred_lines = get_pred_lines(pred_items, None)
     all_gt_indices = set(range(len(norm_gt_lines)))  
     all_pred_indices = set(range(len(norm_pred_lines)))  
     
@@ -317,7 +327,7 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
     elif len(norm_gt_lines) == 1 and len(norm_pred_lines) == 1:
         edit_distance = Levenshtein_distance(norm_gt_lines[0], norm_pred_lines[0])
         normalized_edit_distance = edit_distance / max(len(norm_gt_lines[0]), len(norm_pred_lines[0]))
-        return [{
+        return [record_edit_distance({
             'gt_idx': [0],
             'gt': gt_lines[0],
             'pred_idx': [0],
@@ -331,12 +341,13 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
             'gt_attribute': [gt_items[0].get("attribute", {})],
             'edit': normalized_edit_distance,
             'img_id': img_name
-        }]
+        }, {(norm_gt_lines[0], norm_pred_lines[0]): edit_distance})]
     
     # match category ignore first
     ignores = ['figure_caption', 'figure_footnote', 'table_caption', 'table_footnote', 'code_algorithm', 
                'code_algorithm_caption', 'header', 'footer', 'page_footnote', 'page_number', 'equation_caption', 'circuit_caption', 'circuit_footnote']
     
+    pair_distances = {}   # (norm gt, norm pred) -> Levenshtein distance computed while matching
     ignore_gt_lines = []
     ignores_ori_gt_lines= []
     ignores_gt_items = []
@@ -378,11 +389,16 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
 
     merged_ignore_results = []
 
+    # One page-level cost matrix; the ignore and main phases use slices of it
+    page_cost_matrix = compute_edit_distance_matrix_new(norm_gt_lines, norm_pred_lines, sparse_candidates=sparse_candidates)
+    if budget:
+        budget.exhausted('cost matrix')   # stages are not interrupted; a budget spent here skips the refinement below
+
     if len(ignore_gt_lines) > 0:
         
         ignore_matches_dict = {}
 
-        ignore_matrix = compute_edit_distance_matrix_new(ignore_gt_lines, norm_pred_lines)
+        ignore_matrix = page_cost_matrix[ignore_gt_idxs]
         # print("-------------ignore_matrix-------------")
         # print(ignore_matrix)
         
@@ -423,7 +439,7 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
         # print("-------------ignore_final_matches-------------")
         # print(ignore_final_matches)
         
-        recalculate_edit_distances(ignore_final_matches, {}, ignore_gt_lines, ignore_pred_lines)
+        recalculate_edit_distances(ignore_final_matches, {}, ignore_gt_lines, ignore_pred_lines, pair_distances)
         # print("-------------recalculate_ignore_final_matches-------------")
         # print(ignore_final_matches)
 
@@ -495,11 +511,11 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
     no_ignores_pred_indices = set(range(len(no_ignores_pred_lines)))  
     
     # exclude ignore categories
-    cost_matrix = compute_edit_distance_matrix_new(no_ignores_gt_lines, no_ignores_pred_lines)
+    cost_matrix = page_cost_matrix[np.ix_(np.array(no_ignores_gt_idxs, dtype=int), np.array(no_ignore_pred_idxs, dtype=int))]
     # print("-------------cost matrix-------------")
     # print(cost_matrix)
 
-    matched_col_idx, row_ind, cost_list = cal_final_match(cost_matrix, no_ignores_gt_lines, no_ignores_pred_lines)
+    matched_col_idx, row_ind, cost_list = cal_final_match(cost_matrix, no_ignores_gt_lines, no_ignores_pred_lines, sparse_candidates, budget)
     # print("-------------matched_col_idx-------------")
     # print(matched_col_idx)
     
@@ -527,7 +543,7 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
     # print("-------------unmatched_pred_indices-------------")
     # print(unmatched_pred_indices)
     
-    matching_dict = fuzzy_match_unmatched_items(unmatched_gt_indices, no_ignores_gt_lines, no_ignores_pred_lines)
+    matching_dict = fuzzy_match_unmatched_items(unmatched_gt_indices, no_ignores_gt_lines, no_ignores_pred_lines, budget)
     # print("-------------matching_dict-------------")
     # print(matching_dict)
     
@@ -535,7 +551,7 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
     # print("-------------final_matches-------------")
     # print(final_matches)
 
-    recalculate_edit_distances(final_matches, gt_lens_dict, no_ignores_gt_lines, no_ignores_pred_lines)
+    recalculate_edit_distances(final_matches, gt_lens_dict, no_ignores_gt_lines, no_ignores_pred_lines, pair_distances)
     # print("-------------recalculate_edit_distances-------------")
     # print(final_matches)
     
@@ -612,6 +628,8 @@ def match_gt2pred_quick(gt_items, pred_items, line_type, img_name):
         # for i in merged_ignore_results:
         #     merged_results.append(i)
 
+    for entry in merged_results:
+        record_edit_distance(entry, pair_distances)
     return merged_results
 
     # cost_matrix = compute_edit_distance_matrix_new(norm_gt_lines, norm_pred_lines)
@@ -722,116 +740,108 @@ def merge_lists_with_sublists(main_list, sub_lists):
     return main_list_final   
 
 
+def min_window_distance(text, pattern):
+    """
+    Minimum Levenshtein distance between pattern and every substring of text with the same length as pattern.
+    Returns (distance, first offset reaching it), the same as scanning every offset from left to right.
+    Neighbouring windows differ by one deleted and one appended char, so their distances differ by at most 2:
+    after a window at distance d, the next (d - best) // 2 windows cannot beat best and are skipped.
+    """
+    pattern_len = len(pattern)
+    window_num = len(text) - pattern_len + 1
+    min_dist, pos = pattern_len + 1, -1
+    i = 0
+    while i < window_num:
+        dist = Levenshtein_distance(text[i:i + pattern_len], pattern)
+        if dist < min_dist:
+            min_dist, pos = dist, i
+            if min_dist == 0:
+                break
+        i += (dist - min_dist) // 2 + 1
+    return min_dist, pos
+
 def sub_pred_fuzzy_matching(gt, pred):
     
-    min_d = float('inf')
-    # pos = -1
-
     gt_len = len(gt)
     pred_len = len(pred)
 
     if gt_len >= pred_len and pred_len > 0:
-        for i in range(gt_len - pred_len + 1):
-            sub = gt[i:i + pred_len]
-            dist = Levenshtein_distance(sub, pred)/pred_len
-            if dist < min_d:
-                min_d = dist
-                pos = i
-
-        return min_d
+        min_dist, pos = min_window_distance(gt, pred)
+        return min_dist / pred_len
     else:
         return False
         
 def sub_gt_fuzzy_matching(pred, gt):  
     
-    min_d = float('inf')  
-    pos = ""  
-    matched_sub = ""  
     gt_len = len(gt)  
     pred_len = len(pred)  
     
     if pred_len >= gt_len and gt_len > 0:  
-        for i in range(pred_len - gt_len + 1):  
-            sub = pred[i:i + gt_len]  
-            dist = Levenshtein.distance(sub, gt)  /gt_len
-            if dist < min_d:  
-                min_d = dist  
-                pos = i  
-                matched_sub = sub  
-        return min_d, pos, gt_len, matched_sub  
+        min_dist, pos = min_window_distance(pred, gt)
+        return min_dist / gt_len, pos, gt_len, pred[pos:pos + gt_len]
     else:  
         return 1, "", gt_len, "" 
         
         
 def get_final_subset(subset_certain, subset_certain_cost):
+    # Each subset is a run of consecutive pred indices, so overlaps are checked on (start, end) intervals:
+    # in start order, a subset overlaps a set of earlier subsets iff its start <= their max end.
     if not subset_certain or not subset_certain_cost:
         return []  
 
     subset_turple = sorted([(a, b) for a, b in zip(subset_certain, subset_certain_cost)], key=lambda x: x[0][0])
 
-    group_list = defaultdict(list)
-    group_idx = 0
-    group_list[group_idx].append(subset_turple[0])
-
+    group_list = [[subset_turple[0]]]
+    group_end = subset_turple[0][0][-1]
     for item in subset_turple[1:]:
-        overlap_flag = False
-        for subset in group_list[group_idx]:
-            for idx in item[0]:
-                if idx in subset[0]:
-                    overlap_flag = True
-                    break
-            if overlap_flag:
-                break
-        if overlap_flag:
-            group_list[group_idx].append(item)
+        if item[0][0] <= group_end:
+            group_list[-1].append(item)
+            group_end = max(group_end, item[0][-1])
         else:
-            group_idx += 1
-            group_list[group_idx].append(item)
+            group_list.append([item])
+            group_end = item[0][-1]
 
     final_subset = []
-    for _, group in group_list.items():
+    for group in group_list:
         if len(group) == 1: 
             final_subset.append(group[0][0])
-        else:
-            path_dict = defaultdict(list)
-            path_idx = 0
-            path_dict[path_idx].append(group[0])
-            
-            for subset in group[1:]:
-                new_path = True
-                for path_idx_s, path_items in path_dict.items():
-                    is_dup = False
-                    is_same = False
-                    for path_item in path_items:
-                        if path_item[0] == subset[0]:
-                            is_dup = True
-                            is_same = True
-                            if path_item[1] > subset[1]:
-                                path_dict[path_idx_s].pop(path_dict[path_idx_s].index(path_item))
-                                path_dict[path_idx_s].append(subset)
-                        else:
-                            for num_1 in path_item[0]:
-                                for num_2 in subset[0]:
-                                    if num_1 == num_2:
-                                        is_dup = True
-                    if not is_dup:
-                        path_dict[path_idx_s].append(subset)
-                        new_path = False
-                    if is_same:
-                        new_path = False
-                if new_path:
-                    path_idx = len(path_dict.keys())
-                    path_dict[path_idx].append(subset)
-
-            saved_cost = float('inf')
-            saved_subset = []  
-            for path_idx, path in path_dict.items():
-                avg_cost = sum([i[1] for i in path]) / len(path)
-                if avg_cost < saved_cost:
-                    saved_subset = [i[0] for i in path]
-                    saved_cost = avg_cost
-
-            final_subset.extend(saved_subset)
+            continue
+
+        # Paths of non-overlapping subsets: a subset joins every path it doesn't overlap, replaces an identical
+        # subset with a higher cost, and starts a new path if it overlaps all paths without being in any of them
+        paths = [[group[0]]]
+        path_ends = [group[0][0][-1]]
+        path_items = [{tuple(group[0][0]): group[0]}]
+        for subset in group[1:]:
+            key = tuple(subset[0])
+            new_path = True
+            for path_idx, path in enumerate(paths):
+                same_item = path_items[path_idx].get(key)
+                if same_item is not None:
+                    if same_item[1] > subset[1]:
+                        path.pop(path.index(same_item))
+                        path.append(subset)
+                        path_items[path_idx][key] = subset
+                    new_path = False
+                elif subset[0][0] > path_ends[path_idx]:
+                    path.append(subset)
+                    path_ends[path_idx] = subset[0][-1]
+                    path_items[path_idx][key] = subset
+                    new_path = False
+            if new_path:
+                paths.append([subset])
+                path_ends.append(subset[0][-1])
+                path_items.append({key: subset})
+
+        saved_cost = float('inf')
+        saved_subset = []  
+        for path in paths:
+            avg_cost = sum([i[1] for i in path]) / len(path)
+            if avg_cost < saved_cost:
+                saved_subset = [i[0] for i in path]
+                saved_cost = avg_cost
+
+        final_subset.extend(saved_subset)
 
     return final_subset
 
@@ -861,11 +871,58 @@ def judge_pred_merge(gt_list, pred_list, threshold=0.6):
 
     return merged_pred_flag, continue_flag
     
-def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
+class PredMergeJudge():
+    """
+    judge_pred_merge for one GT line while deal_with_truncated grows runs of consecutive pred lines.
+    The distance of a joined run and the fuzzy distance of each pred line are computed once and reused:
+    the previous step's merged run is the next step's current run, and runs from different start lines share pieces.
+    """
+    def __init__(self, gt, norm_pred_lines, threshold=0.6):
+        self.gt = gt
+        self.norm_pred_lines = norm_pred_lines
+        self.threshold = threshold
+        self.run_dists = {}
+        self.fuzzy_dists = {}
+
+    def run_dist(self, start, end):
+        # Normalized distance between the GT and ' '.join(norm_pred_lines[start:end])
+        if (start, end) not in self.run_dists:
+            run = ' '.join(self.norm_pred_lines[start:end])
+            self.run_dists[(start, end)] = Levenshtein.distance(self.gt, run) / max(len(self.gt), len(run))
+        return self.run_dists[(start, end)]
+
+    def fuzzy_dist(self, idx):
+        if idx not in self.fuzzy_dists:
+            self.fuzzy_dists[idx] = sub_pred_fuzzy_matching(self.gt, self.norm_pred_lines[idx])
+        return self.fuzzy_dists[idx]
+
+    def judge(self, start, end):
+        # Same as judge_pred_merge([gt], norm_pred_lines[start:end])
+        if end - start == 1:
+            return False, False
+
+        if self.run_dist(start, end) > self.run_dist(start, end - 1):
+            return False, False
+
+        for idx in range(start, end - 1):
+            dist = self.fuzzy_dist(idx)
+            if dist is False or dist > self.threshold:
+                return False, False
+
+        add_fuzzy_dist = self.fuzzy_dist(end - 1)
+        if add_fuzzy_dist is False:
+            return False, False
+
+        merged_pred_flag = add_fuzzy_dist < self.threshold
+        continue_flag = sum(len(line) for line in self.norm_pred_lines[start:end]) + end - start - 1 <= len(self.gt)
+
+        return merged_pred_flag, continue_flag
+
+def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines, sparse_candidates=None, budget=None):
     matched_first = np.argwhere(cost_matrix < 0.25)
-    masked_gt_idx = [i[0] for i in matched_first]
+    masked_gt_idx = set(int(i[0]) for i in matched_first)
     unmasked_gt_idx = [i for i in range(cost_matrix.shape[0]) if i not in masked_gt_idx]
-    masked_pred_idx = [i[1] for i in matched_first]
+    masked_pred_idx = set(int(i[1]) for i in matched_first)
     unmasked_pred_idx = [i for i in range(cost_matrix.shape[1]) if i not in masked_pred_idx]
 
     merges_gt_dict = {}
@@ -873,19 +930,24 @@ def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
     merged_gt_subsets = []
 
     for gt_idx in unmasked_gt_idx:
+        if budget and budget.exhausted('truncation merging'):
+            break
         check_merge_subset = []
         merged_dist = []
+        merge_judge = PredMergeJudge(norm_gt_lines[gt_idx], norm_pred_lines)
 
         for pred_idx in unmasked_pred_idx: 
+            if budget and budget.exhausted('truncation merging'):
+                break
             step = 1
-            merged_pred = [norm_pred_lines[pred_idx]]
 
             while True:
                 if pred_idx + step in masked_pred_idx or pred_idx + step >= len(norm_pred_lines):
                     break
                 else:
-                    merged_pred.append(norm_pred_lines[pred_idx + step])
-                    merged_pred_flag, continue_flag = judge_pred_merge([norm_gt_lines[gt_idx]], merged_pred) 
+                    merged_pred_flag, continue_flag = merge_judge.judge(pred_idx, pred_idx + step + 1)
+                    if budget:
+                        budget.spend()
                     if not merged_pred_flag:
                         break
                     else:
@@ -894,9 +956,7 @@ def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
                         break
 
             check_merge_subset.append(list(range(pred_idx, pred_idx + step)))
-            matched_line = ' '.join([norm_pred_lines[i] for i in range(pred_idx, pred_idx + step)])
-            dist = Levenshtein_distance(norm_gt_lines[gt_idx], matched_line) / max(len(matched_line), len(norm_gt_lines[gt_idx]))
-            merged_dist.append(dist)
+            merged_dist.append(merge_judge.run_dist(pred_idx, pred_idx + step))
 
         if not merged_dist:
             subset_certain = []
@@ -915,8 +975,9 @@ def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
             'min_cost': min_cost
         }
 
-    subset_certain = [merges_gt_dict[gt_idx]['subset_certain'] for gt_idx in unmasked_gt_idx if merges_gt_dict[gt_idx]['subset_certain']]
-    subset_certain_cost = [merges_gt_dict[gt_idx]['min_cost'] for gt_idx in unmasked_gt_idx if merges_gt_dict[gt_idx]['subset_certain']]
+    # Only GT lines handled before the budget ran out (all of them without a budget)
+    subset_certain = [merges_gt_dict[gt_idx]['subset_certain'] for gt_idx in merges_gt_dict if merges_gt_dict[gt_idx]['subset_certain']]
+    subset_certain_cost = [merges_gt_dict[gt_idx]['min_cost'] for gt_idx in merges_gt_dict if merges_gt_dict[gt_idx]['subset_certain']]
 
     subset_certain_final = get_final_subset(subset_certain, subset_certain_cost)
 
@@ -926,7 +987,10 @@ def deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines):
     final_pred_idx_list = merge_lists_with_sublists(range(len(norm_pred_lines)), subset_certain_final)
     final_norm_pred_lines = [' '.join(norm_pred_lines[idx_list[0]:idx_list[-1]+1]) if isinstance(idx_list, list) else norm_pred_lines[idx_list] for idx_list in final_pred_idx_list]
 
-    new_cost_matrix = compute_edit_distance_matrix_new(norm_gt_lines, final_norm_pred_lines)
+    # Only the merged pred lines are new, the other columns are reused from cost_matrix
+    merged_cols = [i for i, idx_list in enumerate(final_pred_idx_list) if isinstance(idx_list, list)]
+    new_cost_matrix = cost_matrix[:, [idx_list if not isinstance(idx_list, list) else 0 for idx_list in final_pred_idx_list]]
+    new_cost_matrix[:, merged_cols] = compute_edit_distance_matrix_new(norm_gt_lines, [final_norm_pred_lines[i] for i in merged_cols], sparse_candidates=sparse_candidates)
 
     return new_cost_matrix, final_norm_pred_lines, final_pred_idx_list
     
@@ -939,10 +1003,10 @@ def cal_move_dist(gt, pred):
             pred[i], pred[pred.index(gt_c)] = pred[pred.index(gt_c)], pred[i]
     return step / len(gt)
 
-def cal_final_match(cost_matrix, norm_gt_lines, norm_pred_lines):
+def cal_final_match(cost_matrix, norm_gt_lines, norm_pred_lines, sparse_candidates=None, budget=None):
     # min_indice = cost_matrix.argmax(axis=1)
 
-    new_cost_matrix, final_norm_pred_lines, final_pred_idx_list = deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines)
+    new_cost_matrix, final_norm_pred_lines, final_pred_idx_list = deal_with_truncated(cost_matrix, norm_gt_lines, norm_pred_lines, sparse_candidates, budget)
 
     row_ind, col_ind = linear_sum_assignment(new_cost_matrix)
 
@@ -997,12 +1061,16 @@ def process_matches(matched_col_idx, row_ind, cost_list, norm_gt_lines, norm_pre
 
     return matches, unmatched_gt_indices, unmatched_pred_indices
 
-def fuzzy_match_unmatched_items(unmatched_gt_indices, norm_gt_lines, norm_pred_lines):
+def fuzzy_match_unmatched_items(unmatched_gt_indices, norm_gt_lines, norm_pred_lines, budget=None):
     matching_dict = {}
 
     for pred_idx, pred_content in enumerate(norm_pred_lines):
         if isinstance(pred_idx, list):
             continue
+        if budget:
+            if budget.exhausted('fuzzy matching'):
+                break
+            budget.spend(len(unmatched_gt_indices))
 
         matching_indices = []
 
@@ -1057,7 +1125,26 @@ def merge_matches(matches, matching_dict):
     
 
 
-def recalculate_edit_distances(final_matches, gt_lens_dict, norm_gt_lines, norm_pred_lines):
+def record_edit_distance(entry, pair_distances):
+    # Keep the raw distance and upper length of the final norm_gt / norm_pred for call_Edit_dist, if matching computed that exact pair.
+    # edit_pair ties Edit_num to that pair: call_Edit_dist reuses it only while norm_gt / norm_pred are unchanged.
+    # It holds the same string objects, so it costs no copy, and the comparison is an identity check until a string is replaced.
+    edit_num = pair_distances.get((entry['norm_gt'], entry['norm_pred']))
+    if edit_num is not None and entry['norm_gt'] and entry['norm_pred']:
+        entry['upper_len'] = max(len(entry['norm_gt']), len(entry['norm_pred']))
+        entry['Edit_num'] = edit_num
+        entry['edit_pair'] = (entry['norm_gt'], entry['norm_pred'])
+    return entry
+
+
+def drop_edit_distance(entry):
+    # For callers that change norm_gt / norm_pred after matching (the edit_pair check would also catch it)
+    entry.pop('upper_len', None)
+    entry.pop('Edit_num', None)
+    entry.pop('edit_pair', None)
+
+
+def recalculate_edit_distances(final_matches, gt_lens_dict, norm_gt_lines, norm_pred_lines, pair_distances=None):
     for pred_key, info in final_matches.items():
         gt_indices = sorted(set(info['gt_indices']))
 
@@ -1071,6 +1158,8 @@ def recalculate_edit_distances(final_matches, gt_lens_dict, norm_gt_lines, norm_
 
             try:
                 edit_distance = Levenshtein_distance(merged_gt_content, pred_content)
+                if pair_distances is not None:
+                    pair_distances[(merged_gt_content, pred_content)] = edit_distance
                 normalized_edit_distance = edit_distance / max(len(merged_gt_content), len(pred_content))
             except ZeroDivisionError:
                 normalized_edit_distance = 1
@@ -1082,6 +1171,8 @@ def recalculate_edit_distances(final_matches, gt_lens_dict, norm_gt_lines, norm_
 
             try:
                 edit_distance = Levenshtein_distance(norm_gt_lines[gt_idx], pred_content)
+                if pair_distances is not None:
+                    pair_distances[(norm_gt_lines[gt_idx], pred_content)] = edit_distance
                 normalized_edit_distance = edit_distance / max(len(norm_gt_lines[gt_idx]), len(pred_content))
             except ZeroDivisionError:
                 normalized_edit_distance = 1
@@ -0,0 +1,67 @@
+import re
+import zlib
+
+# HTML tables and LaTeX tabulars: sparse tables compress like a repetition loop, so they are never scanned
+TABLE_REG = re.compile(r'<table\b.*?</table\s*>|\\begin\{tabular\}.*?\\end\{tabular\}', re.S | re.I)
+
+
+class PredictionGuard():
+    '''
+    Truncation policy for degenerate predictions (e.g. a model stuck in a repetition loop), applied to the prediction
+    markdown of a page before extraction and matching:
+      1. Pages longer than min_chars are scanned in windows of window_size characters, skipping closed tables.
+         A window whose zlib compression ratio exceeds max_compression_ratio is repetitive. Each run of consecutive
+         repetitive windows is collapsed to its first window; the text around the run is kept.
+      2. What remains is cut to max_chars characters.
+    guard() returns the (possibly truncated) content and a record of what was cut, or None if the page was left as is.
+    The datasets mark truncated pages as degraded and keep the record in match_status.
+    '''
+    def __init__(self, max_chars=200000, max_compression_ratio=20, window_size=4096, min_chars=20000):
+        self.max_chars = max_chars
+        self.max_compression_ratio = max_compression_ratio
+        self.window_size = window_size
+        self.min_chars = min_chars
+
+    def options(self):
+        return {'max_chars': self.max_chars, 'max_compression_ratio': self.max_compression_ratio,
+                'window_size': self.window_size, 'min_chars': self.min_chars}
+
+    def find_repetitions(self, content):
+        # Returns [(start, end, ratio)] runs of consecutive repetitive windows, with the highest ratio of each run
+        if len(content) <= self.min_chars:
+            return []
+        runs = []
+        segment_start = 0
+        for table_start, table_end in [m.span() for m in TABLE_REG.finditer(content)] + [(len(content), len(content))]:
+            for start in range(segment_start, table_start - self.window_size + 1, self.window_size):
+                window = content[start:start+self.window_size].encode('utf-8')
+                ratio = len(window) / len(zlib.compress(window))
+                if ratio <= self.max_compression_ratio:
+                    continue
+                if runs and runs[-1][1] == start:
+                    runs[-1] = (runs[-1][0], start + self.window_size, max(runs[-1][2], ratio))
+                else:
+                    runs.append((start, start + self.window_size, ratio))
+            segment_start = table_end
+        return runs
+
+    def guard(self, content):
+        original_len = len(content)
+        rules = []
+        pieces = []
+        kept_from = 0
+        for start, end, ratio in self.find_repetitions(content):
+            if end - start <= self.window_size:
+                continue   # a single window is not a loop, nothing to collapse
+            pieces.append(content[kept_from:start+self.window_size])
+            kept_from = end
+            rules.append(f'repetition in chars {start}-{end} collapsed to its first {self.window_size} chars (compression ratio {ratio:.1f} > {self.max_compression_ratio})')
+        if pieces:
+            pieces.append(content[kept_from:])
+            content = ''.join(pieces)
+        if len(content) > self.max_chars:
+            content = content[:self.max_chars]
+            rules.append(f'size cap of {self.max_chars} chars')
+        if not rules:
+            return content, None
+        return content, {'original_chars': original_len, 'kept_chars': len(content), 'rules': rules}
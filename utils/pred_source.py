@@ -0,0 +1,68 @@
+import io
+import json
+import os
+import tarfile
+import zipfile
+from utils.read_files import read_md_file
+
+
+class PredictionSource():
+    '''
+    Prediction files indexed once by basename, so that looking up a page costs no filesystem calls.
+    Supports a directory of markdown files, a tar/zip archive of them, or a JSONL bundle
+    with one {"name": ..., "content": ...} object per line.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.index = {}    # name -> directory file path / archive member / content
+        if os.path.isdir(path):
+            self.kind = 'dir'
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        self.index[entry.name] = entry.path
+        elif path.endswith('.jsonl'):
+            self.kind = 'jsonl'
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        self.index[os.path.basename(item['name'])] = item['content']
+        elif zipfile.is_zipfile(path):
+            self.kind = 'zip'
+            self.archive = zipfile.ZipFile(path)
+            for name in self.archive.namelist():
+                if not name.endswith('/'):
+                    self.index[os.path.basename(name)] = name
+        elif tarfile.is_tarfile(path):
+            # Compressed tars can't be read randomly, so read all members in one pass
+            self.kind = 'tar'
+            with tarfile.open(path) as archive:
+                for member in archive:
+                    if member.isfile():
+                        self.index[os.path.basename(member.name)] = decode_text(archive.extractfile(member).read())
+        else:
+            raise ValueError(f'Unsupported prediction source: {path}. Expected a directory, .tar(.gz), .zip or .jsonl file.')
+        print(f'Indexed {len(self.index)} predictions from {path}')
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def find(self, candidate_names):
+        # Return the first candidate name present in the source, or None
+        for name in candidate_names:
+            if name in self.index:
+                return name
+        return None
+
+    def read(self, name):
+        if self.kind == 'dir':
+            return read_md_file(self.index[name])
+        elif self.kind == 'zip':
+            return decode_text(self.archive.read(self.index[name]))
+        return self.index[name]
+
+
+def decode_text(data):
+    # Same newline handling as reading a file in text mode
+    return io.TextIOWrapper(io.BytesIO(data), encoding='utf-8').read()
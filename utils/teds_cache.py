@@ -0,0 +1,24 @@
+import json
+
+from utils.disk_cache import DiskCache, content_key
+
+# Bump this whenever TEDS scoring (tree building, costs, normalization of the score) changes,
+# so that stale cache entries are not reused.
+TEDS_VERSION = '1'
+
+
+class TEDSCache(DiskCache):
+    '''
+    On-disk cache of TEDS and TEDS_structure_only scores of (pred, gt) table pairs, keyed by the normalized
+    pred and gt tables, the TEDS options and TEDS_VERSION. Both scores of a pair are kept in one json entry.
+    '''
+    def __init__(self, cache_dir, teds_options=None):
+        super().__init__(cache_dir, 'json', name='TEDS cache')
+        self.teds_options = json.dumps(teds_options or {}, sort_keys=True)
+
+    def pair_key(self, pred, gt):
+        return content_key(TEDS_VERSION, self.teds_options, pred, gt)
+
+    def report(self):
+        total = self.hits + self.misses
+        print(f'TEDS cache: {self.hits} hits, {self.misses} misses ({self.hits}/{total} tables reused) in {self.cache_dir}')